@@ -1,11 +1,22 @@
-import CHaMP_Survey_Data_Export_Tool
-import CHaMP_Survey_Data_Project_Export
 import time
 import os
-import glob
 import sys
 import traceback
-import sqlite3
+import multiprocessing
+import Queue
+import socket
+import visit_index
+import visit_filter
+import export_log
+import stage_timer
+import export_plan
+import work_queue
+import process_supervisor
+import visit_fingerprint
+import file_placement
+import project_archive
+import point_columns
+import CHaMP_Data
 
 
 def run(args):
@@ -16,130 +27,401 @@ def run(args):
     printer("Start of Batch Process for CHaMP Data Export Tool ", args.outLogFile)
     printer(str(time.asctime()), args.outLogFile)
 
-    yearsFilter = args.years.split(",") if args.years is not None else None
-    sitesFilter = args.sites.split(",") if args.sites is not None else None
-    watershedsFilter = args.watersheds.split(",") if args.watersheds is not None else None
-    visitsFilter = args.visits.split(",") if args.visits is not None else None
-
-    conn_log = sqlite3.connect(os.path.join(path_output, "export_log.db"))
-    cursor = conn_log.cursor()
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-    if not any("SurveyExports" in tablename for tablename in cursor.fetchall()):
-        conn_log.execute('''CREATE TABLE SurveyExports (timestamp text, 
-                                                        year text, 
-                                                        watershed text, 
-                                                        site text, 
-                                                        visit text, 
-                                                        status text,
-                                                        message text)''')
-        conn_log.commit()
-
-    # Loop through source directory
-    for year in [item for item in os.listdir(args.path_input) if os.path.isdir(os.path.join(args.path_input, item))]:
-        if yearsFilter is None or year in yearsFilter:
-            path_year = os.path.join(args.path_input, year)
-            for watershed in [item for item in os.listdir(path_year) if os.path.isdir(os.path.join(path_year, item))]:
-                if watershedsFilter is None or watershed in watershedsFilter:
-                    path_watershed = os.path.join(path_year, watershed)
-                    for site in [item for item in os.listdir(path_watershed) if os.path.isdir(os.path.join(path_watershed, item))]:
-                        if sitesFilter is None or site in sitesFilter:
-                            path_site = os.path.join(path_watershed, site)
-                            for visit in [item for item in os.listdir(path_site) if os.path.isdir(os.path.join(path_site, item))]:
-                                visit_id = visit.lstrip("VISIT_")
-                                if visitsFilter is None or visit_id in visitsFilter:
-                                    #Gather Datasets
-                                    path_topo = os.path.join(path_site, visit, "Topo")
-                                    datasets = {}
-                                    opt_datasets = {}
-                                    inst_datasets = {}
-                                    datasets["SurveyGDB"] = glob.glob(os.path.join(path_topo, "*.gdb"))
-                                    datasets["TopoTIN"] = glob.glob(os.path.join(path_topo, "tin*"))
-                                    datasets["WSETIN"] = glob.glob(os.path.join(path_topo, "wsetin*"))
-                                    inst_datasets["InstrumentFiles_JOB"] = glob.glob(os.path.join(path_topo, "*.job")) + \
-                                                                          glob.glob(os.path.join(path_topo, "*/*.job"))
-                                    inst_datasets["InstrumentFiles_MJF"] = glob.glob(os.path.join(path_topo, "*.mjf")) + \
-                                                                          glob.glob(os.path.join(path_topo, "*/*.mjf"))
-                                    opt_datasets["InstrumentFiles_RAW"] = glob.glob(os.path.join(path_topo, "*.raw")) + \
-                                                                      glob.glob(os.path.join(path_topo, "*/*.raw"))
-                                    datasets["ChannelUnitCSV"] = glob.glob(os.path.join(path_topo, "ChannelUnits.csv"))
-                                    opt_datasets["DXF_File"] = glob.glob(os.path.join(path_topo, "*.dxf")) + \
-                                                           glob.glob(os.path.join(path_topo, "*/*.dxf")) + \
-                                                           glob.glob(os.path.join(path_topo, "*.shp")) + \
-                                                           glob.glob(os.path.join(path_topo, "*/*.shp"))
-                                    opt_datasets["InstrumentFiles_JOBorMJF"] = inst_datasets["InstrumentFiles_MJF"] + \
-                                                                               inst_datasets["InstrumentFiles_JOB"]
-                                    try:
-                                        if all(len(item) == 1 for item in datasets.itervalues()) and len(opt_datasets["InstrumentFiles_RAW"]) == 1:
-                                            path_output_visit = os.path.join(path_topo, args.output_folder_name) if path_output is None \
-                                                                    else os.path.join(path_output, year, watershed, site,
-                                                                    str(visit), "Topo", args.out_folder_name)
-                                            if not os.path.isdir(path_output_visit):
-                                                os.makedirs(path_output_visit)
-                                            printer("   {}: START".format(site), args.outLogFile)
-                                            if args.project: # TODO add overwrite protection?
-                                                raw_instrument_file = None
-                                                aux_instrument_file = None
-                                                if len(inst_datasets["InstrumentFiles_JOB"]) == 1:
-                                                    raw_instrument_file = opt_datasets["InstrumentFiles_RAW"][0] if len(opt_datasets["InstrumentFiles_RAW"]) == 1 else None
-                                                    aux_instrument_file = inst_datasets["InstrumentFiles_JOB"][0]
-                                                elif len(inst_datasets["InstrumentFiles_MJF"]) == 1:
-                                                    raw_instrument_file = inst_datasets["InstrumentFiles_MJF"][0]
-                                                    aux_instrument_file = opt_datasets["InstrumentFiles_RAW"][0] if len(opt_datasets["InstrumentFiles_RAW"]) == 1 else None
-                                                dxf_file = opt_datasets["DXF_File"][0] if len(opt_datasets["DXF_File"]) == 1 else None
-                                                map_images_folder = os.path.join(path_topo, "MapImages") if os.path.exists(os.path.join(path_topo, "MapImages")) else None
-
-                                                CHaMP_Survey_Data_Project_Export.export_survey_project(datasets["SurveyGDB"][0],
-                                                                                                       datasets["TopoTIN"][0],
-                                                                                                       datasets["WSETIN"][0],
-                                                                                                       datasets["ChannelUnitCSV"][0],
-                                                                                                       path_output_visit,
-                                                                                                       visit_id,
-                                                                                                       site,
-                                                                                                       watershed,
-                                                                                                       year,
-                                                                                                       raw_instrument_file,
-                                                                                                       aux_instrument_file,
-                                                                                                       dxf_file,
-                                                                                                       map_images_folder)
-                                                message = "Survey exported as Riverscapes Project. Optional Datasets Missing or Extra {}".format([key for key, value in opt_datasets.iteritems() if len(value) != 1]) if any(len(value) != 1 for value in opt_datasets.itervalues()) else "Survey exported as Riverscapes Project."
-                                                row = (str(time.asctime()), year, watershed, site, str(visit_id), "Success", message)
-                                                cursor.execute("INSERT INTO SurveyExports VALUES (?,?,?,?,?,?,?)", row)
-                                                conn_log.commit()
-                                                printer("   " + site + ": COMPLETE", args.outLogFile)
-                                            elif len(datasets["SurveyGDB"]) == 0:
-                                                CHaMP_Survey_Data_Export_Tool.main(datasets["SurveyGDB"][0], path_output_visit)
-                                                row = (str(time.asctime()), year, watershed, site, str(visit_id), "Success", "Survey exported.")
-                                                cursor.execute("INSERT INTO SurveyExports VALUES (?,?,?,?,?,?,?)", row)
-                                                conn_log.commit()
-                                                printer("   " + site + ": COMPLETE", args.outLogFile)
-                                        else:
-                                            printer("   {}: ERROR, does not have correct input data requirements".format(site),
-                                                    args.outLogFile)
-                                            missing_datsets = [key for key, value in datasets.iteritems() if len(value) != 1]
-                                            row = (str(time.asctime()), year, watershed, site, str(visit_id), "Error", "Incomplete Visit Data: " + str(missing_datsets))
-                                            cursor.execute("INSERT INTO SurveyExports VALUES (?,?,?,?,?,?,?)", row)
-                                            conn_log.commit()
-                                    except:
-                                        printer("   {}: EXCEPTION".format(site), args.outLogFile)
-                                        tb = sys.exc_info()[2]
-                                        tb_info = traceback.format_tb(tb)[0]
-                                        printer("{0} \n {1}: {2}".format(tb_info, sys.exc_type, sys.exc_value),
-                                                args.outLogFile)
-                                        traceback.print_exc(file=sys.stdout)
-                                        row = (str(time.asctime()), year, watershed, site, str(visit_id), "Exception",
-                                               traceback.format_exc())
-                                        cursor.execute("INSERT INTO SurveyExports VALUES (?,?,?,?,?,?,?)", row)
-                                        conn_log.commit()
-                                else:
-                                    printer("   Visit " + str(visit_id) + " not run due to filter.", args.outLogFile)
-                                    row = (str(time.asctime()), year, watershed, site, str(visit_id), "Warning", "Not exported due to filter.")
-                                    cursor.execute("INSERT INTO SurveyExports VALUES (?,?,?,?,?,?,?)", row)
-                                    conn_log.commit()
+    filters = visit_filter.VisitFilter(visit_filter.level_filter(args.years),
+                                       visit_filter.level_filter(args.watersheds),
+                                       visit_filter.level_filter(args.sites),
+                                       visit_filter.level_filter(args.visits, args.visits_file))
+
+    # In queue mode every node keeps its own log, so each log database still has a single writer.
+    log_name = "export_log.db" if args.queue is None else "export_log_{}.db".format(socket.gethostname())
+    log = export_log.ExportLog(os.path.join(path_output, log_name))
+    visit_fingerprint.create_table(log.conn)
+    stage_timer.create_table(log.conn)
+    run_id = time.strftime("%Y-%m-%d %H:%M:%S")
+    fingerprints = visit_fingerprint.load_fingerprints(log.conn) if args.incremental else {}
+
+    index = visit_index.VisitIndex(os.path.join(path_output, "visit_index.json"), args.rescan)
+    if args.watch:
+        watch(filters, index, log, path_output, run_id, args)
+        log.close()
+        return
+
+    # Gather visits, then export them
+    visits = []
+    for year, watershed, site, path_site, visit, visit_id, selected in filters.walk(index, args.path_input):
+        if selected:
+            visit_data = gather_visit(index, path_site, year, watershed, site, visit, visit_id)
+            visit_data["fingerprint"] = fingerprints.get((year, watershed, site, str(visit_id)))
+            visits.append(visit_data)
+        elif args.log_filtered:
+            printer("   Visit " + str(visit_id) + " not run due to filter.", args.outLogFile)
+            row = (str(time.asctime()), year, watershed, site, str(visit_id), "Warning", "Not exported due to filter.")
+            log.write("SurveyExports", row)
+    index.save()
+
+    if args.plan or args.plan_file or args.workers > 1 or args.queue:
+        visits = export_plan.plan(visits)
+        if args.plan_file:
+            export_plan.write_plan(visits, args.plan_file)
+            printer("Export plan saved to {}".format(args.plan_file), args.outLogFile)
+        if args.plan:
+            for line in export_plan.plan_lines(visits):
+                printer(line, args.outLogFile)
+            printer("Dry run (--plan): no visits exported.", args.outLogFile)
+            log.close()
+            return
+
+    export_visits(visits, path_output, run_id, log, args)
+
     printer("Batch Complete", args.outLogFile)
     printer(str(time.asctime()), args.outLogFile)
 
-    conn_log.commit()
-    conn_log.close()
+    log.close()
+
+
+def export_visits(visits, path_output, run_id, log, args):
+    """ Export visits serially, in a pool of worker processes, or through the shared work queue."""
+    if args.queue:
+        queue = work_queue.WorkQueue(args.queue)
+        printer("Queued {} visits in {}".format(queue.enqueue(visits, args.requeue_failed), args.queue), args.outLogFile)
+        queue.close()
+        jobs = [(args.queue, path_output, run_id, args)] * args.workers
+        worker_pool = export_queue_worker
+    else:
+        jobs = [(visit_data, path_output, run_id, args) for visit_data in visits]
+        worker_pool = export_visit_worker
+
+    # Only the parent process writes to the log; pool workers report into it through a queue.
+    if args.isolate and not args.queue:
+        printer("Exporting {} visits in isolated processes ({} visits per process, {} at once)".format(
+            len(jobs), args.isolate, args.workers), args.outLogFile)
+        # each child process sends its log on its own pipe (see process_supervisor), so a killed child cannot
+        # break the log of the others
+        log_queue = Queue.Queue()
+        log_writer = export_log.QueueWriter(log, log_queue)
+        log_writer.start()
+
+        def on_result(job, messages):
+            for message in messages:
+                printer(message, args.outLogFile)
+
+        def on_killed(job, reason):
+            visit_data = job[0]
+            printer("   {}: EXCEPTION, {}".format(visit_data["site"], reason), args.outLogFile)
+            log.write("SurveyExports", (str(time.asctime()), visit_data["year"], visit_data["watershed"],
+                                        visit_data["site"], str(visit_data["visit_id"]), "Exception", reason))
+        try:
+            process_supervisor.run_supervised(export_visit_worker, jobs,
+                                              processes=args.workers,
+                                              jobs_per_process=args.isolate,
+                                              max_rss_mb=args.max_rss,
+                                              timeout=args.visit_timeout,
+                                              initializer=init_worker,
+                                              initargs=(process_supervisor.MessageQueue(),),
+                                              on_result=on_result,
+                                              on_killed=on_killed,
+                                              on_message=log_queue.put)
+        finally:
+            log_writer.stop()
+    elif args.workers > 1:
+        printer("Exporting {} visits with {} workers".format(len(jobs), args.workers), args.outLogFile)
+        log_queue = multiprocessing.Queue()
+        log_writer = export_log.QueueWriter(log, log_queue)
+        log_writer.start()
+        pool = multiprocessing.Pool(args.workers, init_worker, (log_queue,))
+        try:
+            # chunksize 1 so workers take the remaining visits in plan order (largest first)
+            for messages in pool.imap_unordered(worker_pool, jobs, 1):
+                for message in messages:
+                    printer(message, args.outLogFile)
+        finally:
+            pool.close()
+            pool.join()
+            log_writer.stop()
+    else:
+        for job in jobs:
+            messages = export_queue(job, log) if args.queue else export_visit(job, log)[0]
+            for message in messages:
+                printer(message, args.outLogFile)
+
+    if args.queue:
+        queue = work_queue.WorkQueue(args.queue)
+        printer("Queue status: {}".format(queue.counts()), args.outLogFile)
+        queue.close()
+
+
+def watch(filters, index, log, path_output, run_id, args):
+    """
+    Poll the archive for new or changed visit Topo folders. A visit is exported once its Topo folder has not
+    changed for args.settle seconds and it has the required datasets. Unchanged folders are not listed again, and
+    the files of a visit are only walked again if its folders have changed or while it is settling.
+    """
+    args.incremental = True
+    known = {}    # visit: Topo folder signature when last checked
+    pending = {}  # visit: (Topo folder signature, time first seen)
+    printer("Watching {} for new or changed visits every {}s (Ctrl+C to stop)".format(args.path_input, args.poll_interval),
+            args.outLogFile)
+    try:
+        while True:
+            now = time.time()
+            ready = []
+            for year, watershed, site, path_site, visit, visit_id, selected in filters.walk(index, args.path_input):
+                if not selected:
+                    continue
+                key = (year, watershed, site, str(visit_id))
+                signature = index.signature(os.path.join(path_site, visit, "Topo"), rewalk=key in pending)
+                if known.get(key) == signature:
+                    continue
+                if key not in pending or pending[key][0] != signature:
+                    pending[key] = (signature, now)
+                elif now - pending[key][1] >= args.settle:
+                    del pending[key]
+                    known[key] = signature
+                    visit_data = gather_visit(index, path_site, year, watershed, site, visit, visit_id)
+                    if has_required_datasets(visit_data):
+                        ready.append(visit_data)
+            index.save()
+
+            if ready:
+                log.flush()
+                fingerprints = visit_fingerprint.load_fingerprints(log.conn)
+                for visit_data in ready:
+                    visit_data["fingerprint"] = fingerprints.get((visit_data["year"], visit_data["watershed"],
+                                                                  visit_data["site"], str(visit_data["visit_id"])))
+                printer("{}: {} new or changed visits ready for export".format(time.asctime(), len(ready)), args.outLogFile)
+                export_visits(export_plan.plan(ready), path_output, run_id, log, args)
+                log.flush()
+            time.sleep(args.poll_interval)
+    except KeyboardInterrupt:
+        printer("Watch stopped at {}".format(time.asctime()), args.outLogFile)
+
+
+def gather_visit(index, path_site, year, watershed, site, visit, visit_id):
+    """Collect the input datasets found in a visit's Topo folder."""
+    path_topo = os.path.join(path_site, visit, "Topo")
+    datasets, opt_datasets, inst_datasets = index.classify_topo(path_topo)
+    return {"year": year,
+            "watershed": watershed,
+            "site": site,
+            "visit": visit,
+            "visit_id": visit_id,
+            "path_topo": path_topo,
+            "datasets": datasets,
+            "opt_datasets": opt_datasets,
+            "inst_datasets": inst_datasets}
+
+
+def has_required_datasets(visit_data):
+    return all(len(item) == 1 for item in visit_data["datasets"].itervalues()) and \
+        len(visit_data["opt_datasets"]["InstrumentFiles_RAW"]) == 1
+
+
+worker_log = None
+worker_scratch = None
+
+
+def init_worker(log_queue):
+    """
+    Pool initializer: give each worker process a log client and its own scratch workspace. arcpy is not imported
+    here, so workers start without its startup cost; the workspace is set when the worker exports its first visit.
+    """
+    global worker_log, worker_scratch
+    worker_log = export_log.QueueLog(log_queue)
+    import tempfile
+    worker_scratch = tempfile.mkdtemp(prefix="champ_export_{}_".format(os.getpid()))
+
+
+def export_visit(job, log):
+    """
+    Export a single visit and write the result to the log. Safe to run in a worker process.
+    :param job: tuple of (visit_data, path_output, run_id, args)
+    :param log: export_log.ExportLog, or export_log.QueueLog in a pool worker
+    :return: tuple of (list of messages to print, SurveyExports row or None)
+    """
+    visit_data, path_output, run_id, args = job
+    year = visit_data["year"]
+    watershed = visit_data["watershed"]
+    site = visit_data["site"]
+    visit = visit_data["visit"]
+    visit_id = visit_data["visit_id"]
+    path_topo = visit_data["path_topo"]
+    datasets = visit_data["datasets"]
+    opt_datasets = visit_data["opt_datasets"]
+    inst_datasets = visit_data["inst_datasets"]
+    messages = []
+    row = None
+    fingerprint = None
+    timer = stage_timer.StageTimer()
+    try:
+        if has_required_datasets(visit_data):
+            if args.incremental:
+                fingerprint = visit_fingerprint.fingerprint(visit_inputs(visit_data),
+                                                            export_tool_version(args),
+                                                            args.hash_content)
+                if fingerprint == visit_data["fingerprint"]:
+                    messages.append("   {}: UNCHANGED since last export, skipped".format(site))
+                    return messages, None
+            path_output_visit = os.path.join(path_topo, args.output_folder_name) if path_output is None \
+                                    else os.path.join(path_output, year, watershed, site,
+                                    str(visit), "Topo", args.out_folder_name)
+            if not os.path.isdir(path_output_visit) and not (args.project and args.archive):
+                os.makedirs(path_output_visit)
+            blob_store_folder = os.path.join(path_output, "blobs") if args.blob_store else None
+            # Exporters (and arcpy) are only imported when a visit is exported.
+            import CHaMP_Survey_Data_Export_Tool
+            import CHaMP_Survey_Data_Project_Export
+            if worker_scratch is not None:
+                import arcpy
+                arcpy.env.scratchWorkspace = worker_scratch
+            messages.append("   {}: START".format(site))
+            if args.project: # TODO add overwrite protection?
+                raw_instrument_file = None
+                aux_instrument_file = None
+                if len(inst_datasets["InstrumentFiles_JOB"]) == 1:
+                    raw_instrument_file = opt_datasets["InstrumentFiles_RAW"][0] if len(opt_datasets["InstrumentFiles_RAW"]) == 1 else None
+                    aux_instrument_file = inst_datasets["InstrumentFiles_JOB"][0]
+                elif len(inst_datasets["InstrumentFiles_MJF"]) == 1:
+                    raw_instrument_file = inst_datasets["InstrumentFiles_MJF"][0]
+                    aux_instrument_file = opt_datasets["InstrumentFiles_RAW"][0] if len(opt_datasets["InstrumentFiles_RAW"]) == 1 else None
+                dxf_file = opt_datasets["DXF_File"][0] if len(opt_datasets["DXF_File"]) == 1 else None
+                map_images_folder = os.path.join(path_topo, "MapImages") if os.path.exists(os.path.join(path_topo, "MapImages")) else None
+
+                CHaMP_Survey_Data_Project_Export.export_survey_project(datasets["SurveyGDB"][0],
+                                                                       datasets["TopoTIN"][0],
+                                                                       datasets["WSETIN"][0],
+                                                                       datasets["ChannelUnitCSV"][0],
+                                                                       path_output_visit,
+                                                                       visit_id,
+                                                                       site,
+                                                                       watershed,
+                                                                       year,
+                                                                       raw_instrument_file,
+                                                                       aux_instrument_file,
+                                                                       dxf_file,
+                                                                       map_images_folder,
+                                                                       timer,
+                                                                       args.io_threads,
+                                                                       args.refresh,
+                                                                       args.placement,
+                                                                       blob_store_folder,
+                                                                       args.archive,
+                                                                       args.raster_profile,
+                                                                       args.surface_processes,
+                                                                       args.vector_format,
+                                                                       args.point_columns)
+                message = "Survey exported as Riverscapes Project. Optional Datasets Missing or Extra {}".format([key for key, value in opt_datasets.iteritems() if len(value) != 1]) if any(len(value) != 1 for value in opt_datasets.itervalues()) else "Survey exported as Riverscapes Project."
+                row = (str(time.asctime()), year, watershed, site, str(visit_id), "Success", message)
+                messages.append("   " + site + ": COMPLETE")
+            elif len(datasets["SurveyGDB"]) == 0:
+                CHaMP_Survey_Data_Export_Tool.main(datasets["SurveyGDB"][0], path_output_visit, args.refresh,
+                                                   args.gzip_csv)
+                row = (str(time.asctime()), year, watershed, site, str(visit_id), "Success", "Survey exported.")
+                messages.append("   " + site + ": COMPLETE")
+        else:
+            messages.append("   {}: ERROR, does not have correct input data requirements".format(site))
+            missing_datsets = [key for key, value in datasets.iteritems() if len(value) != 1]
+            row = (str(time.asctime()), year, watershed, site, str(visit_id), "Error", "Incomplete Visit Data: " + str(missing_datsets))
+    except KeyboardInterrupt:
+        raise  # i.e. the lease on a queued visit was lost (see work_queue.LeaseKeeper)
+    except:
+        messages.append("   {}: EXCEPTION".format(site))
+        tb = sys.exc_info()[2]
+        tb_info = traceback.format_tb(tb)[0]
+        messages.append("{0} \n {1}: {2}".format(tb_info, sys.exc_type, sys.exc_value))
+        traceback.print_exc(file=sys.stdout)
+        row = (str(time.asctime()), year, watershed, site, str(visit_id), "Exception",
+               traceback.format_exc())
+    if row is None or row[5] != "Success":
+        fingerprint = None
+    log_visit_result(log, run_id, row, fingerprint, timer)
+    return messages, row
+
+
+def visit_inputs(visit_data):
+    """ input datasets of a visit that are part of its fingerprint."""
+    inputs = []
+    for bucket in ["datasets", "inst_datasets"]:
+        for value in visit_data[bucket].itervalues():
+            inputs.extend(value)
+    inputs.extend(visit_data["opt_datasets"]["InstrumentFiles_RAW"])
+    inputs.extend(visit_data["opt_datasets"]["DXF_File"])
+    inputs.append(os.path.join(visit_data["path_topo"], "MapImages"))
+    return inputs
+
+
+def export_tool_version(args):
+    import CHaMP_Survey_Data_Export_Tool
+    import CHaMP_Survey_Data_Project_Export
+    if args.project:
+        version = "{} {}".format(CHaMP_Survey_Data_Project_Export.toolName, CHaMP_Survey_Data_Project_Export.toolVersion)
+        if args.raster_profile != "default":
+            version = "{} {}".format(version, args.raster_profile)
+        if args.vector_format != "shapefile":
+            version = "{} {}".format(version, args.vector_format)
+        return version
+    version = "{} {}".format(CHaMP_Survey_Data_Export_Tool.toolName, CHaMP_Survey_Data_Export_Tool.toolVersion)
+    return version if not args.gzip_csv else "{} gzip_csv".format(version)
+
+
+def export_visit_worker(job):
+    """ Export a visit in a pool worker. Returns the messages to print."""
+    return export_visit(job, worker_log)[0]
+
+
+def export_queue(job, log):
+    """
+    Claim and export visits from a shared work queue until no visits are left to claim.
+    :param job: tuple of (queue database path, path_output, run_id, args)
+    :param log: export_log.ExportLog, or export_log.QueueLog in a pool worker
+    :return: list of messages to print
+    """
+    queue_path, path_output, run_id, args = job
+    queue = work_queue.WorkQueue(queue_path)
+    node = work_queue.node_name()
+    count = 0
+    results = []
+    try:
+        while True:
+            claim = queue.claim(node)
+            if claim is None:
+                break
+            key, visit_data = claim
+            keeper = work_queue.LeaseKeeper(queue_path, key, node)
+            keeper.start()
+            try:
+                try:
+                    try:
+                        messages, row = export_visit((visit_data, path_output, run_id, args), log)
+                    finally:
+                        keeper.stop()
+                except KeyboardInterrupt:
+                    keeper.check()  # LeaseLost if the keeper interrupted the export, otherwise a real interrupt
+                    raise
+                keeper.check()
+            except work_queue.LeaseLost as e:
+                # the visit was claimed again by another node: stop, and leave its status to that node
+                results.append("   {}: {}, export abandoned".format(visit_data["site"], e))
+                continue
+            status, message = (row[5], row[6]) if row else ("Success", "Unchanged since last export, skipped.")
+            queue.complete(key, node, status, message)
+            results.extend(messages)
+            count += 1
+    finally:
+        queue.close()
+    return results + ["   {}: exported {} visits from queue".format(node, count)]
+
+
+def export_queue_worker(job):
+    return export_queue(job, worker_log)
+
+
+def log_visit_result(log, run_id, row, fingerprint, timer):
+    if row:
+        log.write("SurveyExports", row)
+        if timer:
+            stage_timer.store_timings(log, run_id, row[1], row[2], row[3], row[4], timer)
+    if fingerprint:
+        visit_fingerprint.store_fingerprint(log, row[0], row[1], row[2], row[3], row[4], fingerprint)
 
 
 def printer(string, logfile=None):  # Output messages to interpreter and log file
@@ -159,22 +441,128 @@ def main():
     parser.add_argument('--outLogFile', help="output log file for batch process", type=str)
     parser.add_argument('--project', help="Export topo data as Riverscapes Project", action="store_true", default=False)
     parser.add_argument('--years',
-                        help='(Optional) Years. One or comma delimited',
+                        help='(Optional) Years. One or comma delimited. Values may be glob patterns (i.e. "Upper*") or numeric ranges (i.e. "3500-3999")',
                         type=str)
     parser.add_argument('--watersheds',
-                        help='(Optional) Watersheds. One or comma delimited',
+                        help='(Optional) Watersheds. One or comma delimited. Values may be glob patterns (i.e. "Upper*") or numeric ranges (i.e. "3500-3999")',
                         type=str)
     parser.add_argument('--sites',
-                        help='(Optional) Sites. One or comma delimited',
+                        help='(Optional) Sites. One or comma delimited. Values may be glob patterns (i.e. "Upper*") or numeric ranges (i.e. "3500-3999")',
                         type=str)
     parser.add_argument('--visits',
-                        help='(Optional) Visits. One or comma delimited',
+                        help='(Optional) Visits. One or comma delimited. Values may be glob patterns (i.e. "Upper*") or numeric ranges (i.e. "3500-3999")',
+                        type=str)
+    parser.add_argument('--visits_file',
+                        help='(Optional) Text or csv file of visits to process, separated by commas, spaces or new lines',
                         type=str)
     parser.add_argument('--out_folder_name',
                         help='name of new folder in visit folder to save exported data',
                         type=str,
                         default="GISLayers")
+    parser.add_argument('--workers',
+                        help='(Optional) Number of worker processes used to export visits in parallel. Default 1 (serial).',
+                        type=int,
+                        default=1)
+    parser.add_argument('--rescan',
+                        help='Ignore the cached visit index and list every folder in path_input again',
+                        action="store_true",
+                        default=False)
+    parser.add_argument('--incremental',
+                        help='Only export visits whose input datasets (or the export tool version) changed since their last successful export',
+                        action="store_true",
+                        default=False)
+    parser.add_argument('--hash_content',
+                        help='With --incremental, include file contents (not just size and modified time) in the visit fingerprints',
+                        action="store_true",
+                        default=False)
+    parser.add_argument('--no_filter_log',
+                        help='Do not write a log row for each visit skipped by the year/watershed/site/visit filters',
+                        action="store_false",
+                        dest="log_filtered",
+                        default=True)
+    parser.add_argument('--plan',
+                        help='Dry run: estimate the export cost of each visit from its input file sizes and print the plan (largest first) without exporting',
+                        action="store_true",
+                        default=False)
+    parser.add_argument('--plan_file',
+                        help='(Optional) Save the export plan to this csv file',
+                        type=str)
+    parser.add_argument('--queue',
+                        help='(Optional) Shared queue database for exporting from several nodes. Visits are added to the queue, then claimed and exported one at a time until the queue is empty.',
+                        type=str)
+    parser.add_argument('--requeue_failed',
+                        help='With --queue, queue visits again that ended with an Error or Exception status',
+                        action="store_true",
+                        default=False)
+    parser.add_argument('--watch',
+                        help='Keep running and export new or changed visits as they are uploaded (implies --incremental)',
+                        action="store_true",
+                        default=False)
+    parser.add_argument('--poll_interval',
+                        help='With --watch, seconds between checks of the input folder. Default 60.',
+                        type=int,
+                        default=60)
+    parser.add_argument('--settle',
+                        help='With --watch, seconds a visit Topo folder must be unchanged before it is exported. Default 300.',
+                        type=int,
+                        default=300)
+    parser.add_argument('--isolate',
+                        help='(Optional) Export each group of this many visits in a new child process, so memory is released between groups. Use with --max_rss and --visit_timeout. Not used with --queue.',
+                        type=int,
+                        default=0)
+    parser.add_argument('--max_rss',
+                        help='With --isolate, kill an export process using more than this many MB of memory (requires psutil)',
+                        type=int,
+                        default=None)
+    parser.add_argument('--visit_timeout',
+                        help='With --isolate, kill an export process that has been exporting the same visit for more than this many seconds',
+                        type=int,
+                        default=None)
+    parser.add_argument('--refresh',
+                        help='(Optional) Refresh existing exports in place: only datasets whose sources have changed since the last export are exported again',
+                        action='store_true',
+                        default=False)
+    parser.add_argument('--placement',
+                        help='(Optional) How input files (instrument files, dxf, csv, TINs, MapImages, Reports) are placed into each project: auto (reflink, then copy), reflink (clone or fail), hardlink (shares the data of the archive files: opt in only) or copy',
+                        choices=file_placement.STRATEGIES,
+                        default="auto")
+    parser.add_argument('--blob_store',
+                        help='(Optional) Store the files of the exported projects once, by content, in a "blobs" folder of the output path and hard link them into each project',
+                        action='store_true',
+                        default=False)
+    parser.add_argument('--io_threads',
+                        help='(Optional) Number of threads copying files (TINs, instrument files, map images) while each visit is converted. 0 to copy in the main thread.',
+                        type=int,
+                        default=4)
+    parser.add_argument('--raster_profile',
+                        help='(Optional) GeoTIFF layout of the rasters of each Riverscapes Project: default (stripped, uncompressed) or tiled (internally tiled and compressed, with overviews, for windowed reads)',
+                        choices=CHaMP_Data.RASTER_PROFILES,
+                        default="default")
+    parser.add_argument('--surface_processes',
+                        help='(Optional) Number of processes deriving the Hillshade, Slope and Detrended rasters of visits without them. 0 (default) derives them in the export process; always 0 with --workers.',
+                        type=int,
+                        default=0)
+    parser.add_argument('--vector_format',
+                        help='(Optional) Format of the survey data, survey extent and stage feature classes of each Riverscapes Project: shapefile (one shapefile each) or geopackage (layers of one Vectors.gpkg, with full field names and spatial indexes)',
+                        choices=CHaMP_Data.VECTOR_FORMATS,
+                        default="shapefile")
+    parser.add_argument('--point_columns',
+                        help='(Optional) Also write the survey point feature classes of each Riverscapes Project as Parquet files in its Points folder, for analysis across visits. Requires pyarrow.',
+                        action='store_true',
+                        default=False)
+    parser.add_argument('--gzip_csv',
+                        help='(Optional) Write the point csv files of the CAD_Files folder gzip compressed (.csv.gz). Not used with --project.',
+                        action='store_true',
+                        default=False)
+    parser.add_argument('--archive',
+                        help='(Optional) Write each Riverscapes Project as a single zip or tar archive (<project folder>.zip) instead of a folder. Not used with --refresh or --blob_store.',
+                        choices=project_archive.FORMATS,
+                        default=None)
     args = parser.parse_args()
+    if args.archive and (args.refresh or args.blob_store):
+        parser.error("--archive is not used with --refresh or --blob_store")
+    if args.point_columns and not point_columns.available():
+        parser.error("--point_columns requires pyarrow")
     run(args)
 
 
@@ -12,9 +12,26 @@
 # !/usr/bin/env python
 
 # # Import Modules # #
-import arcpy
 from os import path, makedirs
 import xml.etree.ElementTree as ET
+import hashlib
+import shutil
+from collections import OrderedDict
+
+
+class _LazyArcpy(object):
+    """
+    Stands in for the arcpy module until it is first used, so tools that import this module (i.e. BatchExport --help,
+    discovery and dry runs) do not pay the arcpy startup cost.
+    """
+
+    def __getattr__(self, name):
+        global arcpy
+        import arcpy as arcpy_module
+        arcpy = arcpy_module
+        return getattr(arcpy_module, name)
+
+arcpy = _LazyArcpy()
 
 
 ## Survey Data Containers ## 
@@ -56,6 +73,7 @@ class SurveyGeodatabase():
     def __init__(self, filename):
 
         self.filename = filename
+        self.inventory = GDBInventory(filename)
 
         # Feature Datasets
         self.unprojected = filename + "\\Unprojected"
@@ -174,9 +192,12 @@ class SurveyGeodatabase():
                              self.tblQaQcBacksightLog,
                              self.tblQaQcUncertaintySummary]
 
+        for dataset in self.listDatasets:
+            dataset.inventory = self.inventory
+
     def projection_info(self):
 
-        sr = arcpy.Describe(self.projected).spatialReference
+        sr = self.inventory.spatial_reference(self.projected)
 
         dictProjection = {}
         dictProjection["SpatialReferenceName"] = str(sr.name)
@@ -191,10 +212,10 @@ class SurveyGeodatabase():
                 yield dataset
 
     def get_custom_datasets(self):
-        for dirpath, dirname, gis_datasets in arcpy.da.Walk(self.filename):
-            for gis_dataset in gis_datasets:
-                if gis_dataset not in [dataset.Name for dataset in self.listDatasets] and dirpath is not self.filename:
-                    yield path.join(dirpath, gis_dataset)
+        names = [dataset.Name for dataset in self.listDatasets]
+        for entry in self.inventory.datasets():
+            if entry["name"] not in names:
+                yield path.join(self.filename, entry["relpath"])
 
     def getRasterDatasets(self):
         for dataset in self.getDatasets():
@@ -250,7 +271,7 @@ class SurveyGeodatabase():
                     return str(row[0]) if type == "STRING" else row[0]
 
     def has_unprojected(self):
-        return arcpy.Exists(self.unprojected)
+        return self.inventory.exists(self.unprojected)
 
     def export_custom_datasets(self, dest_folder):
         list_datasets = []
@@ -258,12 +279,12 @@ class SurveyGeodatabase():
         for dataset in self.get_custom_datasets():
             if not path.exists(dest_folder): # make dir only if one or more custom dataset exists
                 makedirs(dest_folder)
-            desc = arcpy.Describe(dataset)
+            entry = self.inventory.get(dataset)
             msg = ""
-            if desc.dataType == "FeatureClass":
-                if int(arcpy.GetCount_management(dataset).getOutput(0)) > 0:
+            if entry["dataType"] == "FeatureClass":
+                if self.inventory.count(dataset) > 0:
                     try:
-                        arcpy.FeatureClassToFeatureClass_conversion(dataset, dest_folder, desc.baseName)
+                        arcpy.FeatureClassToFeatureClass_conversion(dataset, dest_folder, entry["baseName"])
                         exported = "True"
                         list_datasets.append(dataset)
                     except arcpy.ExecuteError:
@@ -272,10 +293,10 @@ class SurveyGeodatabase():
                 else:
                     exported = "False"
                     msg = "No Features found"
-            elif desc.dataType == "Table":
-                if int(arcpy.GetCount_management(dataset).getOutput(0)) > 0:
+            elif entry["dataType"] == "Table":
+                if self.inventory.count(dataset) > 0:
                     try:
-                        arcpy.TableToTable_conversion(dataset, dest_folder, "{}.{}".format(desc.baseName, "dbf"))
+                        arcpy.TableToTable_conversion(dataset, dest_folder, "{}.{}".format(entry["baseName"], "dbf"))
                         exported = "True"
                         list_datasets.append(dataset)
                     except arcpy.ExecuteError:
@@ -284,7 +305,7 @@ class SurveyGeodatabase():
                 else:
                     exported = "False"
                     msg = "No Records in Table"
-            elif desc.dataType == "RasterDataset":
+            elif entry["dataType"] == "RasterDataset":
                 try:
                     arcpy.RasterToOtherFormat_conversion(dataset, dest_folder, "TIFF")
                     exported = "True"
@@ -296,9 +317,9 @@ class SurveyGeodatabase():
                 exported = "False"
                 msg = "Unsupported dataType for export"
 
-            nodeDataset = ET.SubElement(root, desc.dataType)
+            nodeDataset = ET.SubElement(root, entry["dataType"])
             nodeDataset.set("exported", str(exported))
-            ET.SubElement(nodeDataset, "Name").text = desc.baseName
+            ET.SubElement(nodeDataset, "Name").text = entry["baseName"]
             ET.SubElement(nodeDataset, "Source").text = dataset
             if msg:
                 ET.SubElement(nodeDataset, "Message").text = str(msg)
@@ -335,8 +356,9 @@ class SurveyGeodatabase():
 
         return outfile
 
-    def exportSurveyTopographyDXF(self, outFolder):
-        """exports dxf file containing Topographic Survey Points, Lines and Survey Extent """
+    def exportSurveyTopographyDXF(self, outFolder, compress_csv=False):
+        """exports dxf file containing Topographic Survey Points, Lines and Survey Extent, and the csv files of the
+        topo and control points (gzip compressed .csv.gz files if compress_csv)"""
         from os import path
         outfile = path.join(outFolder, "SurveyTopography") + ".dxf"
 
@@ -346,9 +368,8 @@ class SurveyGeodatabase():
         memSurveyExtent = "in_memory//Survey_Extent"
         memPoints = "in_memory//AllPoints"
         # memLines = "in_memory//AllLines"
-        memControlPoints = "in_memory//ControlPoints"
         listmemFCs = [memTopoPoints, memEOW, memBreaklines, memSurveyExtent]
-        listmemAnnotation = [memPoints, memControlPoints]
+        listmemAnnotation = [memPoints]
 
         for fc in listmemFCs + listmemAnnotation:
             if arcpy.Exists(fc):
@@ -358,45 +379,246 @@ class SurveyGeodatabase():
         arcpy.CopyFeatures_management(self.EdgeOfWater_Points.filename, memEOW)
         arcpy.CopyFeatures_management(self.Breaklines.filename, memBreaklines)
         arcpy.CopyFeatures_management(self.SurveyExtent.filename, memSurveyExtent)
-        arcpy.CopyFeatures_management(self.Control_Points.filename, memControlPoints)
         arcpy.CopyFeatures_management(self.Topo_Points.filename, memPoints)
 
         arcpy.ExportCAD_conversion([memBreaklines, memSurveyExtent, memPoints], "DXF_R2010", outfile)
 
-        outCSV = path.join(outFolder, "SurveyTopographyPoints") + ".csv"
-        exportAsCSV(memPoints, outCSV)
+        # the csv files are read from the survey points, without in_memory copies
+        extension = ".csv.gz" if compress_csv else ".csv"
+        outCSV = path.join(outFolder, "SurveyTopographyPoints") + extension
+        exportAsCSV(self.Topo_Points.filename, outCSV, compress_csv)
 
-        outControlCSV = path.join(outFolder, "ControlNetworkPoints") + ".csv"
-        exportAsCSV(memControlPoints, outControlCSV)
+        outControlCSV = path.join(outFolder, "ControlNetworkPoints") + extension
+        exportAsCSV(self.Control_Points.filename, outControlCSV, compress_csv)
 
         return outfile
 
 
-def exportAsCSV(inFeatureClass, outCSVfile):
-    import csv
-    with open(outCSVfile, "wb") as csvfile:
-        csvWriter = csv.writer(csvfile)
+CSV_BLOCK_ROWS = 65536
 
-        fields = arcpy.ListFields(inFeatureClass)
-        fieldsGIS = ("POINT_NUMBER", "SHAPE@Y", "SHAPE@X", "SHAPE@Z", "DESCRIPTION")
-        fieldsCAD = ("PNTNO", "Y", "X", "ELEV", "DESC")
 
-        with arcpy.da.SearchCursor(inFeatureClass, fieldsGIS) as scFeatures:
-            csvWriter.writerow(fieldsCAD)
-            for row in scFeatures:
-                csvWriter.writerow(row)
+def exportAsCSV(inFeatureClass, outCSVfile, compress=False):
+    """
+    writes the point number, y, x, z and description of the points of a feature class as a CAD points csv. The fields
+    are read into a numpy array with one arcpy call, and the rows are written CSV_BLOCK_ROWS at a time.
+    :param compress: write the csv gzip compressed
+    """
+    import csv
+    import gzip
+    import numpy
+    from cStringIO import StringIO
+
+    fieldsGIS = ("POINT_NUMBER", "SHAPE@Y", "SHAPE@X", "SHAPE@Z", "DESCRIPTION")
+    fieldsCAD = ("PNTNO", "Y", "X", "ELEV", "DESC")
+
+    points = arcpy.da.FeatureClassToNumPyArray(inFeatureClass, fieldsGIS,
+                                               null_value={"POINT_NUMBER": "", "DESCRIPTION": ""})
+    buffer = StringIO()
+    csvWriter = csv.writer(buffer)
+    csvWriter.writerow(fieldsCAD)
+    with (gzip.open if compress else open)(outCSVfile, "wb") as csvfile:
+        for start in range(0, len(points), CSV_BLOCK_ROWS):
+            block = points[start:start + CSV_BLOCK_ROWS]
+            rows = block.tolist()
+            # points without z are written with an empty ELEV, as from a cursor
+            for index in numpy.flatnonzero(numpy.isnan(block["SHAPE@Z"])):
+                rows[index] = rows[index][:3] + (None,) + rows[index][4:]
+            csvWriter.writerows(rows)
+            csvfile.write(buffer.getvalue())
+            buffer.seek(0)
+            buffer.truncate()
+        csvfile.write(buffer.getvalue())
     return
 
 
+def digest_rows(dataset, fields):
+    """ sha1 of the spatial reference and rows of a table or feature class"""
+    desc = arcpy.Describe(dataset)
+    digest = hashlib.sha1()
+    if hasattr(desc, "spatialReference"):
+        digest.update(str(desc.spatialReference.factoryCode))
+    with arcpy.da.SearchCursor(dataset, fields) as sc:
+        for row in sc:
+            digest.update(repr(row))
+    return digest.hexdigest()
+
+
+## Geodatabase Inventory ##
+class GDBInventory(object):
+    """
+    Datasets of a geodatabase, read with a single arcpy.Describe of the geodatabase (its children and the children of
+    its feature datasets) when it is first queried. Each entry records the name, data type and spatial reference of a
+    dataset; feature and row counts are read when first asked for, then kept.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._entries = None
+        self._counts = {}
+
+    @staticmethod
+    def key(dataset_path):
+        """ geodatabase paths are case insensitive and may be written with either separator"""
+        return dataset_path.replace("/", "\\").rstrip("\\").lower()
+
+    def relative_path(self, dataset_path):
+        """ path of a dataset relative to the geodatabase, or None if the path is not in the geodatabase"""
+        root = self.key(self.filename) + "\\"
+        dataset_path = dataset_path.replace("/", "\\").rstrip("\\")
+        return dataset_path[len(root):] if dataset_path.lower().startswith(root) else None
+
+    @property
+    def entries(self):
+        if self._entries is None:
+            desc_gdb = arcpy.Describe(self.filename)
+            root_length = len(desc_gdb.catalogPath.rstrip("\\/")) + 1
+            self._entries = OrderedDict()
+            pending = list(desc_gdb.children)
+            while pending:
+                desc = pending.pop(0)
+                relpath = desc.catalogPath[root_length:]
+                self._entries[self.key(relpath)] = {"name": desc.name,
+                                                    "baseName": desc.baseName,
+                                                    "relpath": relpath,
+                                                    "dataType": desc.dataType,
+                                                    "spatialReference": getattr(desc, "spatialReference", None)}
+                if desc.dataType == "FeatureDataset":
+                    pending.extend(desc.children)
+        return self._entries
+
+    def get(self, dataset_path):
+        """ rtype: dict or None"""
+        relpath = self.relative_path(dataset_path)
+        return self.entries.get(self.key(relpath)) if relpath is not None else None
+
+    def exists(self, dataset_path):
+        if self.relative_path(dataset_path) is None:
+            return True if arcpy.Exists(dataset_path) else False
+        return self.get(dataset_path) is not None
+
+    def spatial_reference(self, dataset_path):
+        entry = self.get(dataset_path)
+        if entry is None or entry["spatialReference"] is None:
+            return arcpy.Describe(dataset_path).spatialReference
+        return entry["spatialReference"]
+
+    def count(self, dataset_path):
+        """ number of features or rows of a dataset"""
+        dataset_key = self.key(dataset_path)
+        if dataset_key not in self._counts:
+            self._counts[dataset_key] = int(arcpy.GetCount_management(dataset_path).getOutput(0))
+        return self._counts[dataset_key]
+
+    def datasets(self):
+        """ entries of the feature classes, tables and rasters (not the feature datasets)"""
+        for entry in self.entries.itervalues():
+            if entry["dataType"] != "FeatureDataset":
+                yield entry
+
+    def add(self, dataset_path, data_type):
+        """ record a dataset written into the geodatabase after the inventory was read"""
+        relpath = self.relative_path(dataset_path)
+        name = relpath.split("\\")[-1]
+        self.entries[self.key(relpath)] = {"name": name,
+                                          "baseName": name,
+                                          "relpath": relpath,
+                                          "dataType": data_type,
+                                          "spatialReference": None}
+        self._counts.pop(self.key(dataset_path), None)
+
+
+## Vector Output ##
+# shapefile: one shapefile per feature class, with short (10 character) field names
+# geopackage: the feature classes as layers of one GeoPackage, with full field names and R-tree spatial indexes
+VECTOR_FORMATS = ["shapefile", "geopackage"]
+
+
+def create_geopackage(geopackage):
+    """ create an empty GeoPackage for GISVector.exportToGeoPackage"""
+    arcpy.CreateSQLiteDatabase_management(geopackage, "GEOPACKAGE")
+
+
+def geopackage_layer(geopackage, layer):
+    """ arcpy path of a layer of a GeoPackage"""
+    return path.join(geopackage, "main." + layer)
+
+
+## Raster Output ##
+# default: stripped, uncompressed GeoTIFF (RasterToOtherFormat)
+# tiled: internally tiled, compressed GeoTIFF with overviews, for windowed reads
+RASTER_PROFILES = ["default", "tiled"]
+TILE_SIZE = 512
+
+
+def overview_levels(width, height, tile_size=TILE_SIZE):
+    """ overview factors (2, 4, 8...) until the overview fits in one tile"""
+    levels = []
+    factor = 2
+    while max(width, height) / (factor / 2) > tile_size:
+        levels.append(factor)
+        factor *= 2
+    return levels
+
+
+def write_tiled_geotiff(raster, output_tif):
+    """
+    Write a raster as an internally tiled, compressed GeoTIFF with overviews. With the GDAL python bindings (osgeo),
+    tiles are deflate compressed with a predictor and the overviews are stored in the file. Otherwise arcpy writes
+    LZW compressed tiles and the overviews as pyramids in an .ovr file.
+    """
+    try:
+        from osgeo import gdal
+    except ImportError:
+        gdal = None
+    arcpy.env.tileSize = "{0} {0}".format(TILE_SIZE)
+    arcpy.env.pyramid = "NONE"
+    try:
+        if gdal is None:
+            arcpy.env.compression = "LZW"
+            arcpy.CopyRaster_management(raster, output_tif)
+            arcpy.BuildPyramids_management(output_tif, resample_technique="BILINEAR")
+            return
+        arcpy.env.compression = "NONE"
+        temp_tif = path.splitext(output_tif)[0] + "_untiled.tif"
+        arcpy.CopyRaster_management(raster, temp_tif)
+        source = gdal.Open(temp_tif, gdal.GA_Update)
+        levels = overview_levels(source.RasterXSize, source.RasterYSize)
+        if levels:
+            source.BuildOverviews("AVERAGE", levels)
+        floating_point = gdal.GetDataTypeName(source.GetRasterBand(1).DataType).startswith("Float")
+        gdal.GetDriverByName("GTiff").CreateCopy(output_tif, source, 0,
+                                                 ["TILED=YES",
+                                                  "BLOCKXSIZE={}".format(TILE_SIZE),
+                                                  "BLOCKYSIZE={}".format(TILE_SIZE),
+                                                  "COMPRESS=DEFLATE",
+                                                  "PREDICTOR={}".format(3 if floating_point else 2),
+                                                  "COPY_SRC_OVERVIEWS=YES"])
+        source = None  # close the dataset before it is deleted
+        if path.isfile(temp_tif + ".aux.xml"):  # statistics and histogram stored by CopyRaster
+            shutil.copyfile(temp_tif + ".aux.xml", output_tif + ".aux.xml")
+        arcpy.Delete_management(temp_tif)
+    finally:
+        arcpy.ClearEnvironment("tileSize")
+        arcpy.ClearEnvironment("compression")
+        arcpy.ClearEnvironment("pyramid")
+
+
 ## Base GIS Classes ##
 class GISDataset(object):
+    inventory = None  # GDBInventory of the geodatabase, set by SurveyGeodatabase
 
     def __init__(self, filename):
         self.filename = filename
 
     def validateExists(self):
+        if self.inventory is not None:
+            return self.inventory.exists(self.filename)
         return True if arcpy.Exists(self.filename) else False
 
+    def fingerprint(self):
+        """ digest of the dataset content, used to refresh an exported project (see project_manifest)"""
+        return digest_rows(self.filename, ["*"])
+
 
 class GISTable(GISDataset):
     Datatype = "Table"
@@ -445,6 +667,7 @@ class GISTable(GISDataset):
 
 class GISRaster(GISDataset):
     Datatype = "Raster"
+    derivable = False  # see derive
 
     def __init__(self, filename, name):
         GISDataset.__init__(self, filename)
@@ -452,15 +675,54 @@ class GISRaster(GISDataset):
         self.name = name
         self.Name = name
 
-    def exportToGeoTiff(self, outputPath):
-        arcpy.RasterToOtherFormat_conversion(self.filename, outputPath, "TIFF")
+    def exportToGeoTiff(self, outputPath, profile="default"):
+        """ :param profile: one of RASTER_PROFILES"""
+        if profile == "tiled":
+            write_tiled_geotiff(self.filename, path.join(outputPath, self.basename()))
+        else:
+            arcpy.RasterToOtherFormat_conversion(self.filename, outputPath, "TIFF")
 
-    def export(self, outputPath):
-        self.exportToGeoTiff(outputPath=outputPath)
+    def export(self, outputPath, profile="default"):
+        self.exportToGeoTiff(outputPath=outputPath, profile=profile)
 
     def basename(self):
         return self.name + ".tif"
 
+    def derive(self, survey_gdb, output_raster, processes=0):
+        """
+        compute the raster from the other datasets of the survey, for surveys without it.
+        :return: statistics of the raster collected while it was written (see raster_blocks.Statistics.result), or
+                 False if the raster cannot be derived
+        """
+        return False
+
+    def export_derived(self, survey_gdb, outputPath, profile="default", processes=0):
+        """
+        derive the raster (see derive) as a GeoTIFF in outputPath.
+        :return: statistics of the raster (see derive), or False if it cannot be derived
+        """
+        output_tif = path.join(outputPath, self.basename())
+        if profile != "tiled":
+            return self.derive(survey_gdb, output_tif, processes)
+        derived_tif = path.join(outputPath, self.name + "_derived.tif")
+        derived = self.derive(survey_gdb, derived_tif, processes)
+        if not derived:
+            return False
+        write_tiled_geotiff(derived_tif, output_tif)
+        arcpy.Delete_management(derived_tif)
+        return derived
+
+    def fingerprint(self):
+        """ sha1 of the grid and cell values of the raster, read one block at a time (see raster_blocks)"""
+        import raster_blocks
+        grid = raster_blocks.Grid(self.filename)
+        digest = hashlib.sha1()
+        digest.update(repr((grid.xmin, grid.ymax, grid.columns, grid.rows, grid.cell_width, grid.cell_height,
+                            grid.spatial_reference.factoryCode)))
+        for row, column, rows, columns in grid.blocks():
+            digest.update(raster_blocks.read_block(self.filename, grid, row, column, rows, columns).tostring())
+        return digest.hexdigest()
+
     def get_extents(self):
         dict_extents = {}
         descRaster = arcpy.Describe(self.filename)
@@ -490,14 +752,16 @@ class GISVector(GISDataset):
         self.dict_field_names[field.nameFull] = field.nameShort
         return field
 
-    def getFieldMapping(self):
+    def getFieldMapping(self, short_names=True):
+        """ :param short_names: rename the fields with their short (shapefile) names"""
         fieldMappings = arcpy.FieldMappings()
         for field in arcpy.ListFields(self.filename):
             if field.name.lower() not in ["shape", "oid", "objectid"]:
                 fm = arcpy.FieldMap()
                 fm.addInputField(self.filename, field.name)
                 outfield = fm.outputField
-                outfield.name = self.dict_field_names[field.name] if field.name in self.dict_field_names.keys() else field.name
+                if short_names and field.name in self.dict_field_names:
+                    outfield.name = self.dict_field_names[field.name]
                 outfield.type = "Integer" if field.type == "SmallInteger" else field.type
                 fm.outputField = outfield
                 fieldMappings.addFieldMap(fm)
@@ -512,6 +776,22 @@ class GISVector(GISDataset):
                                                     field_mapping=field_mappings)
         return name + ".shp"
 
+    def exportToGeoPackage(self, geopackage, layer=None, force_z_enabled=False):
+        """
+        export as a layer of a GeoPackage (see create_geopackage), keeping the full field names.
+        :return: path of the layer
+        """
+        name = self.outName if layer is None else layer
+        field_mappings = self.getFieldMapping(short_names=False)
+        if force_z_enabled:
+            arcpy.env.outputZFlag = "ENABLED"
+        arcpy.FeatureClassToFeatureClass_conversion(self.filename, geopackage, name,
+                                                    field_mapping=field_mappings)
+        layer_path = geopackage_layer(geopackage, name)
+        if not arcpy.Describe(layer_path).hasSpatialIndex:
+            arcpy.AddSpatialIndex_management(layer_path)
+        return layer_path
+
     def export(self, ouputPath):
         self.exportToShapeFile(outputPath=ouputPath)
 
@@ -524,6 +804,10 @@ class GISVector(GISDataset):
     def test_z(self):
         return arcpy.Describe(self.filename).hasZ
 
+    def fingerprint(self):
+        # SHAPE@JSON includes the z and m values of the geometries
+        return digest_rows(self.filename, ["*", "SHAPE@JSON"])
+
 
 ## Fields ##
 class GISField():
@@ -1084,6 +1368,7 @@ class DEMHillshade(GISRaster):
     Publish = True
     ExportToGIS = True
     Required = True
+    derivable = True
 
     def __init__(self, path):
         GISRaster.__init__(self, path + "\\" + self.name, self.name)
@@ -1092,12 +1377,18 @@ class DEMHillshade(GISRaster):
         self.rs_id = "DEMHillshade"
         self.rs_type = "DEMHillshade"
 
+    def derive(self, survey_gdb, output_raster, processes=0):
+        """ hillshade of the DEM, for surveys without one (see derived_surfaces)"""
+        import derived_surfaces
+        return derived_surfaces.hillshade(survey_gdb.DEM.filename, output_raster, processes)
+
 
 class DetrendedDEM(GISRaster):
     name = "Detrended"
     Publish = True
     ExportToGIS = True
     Required = True
+    derivable = True
 
     def __init__(self, path):
         GISRaster.__init__(self, path + "\\" + self.name, self.name)
@@ -1106,6 +1397,20 @@ class DetrendedDEM(GISRaster):
         self.rs_id = "Detrended"
         self.rs_type = "Detrended"
 
+    def derive(self, survey_gdb, output_raster, processes=0):
+        """
+        DEM detrended along the wetted (or bankfull) centerline, for surveys without one. The bankfull centerline is
+        used if there is no wetted centerline, or if the trend cannot be fitted along it (i.e. it is off the DEM).
+        """
+        import derived_surfaces
+        for centerline in [survey_gdb.Wetted_Centerline, survey_gdb.Bankfull_Centerline]:
+            if centerline.validateExists():
+                statistics = derived_surfaces.detrended(survey_gdb.DEM.filename, centerline.filename, output_raster,
+                                                        processes)
+                if statistics:
+                    return statistics
+        return False
+
 
 class WaterDepth(GISRaster):
     name = "Water_Depth"
@@ -1121,6 +1426,17 @@ class WaterDepth(GISRaster):
         self.rs_type = "WaterDepth"
 
     def create(self, DEM, WSEDEM):
+        """ water depth from the DEM and water surface DEM, block by block with numpy when they are aligned"""
+        import raster_blocks
+        if raster_blocks.Grid(DEM).aligned(raster_blocks.Grid(WSEDEM)):
+            raster_blocks.water_depth(DEM, WSEDEM, self.filename)
+        else:
+            self.create_spatial_analyst(DEM, WSEDEM)
+        if self.inventory is not None:
+            self.inventory.add(self.filename, "RasterDataset")
+
+    def create_spatial_analyst(self, DEM, WSEDEM):
+        """ water depth with Spatial Analyst, which resamples the water surface DEM to the DEM cells"""
         arcpy.CheckOutExtension("Spatial")
         arcpy.env.extent = arcpy.Describe(DEM).Extent
         arcpy.env.snapRaster = DEM
@@ -1151,6 +1467,7 @@ class AssocSlope(GISRaster):
     Publish = True
     ExportToGIS = True
     Required = True
+    derivable = True
 
     def __init__(self, path):
         GISRaster.__init__(self, path + "\\" + self.name, self.name)
@@ -1159,6 +1476,11 @@ class AssocSlope(GISRaster):
         self.rs_id = "Slope"
         self.rs_type = "Slope"
 
+    def derive(self, survey_gdb, output_raster, processes=0):
+        """ slope of the DEM in degrees, for surveys without one (see derived_surfaces)"""
+        import derived_surfaces
+        return derived_surfaces.slope(survey_gdb.DEM.filename, output_raster, processes)
+
 
 class AssocPDensity(GISRaster):
     name = "AssocPDensity"
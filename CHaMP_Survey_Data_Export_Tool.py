@@ -4,17 +4,24 @@
     Tool for converting a CHaMP SurveyGeodatabase into open-format GIS datasets.
 """
 import os 
+import glob
 import shutil
 import sys
 import time
 import CHaMP_Data
+import project_manifest
 import sfr_metadata as Metadata
 
 toolName = "CHaMP Survey Data Export Tool"
 toolVersion = "1.3"
 
-def main(strInputSurveyGDB, strOutputPath):
-    reload(CHaMP_Data)
+def main(strInputSurveyGDB, strOutputPath, refresh=False, compress_csv=False):
+    """
+    :param strInputSurveyGDB: path to the survey geodatabase
+    :param strOutputPath: output folder
+    :param refresh: keep the datasets of a previous export whose sources have not changed (see project_manifest).
+    :param compress_csv: write the point csv files of CAD_Files gzip compressed (.csv.gz)
+    """
     start = time.time()
     print "Starting CHaMP Survey Export Tool at " + str(time.asctime())
     print "Input SurveyGDB: " + str(strInputSurveyGDB)
@@ -52,20 +59,26 @@ def main(strInputSurveyGDB, strOutputPath):
         print "Output Folder does not exist: Creating {0}".format(strOutputPath)
         os.makedirs(strOutputPath)
 
-    for file in os.listdir(strOutputPath):
-        file_path = os.path.join(strOutputPath, file)
-        try:
-            if os.path.isfile(file_path):
-                print "Deleting existing file: " + str(file_path)
-                mWriter.currentRun.addMessage("Info","Deleting existing file: " + str(file_path))
-                os.unlink(file_path)
-            elif os.path.isdir(file_path): 
-                shutil.rmtree(file_path)
-                print "Deleting existing directory: " + str(file_path)
-                mWriter.currentRun.addMessage("Info","Deleting existing directory: " + str(file_path))
-        except Exception as e:
-            print e
-            mWriter.currentRun.addMessage("Exception",str(e))
+    manifest = project_manifest.ProjectManifest(strOutputPath, toolVersion, refresh)
+    manifest.add_source("SurveyGDB", strInputSurveyGDB)
+    if manifest.loaded:
+        print "Refreshing existing export: only datasets with changed sources are exported"
+        mWriter.currentRun.addMessage("Info", "Refreshing existing export")
+    else:
+        for file in os.listdir(strOutputPath):
+            file_path = os.path.join(strOutputPath, file)
+            try:
+                if os.path.isfile(file_path):
+                    print "Deleting existing file: " + str(file_path)
+                    mWriter.currentRun.addMessage("Info","Deleting existing file: " + str(file_path))
+                    os.unlink(file_path)
+                elif os.path.isdir(file_path): 
+                    shutil.rmtree(file_path)
+                    print "Deleting existing directory: " + str(file_path)
+                    mWriter.currentRun.addMessage("Info","Deleting existing directory: " + str(file_path))
+            except Exception as e:
+                print e
+                mWriter.currentRun.addMessage("Exception",str(e))
 
     ## Rasters
     for raster in SurveyGDB.getRasterDatasets():
@@ -73,8 +86,12 @@ def main(strInputSurveyGDB, strOutputPath):
         if raster.validateExists():
             print "Validated: {0} exists in {1}s".format(str(raster.filename), int(time.time() - valstart))
             start = time.time()
-            raster.exportToGeoTiff(strOutputPath)
-            print "Exported: {0} in {1}s".format(str(raster.filename), int(time.time() - start))
+            if manifest.current(raster.basename(), raster.fingerprint, "SurveyGDB") is None:
+                raster.exportToGeoTiff(strOutputPath)
+                manifest.record(raster.basename())
+                print "Exported: {0} in {1}s".format(str(raster.filename), int(time.time() - start))
+            else:
+                print "Unchanged: {0}".format(str(raster.filename))
             ###Write to Log
             mWriter.currentRun.addOutput(raster.name,str(raster.filename))
         else:
@@ -90,8 +107,12 @@ def main(strInputSurveyGDB, strOutputPath):
         if vectorFC.validateExists():
             print "Validated: {0} exists in {1}s".format(str(vectorFC.filename), int(time.time() - valstart))
             start = time.time()
-            vectorFC.exportToShapeFile(strOutputPath)
-            print "Exported: {0} in {1}s".format(str(vectorFC.filename), int(time.time() - start))
+            if manifest.current(vectorFC.shapefile_basename(), vectorFC.fingerprint, "SurveyGDB") is None:
+                vectorFC.exportToShapeFile(strOutputPath)
+                manifest.record(vectorFC.shapefile_basename())
+                print "Exported: {0} in {1}s".format(str(vectorFC.filename), int(time.time() - start))
+            else:
+                print "Unchanged: {0}".format(str(vectorFC.filename))
             mWriter.currentRun.addOutput(vectorFC.Name,str(vectorFC.filename))
         else:
             print str(vectorFC.filename) + " does not exist."
@@ -107,24 +128,38 @@ def main(strInputSurveyGDB, strOutputPath):
             print str(table.filename) + " does not exist."
             mWriter.currentRun.addMessage("Warning",str(table.filename) + " does not exist.")
 
-    # Make DXF Files
+    # Make DXF Files (from the TINs next to the geodatabase and the survey points)
     outCadFolder = os.path.join(strOutputPath, "CAD_Files")
-    os.makedirs(outCadFolder)
-
-    try:
-        topoTinDXF = SurveyGDB.exportTopoTINDXF(outCadFolder)
-        mWriter.currentRun.addOutput("TopoTinDXF", topoTinDXF)
-        print "Exported " + topoTinDXF
-    except:
-        mWriter.currentRun.addMessage("Error", "Cannot write output TopoTIN.dxf file.")
-        print "Could not Export Topo TIN DXF"
-    try:
-        topoSurveyDXF = SurveyGDB.exportSurveyTopographyDXF(outCadFolder)
-        mWriter.currentRun.addOutput("TopoSurveyDXF",topoSurveyDXF)
-        print "Exported " + topoSurveyDXF
-    except:
-        mWriter.currentRun.addMessage("Error", "Cannot write output SurveyTopography.dxf file.")
-        print "Could not Export  Topographic Survey DXF."
+    cad_sources = [strInputSurveyGDB] + glob.glob(os.path.join(os.path.dirname(strInputSurveyGDB), "tin*"))
+    cad_entry = manifest.current("CAD_Files",
+                                 lambda: project_manifest.combine([compress_csv] +
+                                                                  [project_manifest.file_fingerprint(source)
+                                                                   for source in cad_sources]))
+    if cad_entry is None:
+        os.makedirs(outCadFolder)
+        cad_messages = []
+        try:
+            topoTinDXF = SurveyGDB.exportTopoTINDXF(outCadFolder)
+            print "Exported " + topoTinDXF
+        except:
+            cad_messages.append("Cannot write output TopoTIN.dxf file.")
+            print "Could not Export Topo TIN DXF"
+        try:
+            topoSurveyDXF = SurveyGDB.exportSurveyTopographyDXF(outCadFolder, compress_csv)
+            print "Exported " + topoSurveyDXF
+        except:
+            cad_messages.append("Cannot write output SurveyTopography.dxf file.")
+            print "Could not Export  Topographic Survey DXF."
+        cad_entry = manifest.record("CAD_Files", cad_messages)
+    for message in cad_entry["messages"]:
+        mWriter.currentRun.addMessage("Error", message)
+    for name, dxf_file in [("TopoTinDXF", "TopoTin.dxf"), ("TopoSurveyDXF", "SurveyTopography.dxf")]:
+        if os.path.isfile(os.path.join(outCadFolder, dxf_file)):
+            mWriter.currentRun.addOutput(name, os.path.join(outCadFolder, dxf_file))
+
+    for output in manifest.remove_stale():
+        print "Removed dataset no longer in the inputs: " + output
+    manifest.save()
     print "Export Complete  at " + str(time.asctime())
     totaltime = ( time.time() - start )
     print "Total Time: {0}s".format(totaltime)
@@ -148,4 +183,6 @@ def main(strInputSurveyGDB, strOutputPath):
 if __name__ == "__main__":
 
     main(sys.argv[1],
-         sys.argv[2])
\ No newline at end of file
+         sys.argv[2],
+         "--refresh" in sys.argv[3:],
+         "--gzip_csv" in sys.argv[3:])
\ No newline at end of file
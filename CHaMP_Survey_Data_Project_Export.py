@@ -4,10 +4,20 @@
 import os
 import sys
 import shutil
-from distutils import dir_util
+import tempfile
+import functools
 import time
 import traceback
 import CHaMP_Data
+import stage_timer
+import stage_executor
+import project_manifest
+import project_staging
+import file_placement
+import blob_store
+import project_archive
+import point_columns
+import raster_blocks
 from Riverscapes import Riverscapes
 
 toolName = "CHaMP Survey Data Project Export"
@@ -26,7 +36,17 @@ def export_survey_project(survey_gdb,
                           raw_inst_file=None,
                           aux_inst_file=None,
                           dxf_file=None,
-                          mapimages_folder=None):
+                          mapimages_folder=None,
+                          timer=None,
+                          io_threads=4,
+                          refresh=False,
+                          placement="auto",
+                          blob_store_folder=None,
+                          archive_format=None,
+                          raster_profile="default",
+                          surface_processes=0,
+                          vector_format="shapefile",
+                          export_point_columns=False):
     """
     export a champ survey visit to Riverscapes project
     :param survey_gdb:
@@ -42,53 +62,139 @@ def export_survey_project(survey_gdb,
     :param aux_inst_file:
     :param dxf_file:
     :param mapimages_folder:
+    :param timer: stage_timer.StageTimer to record the time and memory of each export stage
+    :param io_threads: number of threads copying files while the arcpy stages run. 0 copies in the main thread.
+    :param refresh: keep the datasets of a previous export whose sources have not changed (see project_manifest).
+    :param placement: how input files (and the datasets kept by a refresh) are placed into the project: auto
+                      (reflink, then copy), reflink (clone or fail), hardlink or copy (see file_placement)
+    :param blob_store_folder: folder of a content-addressed store shared by exported projects (see blob_store).
+                              Files are stored once and hard linked into the project (placement is not used).
+    :param archive_format: zip or tar to write the project as the single archive <output_folder>.zip (or .tar)
+                           instead of a folder (see project_archive). Input files are streamed into the archive
+                           from their source (placement is not used). Not used with refresh or blob_store_folder.
+    :param raster_profile: GeoTIFF layout of the rasters: default (stripped, uncompressed) or tiled (tiled,
+                           compressed, with overviews). See CHaMP_Data.RASTER_PROFILES.
+    :param surface_processes: size of the process pool deriving the Hillshade, Slope and Detrended rasters of surveys
+                              without them (see derived_surfaces). 0 derives them in this process.
+    :param vector_format: shapefile (one shapefile per feature class) or geopackage (the survey data, survey extent
+                          and stage feature classes as layers of one GeoPackage, Vectors.gpkg, with full field names).
+                          See CHaMP_Data.VECTOR_FORMATS.
+    :param export_point_columns: also write the survey point feature classes as Parquet files in the Points folder
+                                 (see point_columns). Requires pyarrow.
     :return:
     """
+    print "Checking output directory..."
+    # Make sure we're not passing in some weird short string
+    if output_folder < 3:
+        print "ERROR: Output path is too short."
+        return
+    # Make sure the directory is writeable
+    if os.path.isdir(output_folder) and not os.access(output_folder, os.W_OK):
+        print "ERROR: Output Path is not writeable"
+        return
+    parent_folder = os.path.dirname(os.path.abspath(output_folder))
+    if not os.path.isdir(parent_folder):
+        os.makedirs(parent_folder)
+
+    if archive_format:
+        if refresh or blob_store_folder:
+            raise ValueError("Archive output is not used with refresh or a blob store.")
+        export_survey_project_archive(survey_gdb, topo_tin, ws_tin, channelunits_csv, output_folder, visitid, siteid,
+                                      watershed, year, raw_inst_file, aux_inst_file, dxf_file, mapimages_folder,
+                                      timer, io_threads, placement, archive_format, raster_profile, surface_processes,
+                                      vector_format, export_point_columns)
+        return
+
+    # The project is written into a staging folder and swapped in when complete (see project_staging)
+    staging_folder = project_staging.start(output_folder, refresh, placement)
+    store = blob_store.BlobStore(blob_store_folder) if blob_store_folder else None
+    try:
+        write_survey_project(survey_gdb, topo_tin, ws_tin, channelunits_csv, staging_folder, visitid, siteid,
+                             watershed, year, raw_inst_file, aux_inst_file, dxf_file, mapimages_folder, timer,
+                             io_threads, refresh, placement, store, raster_profile, surface_processes,
+                             vector_format, export_point_columns)
+    except:
+        project_staging.abort(output_folder)
+        raise
+    finally:
+        if store is not None:
+            store.close()
+    try:
+        project_staging.commit(output_folder)
+    except:
+        project_staging.abort(output_folder)
+        raise
+    print "Project written to " + str(output_folder)
+
+
+def export_survey_project_archive(survey_gdb, topo_tin, ws_tin, channelunits_csv, output_folder, visitid, siteid,
+                                  watershed, year, raw_inst_file, aux_inst_file, dxf_file, mapimages_folder, timer,
+                                  io_threads, placement, archive_format, raster_profile, surface_processes,
+                                  vector_format, export_point_columns):
+    """
+    export a champ survey visit to a Riverscapes project archive. The project is written into a local temporary
+    folder and streamed into the archive while it is exported (see project_archive.ArchiveStream). Parameters as
+    export_survey_project.
+    """
+    archive_file = project_archive.archive_path(output_folder, archive_format)
+    timer = stage_timer.StageTimer() if timer is None else timer
+    temp_folder = tempfile.mkdtemp(prefix="champ_project_")
+    try:
+        archive = project_archive.ArchiveStream(temp_folder, archive_file, archive_format)
+        try:
+            write_survey_project(survey_gdb, topo_tin, ws_tin, channelunits_csv, temp_folder, visitid, siteid,
+                                 watershed, year, raw_inst_file, aux_inst_file, dxf_file, mapimages_folder, timer,
+                                 io_threads, False, placement, None, raster_profile, surface_processes,
+                                 vector_format, export_point_columns, archive)
+        except:
+            archive.abort()
+            raise
+        with timer.stage("archive"):
+            archive.close()
+    finally:
+        shutil.rmtree(temp_folder, ignore_errors=True)
+    print "Project written to " + str(archive_file)
+
+
+def write_survey_project(survey_gdb, topo_tin, ws_tin, channelunits_csv, output_folder, visitid, siteid, watershed,
+                         year, raw_inst_file, aux_inst_file, dxf_file, mapimages_folder, timer, io_threads, refresh,
+                         placement, store, raster_profile, surface_processes, vector_format,
+                         export_point_columns, archive=None):
+    """
+    write a champ survey visit to a Riverscapes project in an empty (or seeded, see project_staging) folder.
+    Parameters as export_survey_project.
+    :param archive: project_archive.ArchiveStream the project is streamed into. Input files are placed into the
+                    archive instead of the folder (placement is not used), and the files written by the stages are
+                    added at fixed points between them.
+    """
 
     ws_tin = None if ws_tin.lower() == "none" else ws_tin
     channelunits_csv = None if channelunits_csv.lower() == "none" else channelunits_csv
-    
-    reload(CHaMP_Data)
-    reload(Riverscapes)
+
     start = time.time()
+    timer = stage_timer.StageTimer() if timer is None else timer
     print "Starting" + toolName + " at " + str(time.asctime())
     print "Input SurveyGDB: " + str(survey_gdb)
     print "Output Path: " + str(output_folder)
 
     SurveyGDB = CHaMP_Data.SurveyGeodatabase(survey_gdb)
     log_messages = []
+    # rasters exported with another profile, and vectors in another format, are not kept by a refresh
+    manifest_version = toolVersion
+    if raster_profile != "default":
+        manifest_version += " " + raster_profile
+    if vector_format != "shapefile":
+        manifest_version += " " + vector_format
+    manifest = project_manifest.ProjectManifest(output_folder, manifest_version, refresh)
+    manifest.add_source("SurveyGDB", survey_gdb)
 
     ## OutputWorkspace Prep
-    ### http://stackoverflow.com/questions/185936/delete-folder-contents-in-python ###
     print "Checking input SuveyGDB Folder..."
     if not os.path.isdir(survey_gdb):
         print "ERROR: Input SurveyGDB directory does not exist"
 
-    print "Checking output directory..."
-    # Make sure we're not passing in some weird short string
-    if output_folder < 3:
-        print "ERROR: Output path is too short."
-        return
-    # Make sure the directory is writeable
-    if os.path.isdir(output_folder) and not os.access(output_folder, os.W_OK):
-        print "ERROR: Output Path is not writeable"
-        return
-    # Make the folder if it doesn't exist
-    if not os.path.isdir(output_folder):
-        print "Output Project Folder does not exist: Creating {0}".format(output_folder)
-        os.makedirs(output_folder)
-
-    for file in os.listdir(output_folder):
-        file_path = os.path.join(output_folder, file)
-        try:
-            if os.path.isfile(file_path):
-                print "Deleting existing file: " + str(file_path)
-                os.unlink(file_path)
-            elif os.path.isdir(file_path): 
-                shutil.rmtree(file_path)
-                print "Deleting existing directory: " + str(file_path)
-        except Exception as e:
-            print e
+    if manifest.loaded:
+        print "Refreshing existing project: only datasets with changed sources are exported"
 
     # New Project
     rs_project = Riverscapes.Project()
@@ -117,256 +223,524 @@ def export_survey_project(survey_gdb,
 
     # Inputs
     inputs_folder = os.path.join(output_folder, "Inputs")
-    os.makedirs(inputs_folder)
-
-    # SQLITE
-    sqlite_db_template = os.path.join(os.path.realpath(__file__).rstrip(os.path.basename(__file__)), "SurveyQualityTemplate.sqlite")
-    sqlite_db = os.path.join(inputs_folder, "SurveyQualityDB.sqlite")
-    shutil.copyfile(sqlite_db_template, sqlite_db)
-
-    for table in SurveyGDB.getDatasets("QA"):
-        if table.validateExists():
-            table.export_to_sqlite(sqlite_db)
-
-    rs_project.addInputDataset("Survey Quality Database",
-                               "SurveyQualityDB",
-                               os.path.join("Inputs", "SurveyQuality.sqlite"),
-                               datasettype="SurveyQualityDB")
-
-    if raw_inst_file:
-        for rfile in raw_inst_file.split(","):
-            shutil.copy2(rfile, inputs_folder)
-            ds_raw = Riverscapes.Dataset()
-            ds_raw.create("Instrument File", os.path.join("Inputs", os.path.basename(rfile)), type="InstrumentFile")
-            ds_raw.id = "RawFile"
-            ds_raw.metadata["Type"] = "RawFile"
-            for name, value in dict_instrument_tag_data.iteritems():
-                ds_raw.metadata[str(name)] = str(value)
-            rs_project.InputDatasets["Instrument File"] = ds_raw
-
-    if aux_inst_file:
-        i_aux = 0
-        for afile in aux_inst_file.split(","):
-            i_aux = i_aux + 1
-            shutil.copy2(afile, inputs_folder)
-            ds_aux = Riverscapes.Dataset()
-            ds_aux.create("Auxiliary Instrument File", os.path.join("Inputs", os.path.basename(afile)), type="AuxInstrumentFile")
-            ds_aux.id = "AuxFile" + str(i_aux)
-            rs_project.InputDatasets["Auxiliary Instrument File " + str(i_aux)] = ds_aux
-
-    # if SurveyGDB.fcQaQcRawPoints.exists:
-    if SurveyGDB.fcQaQcRawPoints.validateExists():
-        raw_points_shp = SurveyGDB.fcQaQcRawPoints.exportToShapeFile(inputs_folder, "QaQcPoints")
-        rs_project.addInputDataset(SurveyGDB.fcQaQcRawPoints.rs_name, SurveyGDB.fcQaQcRawPoints.rs_id,
-                                   os.path.join("Inputs", raw_points_shp))
-
-    if dxf_file:
-        dxf_dataset = Riverscapes.Dataset()
-        dxf_dataset.create("Breaklines", os.path.join("Inputs", os.path.basename(dxf_file)))
-        dxf_dataset.id = "BreaklineDXF"
-        if os.path.splitext(dxf_file)[1].lower() == ".dxf":
-            shutil.copy2(dxf_file, inputs_folder)
-            dxf_dataset.metadata["FeatureClassName"] = "Polyline"
-        else:
-            CHaMP_Data.copy_shapefile(dxf_file, os.path.join(inputs_folder, os.path.basename(dxf_file)))
-            dxf_dataset.metadata["FeatureClassType"] = "Shapefile"
-        rs_project.InputDatasets["BreaklineDXF"] = dxf_dataset
-
-    if channelunits_csv:
-        shutil.copy2(channelunits_csv, inputs_folder)
-        rs_project.addInputDataset("Channel Units CSV",
-                                   "channelunitcsv",
-                                   os.path.join("Inputs", os.path.basename(channelunits_csv)),
-                                   datasettype="CSV")
-
-    # Survey Data Realizations
-    if SurveyGDB.has_unprojected():
-        unprojected_folder = os.path.join(output_folder, "SurveyDataUnProjected")
-        os.makedirs(unprojected_folder)
-        unprojected_realization = Riverscapes.SurveyDataRealization(False)
-        unprojected_realization.create("Survey Data Unprojected")
-        unprojected_realization.productVersion = toolVersion
-
-        for dataset in SurveyGDB.get_survey_datasets(False):
-            if dataset.validateExists():
-                dataset.exportToShapeFile(unprojected_folder)
+    make_folder(inputs_folder)
+
+    # Pass-through input files are placed through the blob store (if any) or with the placement strategy
+    if store is not None:
+        place_files, place_tree = store.place_files, store.place_tree
+    elif archive is not None:
+        place_files, place_tree = archive.place_files, archive.place_tree
+    else:
+        place_files = functools.partial(file_placement.place_files, strategy=placement)
+        place_tree = functools.partial(file_placement.place_tree, strategy=placement)
+
+    # File copies run in background threads while the arcpy stages below run in this thread.
+    with stage_executor.StageExecutor(io_threads, timer) as executor:
+
+        def stream_written():
+            """ stream the files of the completed stages into the archive (in the same order on every export)"""
+            if archive is not None:
+                executor.wait_all()  # input files placed by background stages
+                archive.add_written()
+
+        # SQLITE
+        sqlite_db_template = os.path.join(os.path.realpath(__file__).rstrip(os.path.basename(__file__)), "SurveyQualityTemplate.sqlite")
+        sqlite_db = os.path.join(inputs_folder, "SurveyQualityDB.sqlite")
+        qa_tables = [table for table in SurveyGDB.getDatasets("QA") if table.validateExists()]
+        sqlite_entry = manifest.current(os.path.join("Inputs", "SurveyQualityDB.sqlite"),
+                                        lambda: project_manifest.combine(table.fingerprint() for table in qa_tables),
+                                        "SurveyGDB")
+        if sqlite_entry is None:
+            executor.submit("sqlite_template", file_placement.place, sqlite_db_template, sqlite_db, "auto", True)
+
+        instrument_files = []
+        if raw_inst_file:
+            for rfile in raw_inst_file.split(","):
+                instrument_files.append(rfile)
+                ds_raw = Riverscapes.Dataset()
+                ds_raw.create("Instrument File", os.path.join("Inputs", os.path.basename(rfile)), type="InstrumentFile")
+                ds_raw.id = "RawFile"
+                ds_raw.metadata["Type"] = "RawFile"
+                for name, value in dict_instrument_tag_data.iteritems():
+                    ds_raw.metadata[str(name)] = str(value)
+                rs_project.InputDatasets["Instrument File"] = ds_raw
+
+        if aux_inst_file:
+            i_aux = 0
+            for afile in aux_inst_file.split(","):
+                i_aux = i_aux + 1
+                instrument_files.append(afile)
+                ds_aux = Riverscapes.Dataset()
+                ds_aux.create("Auxiliary Instrument File", os.path.join("Inputs", os.path.basename(afile)), type="AuxInstrumentFile")
+                ds_aux.id = "AuxFile" + str(i_aux)
+                rs_project.InputDatasets["Auxiliary Instrument File " + str(i_aux)] = ds_aux
+
+        executor.submit("instrument_files", place_files, changed_files(manifest, instrument_files, "Inputs"),
+                        inputs_folder)
+
+        input_files = []
+        if dxf_file:
+            dxf_dataset = Riverscapes.Dataset()
+            dxf_dataset.create("Breaklines", os.path.join("Inputs", os.path.basename(dxf_file)))
+            dxf_dataset.id = "BreaklineDXF"
+            if os.path.splitext(dxf_file)[1].lower() == ".dxf":
+                input_files.append(dxf_file)
+                dxf_dataset.metadata["FeatureClassName"] = "Polyline"
+            else:
+                dxf_output = os.path.join("Inputs", os.path.basename(dxf_file))
+                if manifest.current(dxf_output, project_manifest.file_fingerprint(dxf_file)) is None:
+                    with timer.stage("input_files"):
+                        CHaMP_Data.copy_shapefile(dxf_file, os.path.join(output_folder, dxf_output))
+                    manifest.record(dxf_output)
+                dxf_dataset.metadata["FeatureClassType"] = "Shapefile"
+            rs_project.InputDatasets["BreaklineDXF"] = dxf_dataset
+
+        if channelunits_csv:
+            input_files.append(channelunits_csv)
+            rs_project.addInputDataset("Channel Units CSV",
+                                       "channelunitcsv",
+                                       os.path.join("Inputs", os.path.basename(channelunits_csv)),
+                                       datasettype="CSV")
+
+        executor.submit("input_copies", place_files, changed_files(manifest, input_files, "Inputs"), inputs_folder)
+
+        # Topography TINs
+        topography_folder_base = os.path.join("Topography", "TIN0001")
+        topography_folder = os.path.join(output_folder, topography_folder_base)
+        make_folder(topography_folder)
+
+        TIN = CHaMP_Data.EsriTIN(topo_tin)
+        tin_output = os.path.join(topography_folder_base, TIN.basename)
+        if manifest.current(tin_output, project_manifest.file_fingerprint(topo_tin)) is None:
+            executor.submit("tin_copy", place_tree, topo_tin, os.path.join(output_folder, tin_output))
+            manifest.record(tin_output)
+        if ws_tin:
+            WSETIN = CHaMP_Data.EsriTIN(ws_tin)
+            wsetin_output = os.path.join(topography_folder_base, WSETIN.basename)
+            if manifest.current(wsetin_output, project_manifest.file_fingerprint(ws_tin)) is None:
+                executor.submit("wsetin_copy", place_tree, ws_tin, os.path.join(output_folder, wsetin_output))
+                manifest.record(wsetin_output)
+
+        # Map Images
+        mapimages_project_folder = None
+        images = []
+        if mapimages_folder and os.path.exists(mapimages_folder):
+            mapimages_project_folder = os.path.join(output_folder, "MapImages")
+            make_folder(mapimages_project_folder)
+            import glob
+            images = glob.glob(os.path.join(mapimages_folder, "*.png")) + glob.glob(os.path.join(mapimages_folder, "*.jpg"))
+            executor.submit("mapimages_copy", place_files, changed_files(manifest, images, "MapImages"),
+                            mapimages_project_folder)
+
+            reports_folder = os.path.join(mapimages_folder, "Reports")
+            if os.path.exists(reports_folder):
+                if manifest.current("Reports", project_manifest.file_fingerprint(reports_folder)) is None:
+                    executor.submit("reports_copy", place_tree, reports_folder, os.path.join(output_folder, "Reports"))
+                    manifest.record("Reports")
+
+        if sqlite_entry is None:
+            with timer.stage("sqlite_qa"):
+                executor.wait("sqlite_template")
+                for table in qa_tables:
+                    table.export_to_sqlite(sqlite_db)
+            manifest.record(os.path.join("Inputs", "SurveyQualityDB.sqlite"))
+
+        rs_project.addInputDataset("Survey Quality Database",
+                                   "SurveyQualityDB",
+                                   os.path.join("Inputs", "SurveyQuality.sqlite"),
+                                   datasettype="SurveyQualityDB")
+
+        with timer.stage("input_files"):
+            # if SurveyGDB.fcQaQcRawPoints.exists:
+            if SurveyGDB.fcQaQcRawPoints.validateExists():
+                raw_points_output = os.path.join("Inputs", "QaQcPoints.shp")
+                if manifest.current(raw_points_output, SurveyGDB.fcQaQcRawPoints.fingerprint, "SurveyGDB") is None:
+                    SurveyGDB.fcQaQcRawPoints.exportToShapeFile(inputs_folder, "QaQcPoints")
+                    manifest.record(raw_points_output)
+                rs_project.addInputDataset(SurveyGDB.fcQaQcRawPoints.rs_name, SurveyGDB.fcQaQcRawPoints.rs_id,
+                                           raw_points_output)
+
+        # Survey data, survey extent and stage feature classes
+        vectors = VectorOutput(manifest, output_folder, vector_format, SurveyGDB)
+
+        # Survey Data Realizations
+        with timer.stage("survey_data_unprojected"):
+            if SurveyGDB.has_unprojected():
+                unprojected_realization = Riverscapes.SurveyDataRealization(False)
+                unprojected_realization.create("Survey Data Unprojected")
+                unprojected_realization.productVersion = toolVersion
+
+                for dataset in SurveyGDB.get_survey_datasets(False):
+                    if dataset.validateExists():
+                        output, entry = vectors.export(dataset, "SurveyDataUnProjected", dataset.Name)
+                        ds = Riverscapes.Dataset()
+                        ds.create(dataset.rs_name, output)
+                        ds.id = dataset.rs_id
+                        unprojected_realization.datasets[ds.id] = ds
+                        rs_project.addRealization(unprojected_realization, "survey_data_unprojected")
+
+                if SurveyGDB.tblTransformations.validateExists():
+                    unprojected_folder = os.path.join(output_folder, "SurveyDataUnProjected")
+                    make_folder(unprojected_folder)
+                    output = os.path.join("SurveyDataUnProjected", "Transformations.dbf")
+                    if manifest.current(output, SurveyGDB.tblTransformations.fingerprint, "SurveyGDB") is None:
+                        SurveyGDB.tblTransformations.export_to_dbf(unprojected_folder, "Transformations.dbf")
+                        manifest.record(output)
+
+        with timer.stage("survey_data_projected"):
+            if SurveyGDB.projected:
+                projected_realization = Riverscapes.SurveyDataRealization(True)
+                projected_realization.create("Survey Data Projected")
+                projected_realization.promoted = True
+                projected_realization.productVersion = toolVersion
+
+                for dataset in SurveyGDB.get_survey_datasets(True):
+                    if dataset.validateExists():
+                        output, entry = vectors.export(dataset, "SurveyData",
+                                                       fix=functools.partial(enable_breakline_z, SurveyGDB, timer),
+                                                       force_z_enabled=True)
+                        ds = Riverscapes.Dataset()
+                        ds.create(dataset.rs_name, output)
+                        ds.id = dataset.rs_id
+                        ds.metadata.update(entry["metadata"])
+                        log_messages.extend(entry["messages"])
+                        projected_realization.datasets[ds.id] = ds
+
+                output, entry = vectors.export(SurveyGDB.SurveyExtent, os.path.join("SurveyData", "SurveyExtents"))
                 ds = Riverscapes.Dataset()
-                ds.create(dataset.rs_name, os.path.join("SurveyDataUnProjected", dataset.shapefile_basename()))
-                ds.id = dataset.rs_id
-                unprojected_realization.datasets[ds.id] = ds
-                rs_project.addRealization(unprojected_realization, "survey_data_unprojected")
-
-        if SurveyGDB.tblTransformations.validateExists():
-            SurveyGDB.tblTransformations.export_to_dbf(unprojected_folder, "Transformations.dbf")
-
-    if SurveyGDB.projected:
-        projected_folder = os.path.join(output_folder, "SurveyData")
-        os.makedirs(projected_folder)
-        projected_realization = Riverscapes.SurveyDataRealization(True)
-        projected_realization.create("Survey Data Projected")
-        projected_realization.promoted = True
-        projected_realization.productVersion = toolVersion
-
-        for dataset in SurveyGDB.get_survey_datasets(True):
-            if dataset.validateExists():
-                dataset.exportToShapeFile(projected_folder, force_z_enabled=True)
+                ds.create(SurveyGDB.SurveyExtent.rs_name, output)
+                ds.id = SurveyGDB.SurveyExtent.rs_id
+                ds.attributes["active"] = "true"
+                projected_realization.survey_extents[ds.id] = ds
+                rs_project.addRealization(projected_realization, "survey_data_projected")
+
+        if export_point_columns:
+            with timer.stage("point_columns"):
+                make_folder(os.path.join(output_folder, "Points"))
+                for dataset in point_columns.point_datasets(SurveyGDB):
+                    output = os.path.join("Points", dataset.Name + point_columns.EXTENSION)
+                    if manifest.current(output, dataset.fingerprint, "SurveyGDB") is None:
+                        point_columns.export_points(dataset.filename, os.path.join(output_folder, output),
+                                                    {"VisitID": visitid} if visitid else None)
+                        manifest.record(output)
+            stream_written()
+
+        # Topography Realization
+        ds_tin = Riverscapes.Dataset()
+        ds_tin.create("TopoTIN", tin_output, "TIN")
+        ds_tin.id = TIN.basename
+        ds_tin.attributes["active"] = "true"
+
+        topography_realization = Riverscapes.TopographyRealization("Topography Realization", ds_tin)
+        topography_realization.id = "topography"
+        topography_realization.productVersion = toolVersion
+
+        with timer.stage("stage_shapefiles"):
+            for dataset in SurveyGDB.getDatasets("stage"):
+                if dataset.validateExists():
+                    ds = Riverscapes.Dataset()
+                    stage_folder_base = os.path.join(topography_folder_base, "Stages", "Wetted")if dataset.stage == "wetted" else os.path.join(topography_folder_base, "Stages", "Bankfull")
+                    output, entry = vectors.export(dataset, stage_folder_base, fix=add_stage_fields)
+                    log_messages.extend(entry["messages"])
+                    ds.create(dataset.rs_name, output)
+                    ds.id = dataset.rs_id
+                    ds.attributes["stage"] = dataset.stage
+                    ds.attributes["type"] = dataset.stage_type
+                    topography_realization.stages[ds.id] = ds
+        vectors.close()
+        stream_written()
+
+        with timer.stage("raster_exports"):
+            for dataset in SurveyGDB.getDatasets("topography"):
+                output = os.path.join(topography_folder_base, dataset.basename())
+                if dataset.validateExists():
+                    entry = manifest.current(output, dataset.fingerprint, "SurveyGDB")
+                    if entry is None:
+                        dataset.export(topography_folder, raster_profile)
+                        entry = manifest.record(output)
+                    ds = Riverscapes.Dataset()
+                    ds.create(dataset.rs_name, output, dataset.rs_type)
+                    ds.id = dataset.rs_id
+                    for key, value in raster_metadata(entry, os.path.join(output_folder, output)).iteritems():
+                        ds.metadata[key] = value
+                    if dataset.rs_name == "DEM":
+                        for key, value in dataset.get_extents().iteritems():
+                            ds.metadata[key] = str(value)
+                    log_messages.extend(entry["messages"])
+                    topography_realization.topography[ds.id] = ds
+                elif dataset.rs_name == "Water Depth" and SurveyGDB.WSEDEM.validateExists():
+                    entry = manifest.current(output,
+                                             lambda: project_manifest.combine([SurveyGDB.DEM.fingerprint(),
+                                                                               SurveyGDB.WSEDEM.fingerprint()]),
+                                             "SurveyGDB")
+                    if entry is None:
+                        dataset.create(SurveyGDB.DEM.filename, SurveyGDB.WSEDEM.filename)
+                        dataset.export(topography_folder, raster_profile)
+                        entry = manifest.record(output, ["Export: Added WaterDepth raster on Export."])
+                    ds = Riverscapes.Dataset()
+                    ds.create(dataset.rs_name, output, dataset.rs_type)
+                    ds.id = dataset.rs_id
+                    for key, value in raster_metadata(entry, os.path.join(output_folder, output)).iteritems():
+                        ds.metadata[key] = value
+                    topography_realization.topography[ds.id] = ds
+                    log_messages.extend(entry["messages"])
+                else:
+                    entry = derive_surface(manifest, SurveyGDB, dataset, output, topography_folder, raster_profile,
+                                           surface_processes)
+                    if entry is not None:
+                        ds = Riverscapes.Dataset()
+                        ds.create(dataset.rs_name, output, dataset.rs_type)
+                        ds.id = dataset.rs_id
+                        for key, value in raster_metadata(entry, os.path.join(output_folder, output)).iteritems():
+                            ds.metadata[key] = value
+                        topography_realization.topography[ds.id] = ds
+                        log_messages.extend(entry["messages"])
+            stream_written()
+
+        if ws_tin:
+            ds_wsetin = Riverscapes.Dataset()
+            ds_wsetin.create("Water Surface TIN", wsetin_output, "WaterSurfaceTIN")
+            ds_wsetin.id = "WaterSurfaceTIN"
+            ds_wsetin.attributes["active"] = "true"
+
+            topography_realization.topography[ds_wsetin.id] = ds_wsetin
+
+        with timer.stage("raster_exports"):
+            assoc_surfaces_folder = os.path.join(topography_folder, "AssocSurfaces")
+            make_folder(assoc_surfaces_folder)
+            for dataset in SurveyGDB.getDatasets("surfaces"):
+                output = os.path.join(topography_folder_base, "AssocSurfaces", dataset.basename())
+                if dataset.validateExists():
+                    entry = manifest.current(output, dataset.fingerprint, "SurveyGDB")
+                    if entry is None:
+                        dataset.export(assoc_surfaces_folder, raster_profile)
+                        entry = manifest.record(output)
+                else:
+                    entry = derive_surface(manifest, SurveyGDB, dataset, output, assoc_surfaces_folder,
+                                           raster_profile, surface_processes)
+                    if entry is None:
+                        continue
+                    log_messages.extend(entry["messages"])
                 ds = Riverscapes.Dataset()
-                ds.create(dataset.rs_name, os.path.join("SurveyData", dataset.shapefile_basename()))
+                ds.create(dataset.rs_name, output, dataset.rs_type)
                 ds.id = dataset.rs_id
-                # check if z values for breaklines exist.
-                if dataset.rs_name == "Breaklines" and not dataset.test_z():
-                    import ZSnap
-                    ZSnap.polylines(os.path.join(projected_folder, "Breaklines.shp"),[SurveyGDB.Topo_Points.filename,
-                                                                            SurveyGDB.EdgeOfWater_Points.filename,
-                                                                            SurveyGDB.Stream_Features.filename])
-                    ds.metadata["ExportNote"] = "Enabled Z Values on Export"
-                    log_messages.append("Export: Breaklines: Enabled Z Values on Export")
-                projected_realization.datasets[ds.id] = ds
-
-        survey_extents_folder = os.path.join(projected_folder, "SurveyExtents")
-        os.makedirs(survey_extents_folder)
-        SurveyGDB.SurveyExtent.exportToShapeFile(survey_extents_folder)
-        ds = Riverscapes.Dataset()
-        ds.create(SurveyGDB.SurveyExtent.rs_name, os.path.join("SurveyData", "SurveyExtents",
-                                                               SurveyGDB.SurveyExtent.shapefile_basename()))
-        ds.id = SurveyGDB.SurveyExtent.rs_id
-        ds.attributes["active"] = "true"
-        projected_realization.survey_extents[ds.id] = ds
-        rs_project.addRealization(projected_realization, "survey_data_projected")
-
-    # Topography Realization
-    topography_folder_base = os.path.join("Topography", "TIN0001")
-    topography_folder = os.path.join(output_folder, topography_folder_base)
-    os.makedirs(topography_folder)
-
-    TIN = CHaMP_Data.EsriTIN(topo_tin)
-    TIN.copy_tin(os.path.join(topography_folder, TIN.basename))
-
-    ds_tin = Riverscapes.Dataset()
-    ds_tin.create("TopoTIN", os.path.join(topography_folder_base, TIN.basename), "TIN")
-    ds_tin.id = TIN.basename
-    ds_tin.attributes["active"] = "true"
-
-    topography_realization = Riverscapes.TopographyRealization("Topography Realization", ds_tin)
-    topography_realization.id = "topography"
-    topography_realization.productVersion = toolVersion
-
-    stage_wetted_folder = os.path.join(topography_folder, "Stages", "Wetted")
-    stage_bankfull_folder = os.path.join(topography_folder, "Stages", "Bankfull")
-    os.makedirs(stage_bankfull_folder)
-    os.makedirs(stage_wetted_folder)
-
-    for dataset in SurveyGDB.getDatasets("stage"):
-        if dataset.validateExists():
-            ds = Riverscapes.Dataset()
-            stage_folder = stage_wetted_folder if dataset.stage == "wetted" else stage_bankfull_folder
-            stage_folder_base = os.path.join(topography_folder_base, "Stages", "Wetted")if dataset.stage == "wetted" else os.path.join(topography_folder_base, "Stages", "Bankfull")
-            dataset.exportToShapeFile(stage_folder)
-            ds.create(dataset.rs_name, os.path.join(stage_folder_base, dataset.shapefile_basename()))
-            if dataset.Name in ["BankfullCL", "WettedCL", "CenterLine", "Centerline"]:
-                fChannel = CHaMP_Data.FieldChannel()
-                out_shp = os.path.join(stage_folder, dataset.shapefile_basename())
-                if not fChannel.field_exists(out_shp):
-                    fChannel.create_field(out_shp, True)
-                    log_messages.append("Export: Added Channel Field to " + dataset.shapefile_basename())
-                    if fChannel.get_count(out_shp) == 1:
-                        fChannel.set_value(out_shp, '"Main"', True)
-                        log_messages.append("Export: Set one (1) channel type to 'Main' in " + dataset.shapefile_basename())
-                    else:
-                        log_messages.append("Export: Unable to find one (1) main channel in " + dataset.shapefile_basename())
-
-            if dataset.Name in ["WaterExtent", "Bankfull"]:
-                fExtentType = CHaMP_Data.FieldExtentType()
-                out_shp = os.path.join(stage_folder, dataset.shapefile_basename())
-                if not fExtentType.field_exists(out_shp):
-                    fExtentType.create_field(out_shp, True)
-                    log_messages.append("Export: Added ExtentType Field to " + dataset.shapefile_basename())
-                    if fExtentType.get_count(out_shp) == 1:
-                        fExtentType.set_value(out_shp, '"Channel"')
-                        log_messages.append("Export: Set one (1) extent type to 'Channel' in " + dataset.shapefile_basename())
-                    else:
-                        log_messages.append("Export: Unable to find one (1) main channel feature in " + dataset.shapefile_basename())
-
-            ds.id = dataset.rs_id
-            ds.attributes["stage"] = dataset.stage
-            ds.attributes["type"] = dataset.stage_type
-            topography_realization.stages[ds.id] = ds
-
-    for dataset in SurveyGDB.getDatasets("topography"):
-        if dataset.validateExists():
-            ds = Riverscapes.Dataset()
-            dataset.export(topography_folder)
-            ds.create(dataset.rs_name, os.path.join(topography_folder_base, dataset.basename()), dataset.rs_type)
-            ds.id = dataset.rs_id
-            if dataset.rs_name == "DEM":
-                for key, value in dataset.get_extents().iteritems():
-                    ds.metadata[key] = str(value)
-            topography_realization.topography[ds.id] = ds
-        elif dataset.rs_name == "Water Depth" and SurveyGDB.WSEDEM.validateExists():
-            dataset.create(SurveyGDB.DEM.filename, SurveyGDB.WSEDEM.filename)
-            ds = Riverscapes.Dataset()
-            dataset.export(topography_folder)
-            ds.create(dataset.rs_name, os.path.join(topography_folder_base, dataset.basename()), dataset.rs_type)
-            ds.id = dataset.rs_id
-            topography_realization.topography[ds.id] = ds
-            log_messages.append("Export: Added WaterDepth raster on Export.")
-
-    if ws_tin:
-        WSETIN = CHaMP_Data.EsriTIN(ws_tin)
-        WSETIN.copy_tin(os.path.join(topography_folder, WSETIN.basename))
-        ds_wsetin = Riverscapes.Dataset()
-
-        ds_wsetin.create("Water Surface TIN", os.path.join(topography_folder_base, WSETIN.basename), "WaterSurfaceTIN")
-        ds_wsetin.id = "WaterSurfaceTIN"
-        ds_wsetin.attributes["active"] = "true"
-
-        topography_realization.topography[ds_wsetin.id] = ds_wsetin
-
-    assoc_surfaces_folder = os.path.join(topography_folder, "AssocSurfaces")
-    os.makedirs(assoc_surfaces_folder)
-    for dataset in SurveyGDB.getDatasets("surfaces"):
-        if dataset.validateExists():
-            ds = Riverscapes.Dataset()
-            dataset.export(assoc_surfaces_folder)
-            ds.create(dataset.rs_name, os.path.join(topography_folder_base, "AssocSurfaces", dataset.basename()), dataset.rs_type)
-            ds.id = dataset.rs_id
-            topography_realization.assocated_surfaces[ds.id] = ds
-
-    rs_project.addRealization(topography_realization, topography_realization.id)
-    rs_project.writeProjectXML()
-
-    if mapimages_folder and os.path.exists(mapimages_folder):
-        mapimages_project_folder = os.path.join(output_folder, "MapImages")
-        os.makedirs(mapimages_project_folder)
-        import glob
-        images = []
-        for image in glob.glob(os.path.join(mapimages_folder, "*.png")) + glob.glob(os.path.join(mapimages_folder, "*.jpg")):
-            image_name = os.path.basename(image)
-            shutil.copyfile(image, os.path.join(mapimages_project_folder, image_name))
-            images.append(image_name)
-
-        SurveyGDB.tblMapImages.export_mapimages_xml(os.path.join(mapimages_project_folder, "mapimages.xml"), images)
-
-        reports_folder = os.path.join(mapimages_folder, "Reports")
-        if os.path.exists(reports_folder):
-            os.makedirs(os.path.join(output_folder, "Reports"))
-            dir_util.copy_tree(reports_folder, os.path.join(output_folder, "Reports"))
-
-    # Do something with custom datasets
-    custom_datasets = SurveyGDB.export_custom_datasets(os.path.join(output_folder, "CustomData"))
-    for custom_dataset in custom_datasets:
-        log_messages.append("Exported Custom Dataset: {}".format(custom_dataset))
+                for key, value in raster_metadata(entry, os.path.join(output_folder, output)).iteritems():
+                    ds.metadata[key] = value
+                topography_realization.assocated_surfaces[ds.id] = ds
+            stream_written()
+
+        with timer.stage("project_xml"):
+            rs_project.addRealization(topography_realization, topography_realization.id)
+            rs_project.writeProjectXML()
+
+        if mapimages_project_folder:
+            with timer.stage("mapimages"):
+                SurveyGDB.tblMapImages.export_mapimages_xml(os.path.join(mapimages_project_folder, "mapimages.xml"),
+                                                            [os.path.basename(image) for image in images])
+
+        # Do something with custom datasets
+        with timer.stage("custom_datasets"):
+            # custom datasets are found in the geodatabase inventory and are not in the manifest: always exported again
+            custom_datasets = SurveyGDB.export_custom_datasets(os.path.join(output_folder, "CustomData"))
+            for custom_dataset in custom_datasets:
+                log_messages.append("Exported Custom Dataset: {}".format(custom_dataset))
+        stream_written()
+
+    for output in manifest.remove_stale():
+        print "Removed dataset no longer in the inputs: " + output
+    manifest.save()
 
     log_messages.append("Exported by {} version {}".format(toolName, toolVersion))
-    SurveyGDB.tblLog.export_as_xml(os.path.join(output_folder, "log.xml"), log_messages)
+    with timer.stage("log_xml"):
+        SurveyGDB.tblLog.export_as_xml(os.path.join(output_folder, "log.xml"), log_messages)
+
+    if store is not None:
+        with timer.stage("blob_store"):
+            store.ingest_tree(output_folder)
 
     totaltime = ( time.time() - start )
     print "Total Time: {0}s".format(totaltime)
+    for line in timer.summary():
+        print line
     print "Export Complete  at " + str(time.asctime())
             
     return
 
 
+def make_folder(folder):
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+
+
+GEOPACKAGE_NAME = "Vectors.gpkg"
+
+
+class VectorOutput(object):
+    """
+    Writes the survey data, survey extent and stage feature classes of a project: as shapefiles in the folders of the
+    project, or as the layers of one GeoPackage (GEOPACKAGE_NAME) in the project folder.
+
+    Files in a project must not be edited once exported (see blob_store), so the GeoPackage is a single output of the
+    manifest: it is kept if none of its feature classes has changed, otherwise it is written again.
+    """
+
+    def __init__(self, manifest, output_folder, vector_format, survey_gdb):
+        """ :param vector_format: one of CHaMP_Data.VECTOR_FORMATS"""
+        if vector_format not in CHaMP_Data.VECTOR_FORMATS:
+            raise ValueError("Unknown vector format {}. Use one of {}".format(vector_format,
+                                                                              CHaMP_Data.VECTOR_FORMATS))
+        self.manifest = manifest
+        self.output_folder = output_folder
+        self.geopackage = None
+        if vector_format == "geopackage":
+            self.geopackage = os.path.join(output_folder, GEOPACKAGE_NAME)
+            datasets = survey_vectors(survey_gdb)
+            self.entry = manifest.current(GEOPACKAGE_NAME,
+                                          lambda: project_manifest.combine((dataset.Name, dataset.fingerprint())
+                                                                           for dataset in datasets),
+                                          "SurveyGDB")
+            self.layers = {} if self.entry is None else self.entry["metadata"]["layers"]
+            if self.entry is None:
+                CHaMP_Data.create_geopackage(self.geopackage)
+
+    def export(self, dataset, folder, layer=None, fix=None, **kwargs):
+        """
+        export a feature class, unless it is current.
+        :param folder: folder of the shapefile, relative to the project folder
+        :param layer: name of the GeoPackage layer (default dataset.outName)
+        :param fix: function(dataset, output feature class, output name) run after the export, returning a tuple of
+                    (messages, metadata)
+        :param kwargs: passed to exportToShapeFile or exportToGeoPackage
+        :return: tuple of (output path relative to the project folder, entry with the "messages" and "metadata" of
+                 the export)
+        """
+        if self.geopackage is None:
+            output = os.path.join(folder, dataset.shapefile_basename())
+            entry = self.manifest.current(output, dataset.fingerprint, "SurveyGDB")
+            if entry is None:
+                make_folder(os.path.join(self.output_folder, folder))
+                dataset.exportToShapeFile(os.path.join(self.output_folder, folder), **kwargs)
+                messages, metadata = ([], {}) if fix is None else \
+                    fix(dataset, os.path.join(self.output_folder, output), dataset.shapefile_basename())
+                entry = self.manifest.record(output, messages, metadata)
+            return output, entry
+        layer = dataset.outName if layer is None else layer
+        if self.entry is None:
+            out_fc = dataset.exportToGeoPackage(self.geopackage, layer, **kwargs)
+            messages, metadata = ([], {}) if fix is None else fix(dataset, out_fc, layer)
+            self.layers[layer] = {"messages": messages, "metadata": metadata}
+        return os.path.join(GEOPACKAGE_NAME, layer), self.layers[layer]
+
+    def close(self):
+        """ record the GeoPackage, once all its layers are exported"""
+        if self.geopackage is not None and self.entry is None:
+            self.manifest.record(GEOPACKAGE_NAME, metadata={"layers": self.layers})
+
+
+def survey_vectors(survey_gdb):
+    """ the feature classes of a survey written by VectorOutput"""
+    datasets = []
+    if survey_gdb.has_unprojected():
+        datasets.extend(survey_gdb.get_survey_datasets(False))
+    if survey_gdb.projected:
+        datasets.extend(survey_gdb.get_survey_datasets(True))
+        datasets.append(survey_gdb.SurveyExtent)
+    datasets.extend(survey_gdb.getDatasets("stage"))
+    return [dataset for dataset in datasets if dataset.validateExists()]
+
+
+def enable_breakline_z(survey_gdb, timer, dataset, out_fc, name):
+    """ add z values to exported breaklines without them, from the survey points (see ZSnap)"""
+    if dataset.rs_name != "Breaklines" or dataset.test_z():
+        return [], {}
+    with timer.stage("zsnap"):
+        import ZSnap
+        ZSnap.polylines(out_fc, [survey_gdb.Topo_Points.filename,
+                                 survey_gdb.EdgeOfWater_Points.filename,
+                                 survey_gdb.Stream_Features.filename])
+    return ["Export: Breaklines: Enabled Z Values on Export"], {"ExportNote": "Enabled Z Values on Export"}
+
+
+def add_stage_fields(dataset, out_fc, name):
+    """ add the Channel field to exported centerlines and the ExtentType field to exported extents, if missing"""
+    messages = []
+    short_fieldname = out_fc.lower().endswith(".shp")
+    if dataset.Name in ["BankfullCL", "WettedCL", "CenterLine", "Centerline"]:
+        fChannel = CHaMP_Data.FieldChannel()
+        if not fChannel.field_exists(out_fc):
+            fChannel.create_field(out_fc, short_fieldname)
+            messages.append("Export: Added Channel Field to " + name)
+            if fChannel.get_count(out_fc) == 1:
+                fChannel.set_value(out_fc, '"Main"', short_fieldname)
+                messages.append("Export: Set one (1) channel type to 'Main' in " + name)
+            else:
+                messages.append("Export: Unable to find one (1) main channel in " + name)
+
+    if dataset.Name in ["WaterExtent", "Bankfull"]:
+        fExtentType = CHaMP_Data.FieldExtentType()
+        if not fExtentType.field_exists(out_fc):
+            fExtentType.create_field(out_fc, short_fieldname)
+            messages.append("Export: Added ExtentType Field to " + name)
+            if fExtentType.get_count(out_fc) == 1:
+                fExtentType.set_value(out_fc, '"Channel"', short_fieldname)
+                messages.append("Export: Set one (1) extent type to 'Channel' in " + name)
+            else:
+                messages.append("Export: Unable to find one (1) main channel feature in " + name)
+    return messages, {}
+
+
+def derive_surface(manifest, survey_gdb, dataset, output, folder, raster_profile, processes):
+    """
+    derive a raster missing from the survey geodatabase from the DEM (see CHaMP_Data.GISRaster.derive).
+    :return: manifest entry of the derived raster (with its statistics, see raster_metadata), or None if it cannot
+             be derived
+    """
+    if not dataset.derivable or not survey_gdb.DEM.validateExists():
+        return None
+    sources = [survey_gdb.DEM]
+    if dataset is survey_gdb.DetrendedDEM:
+        sources.extend([survey_gdb.Wetted_Centerline, survey_gdb.Bankfull_Centerline])
+    entry = manifest.current(output,
+                             lambda: project_manifest.combine([dataset.name] + [source.fingerprint() for source in sources
+                                                                                if source.validateExists()]),
+                             "SurveyGDB")
+    if entry is None:
+        statistics = dataset.export_derived(survey_gdb, folder, raster_profile, processes)
+        if not statistics:
+            return None
+        entry = manifest.record(output, ["Export: Added {} raster derived from the DEM on Export.".format(dataset.name)])
+        raster_metadata(entry, None, statistics)
+    return entry
+
+
+def raster_metadata(entry, raster, statistics=None):
+    """
+    statistics of an exported raster (see raster_blocks.Statistics) as dataset metadata. They are kept in the
+    manifest entry of the raster, so a raster kept by a refresh is not read again.
+    :param raster: the exported GeoTIFF. Its statistics are those stored when it was written (see
+                   raster_blocks.stored_statistics), and only computed from its blocks if it has none.
+    :param statistics: statistics collected while the raster was written (see raster_blocks.map_blocks)
+    """
+    if "valid_cells" not in entry["metadata"]:
+        statistics = statistics or raster_blocks.stored_statistics(raster) or raster_blocks.statistics(raster)
+        for key, value in statistics.iteritems():
+            if value is not None:
+                entry["metadata"][key] = ",".join(str(item) for item in value) if isinstance(value, (list, tuple)) \
+                    else str(value)
+    return entry["metadata"]
+
+
+def changed_files(manifest, files, folder):
+    """ input files that are not current in the project folder (see project_manifest). Records them as exported."""
+    changed = []
+    for file_path in files:
+        output = os.path.join(folder, os.path.basename(file_path))
+        if manifest.current(output, project_manifest.file_fingerprint(file_path)) is None:
+            manifest.record(output)
+            changed.append(file_path)
+    return changed
+
+
 def main():
     import argparse
     parser = argparse.ArgumentParser()
@@ -384,6 +758,15 @@ def main():
     parser.add_argument('--auxinstrumentfile', help="auxiliary instrument files", type=str, default=None)
     parser.add_argument('--dxffile', help="Path to dxf file", type=str, default=None)
     parser.add_argument('--mapimagesfolder', help="Path to map images folder", type=str, default=None)
+    parser.add_argument('--refresh', help="Refresh an existing project: only export the datasets whose sources have changed since the last export.", action='store_true', default=False)
+    parser.add_argument('--placement', help="How input files are placed into the project: auto (reflink, then copy), reflink (clone or fail), hardlink (shares the data of the input files: opt in only) or copy.", choices=file_placement.STRATEGIES, default="auto")
+    parser.add_argument('--blob_store', help="Folder of a content-addressed store shared by exported projects: files are stored once and hard linked into the project.", type=str, default=None)
+    parser.add_argument('--io_threads', help="Number of threads copying files while the survey data is converted. 0 to copy in the main thread.", type=int, default=4)
+    parser.add_argument('--raster_profile', help="GeoTIFF layout of the rasters: default (stripped, uncompressed) or tiled (tiled, compressed, with overviews).", choices=CHaMP_Data.RASTER_PROFILES, default="default")
+    parser.add_argument('--surface_processes', help="Number of processes deriving the Hillshade, Slope and Detrended rasters of surveys without them. 0 to derive them in the main process.", type=int, default=0)
+    parser.add_argument('--vector_format', help="Format of the survey data and stage feature classes: shapefile (one shapefile each) or geopackage (layers of one GeoPackage, with full field names).", choices=CHaMP_Data.VECTOR_FORMATS, default="shapefile")
+    parser.add_argument('--point_columns', help="Also write the survey point feature classes as Parquet files in the Points folder of the project (requires pyarrow).", action='store_true', default=False)
+    parser.add_argument('--archive', help="Write the project as a single archive <outputprojectfolder>.zip (or .tar) instead of a folder.", choices=project_archive.FORMATS, default=None)
 
     parser.add_argument('--logfile', help='Output a log file.', default="" )
     parser.add_argument('--verbose', help='Get more information in your logs.', action='store_true', default=False )
@@ -394,7 +777,14 @@ def main():
         print "ERROR: Missing arguments"
         parser.print_help()
         exit(1)
-    if not os.path.isdir(args.outputprojectfolder):
+    if args.archive and (args.refresh or args.blob_store):
+        print "ERROR: --archive is not used with --refresh or --blob_store"
+        parser.print_help()
+        exit(1)
+    if args.point_columns and not point_columns.available():
+        print "ERROR: --point_columns requires pyarrow"
+        exit(1)
+    if not args.archive and not os.path.isdir(args.outputprojectfolder):
         print "ERROR: '{}' is not a folder".format(args.outputprojectfolder)
         parser.print_help()
         exit(1)
@@ -412,7 +802,16 @@ def main():
                               args.rawinstrumentfile,
                               args.auxinstrumentfile,
                               args.dxffile,
-                              args.mapimagesfolder)
+                              args.mapimagesfolder,
+                              io_threads=args.io_threads,
+                              refresh=args.refresh,
+                              placement=args.placement,
+                              blob_store_folder=args.blob_store,
+                              archive_format=args.archive,
+                              raster_profile=args.raster_profile,
+                              surface_processes=args.surface_processes,
+                              vector_format=args.vector_format,
+                              export_point_columns=args.point_columns)
     except Exception as e:
         traceback.print_exc(file=sys.stdout)
         sys.exit(1)
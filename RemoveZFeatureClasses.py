@@ -47,15 +47,19 @@ def main(topo_project_xml):
         node.text = "Repaired Z-Enabled settings for {}.".format(fc)
         Riverscapes.indent(root)
         out_tree = ET.ElementTree(root)
-        out_tree.write(os.path.join(os.path.dirname(topo_project_xml), "log.xml"))
+        # log.xml may be a hard link shared with other projects (see blob_store): replace it, never edit it in place
+        log_xml = os.path.join(os.path.dirname(topo_project_xml), "log.xml")
+        out_tree.write(log_xml + ".tmp")
+        os.remove(log_xml)  # rename does not replace files on Windows
+        os.rename(log_xml + ".tmp", log_xml)
 
     return 0
 
 
 if __name__ == "__main__":
     import argparse
-    import sqlite3
     import traceback
+    import export_log
 
     parser = argparse.ArgumentParser()
     parser.add_argument('sourcefolder',
@@ -68,18 +72,7 @@ if __name__ == "__main__":
 
     # Set up log table - could be same db, but different table.
     logfile = os.path.join(args.sourcefolder, "log.db") if args.logfile is None else args.logfile
-    conn_log = sqlite3.connect(logfile)
-    cursor = conn_log.cursor()
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-    if not any("ZPolygonRepair" in tablename for tablename in cursor.fetchall()):
-        conn_log.execute('''CREATE TABLE ZPolygonRepair (timestamp text, 
-                                                        year text, 
-                                                        watershed text, 
-                                                        site text, 
-                                                        visit text, 
-                                                        status text,
-                                                        message text)''')
-        conn_log.commit()
+    log = export_log.ExportLog(logfile, ["ZPolygonRepair"])
 
     for dirname, dirs, filenames in os.walk(args.sourcefolder):
         for filename in [os.path.join(dirname, name) for name in filenames]:
@@ -97,16 +90,14 @@ if __name__ == "__main__":
 
                     if status == 0:
                         row = (str(time.asctime()), year, watershed, siteid, str(visitid), "Success", "Polyons repaired")
-                        cursor.execute("INSERT INTO ZPolygonRepair VALUES (?,?,?,?,?,?,?)", row)
-                        conn_log.commit()
+                        log.write("ZPolygonRepair", row)
                         print("Successful Polygon Repair {}".format(row))
                     else:
                         row = (str(time.asctime()), year, watershed, siteid, str(visitid), "Error", status)
-                        cursor.execute("INSERT INTO ZPolygonRepair VALUES (?,?,?,?,?,?,?)", row)
-                        conn_log.commit()
+                        log.write("ZPolygonRepair", row)
                         print("Error with Polygon Repair {}".format(row))
                 except:
                     row = (str(time.asctime()), year, watershed, siteid, str(visitid), 'Exception', traceback.format_exc())
-                    cursor.execute("INSERT INTO ZPolygonRepair VALUES (?,?,?,?,?,?,?)", row)
-                    conn_log.commit()
+                    log.write("ZPolygonRepair", row)
                     print("Exception {}".format(traceback.format_exc()))
+    log.close()
@@ -0,0 +1,219 @@
+"""
+    Content-addressed store of exported files, shared by the projects of a batch export.
+
+    Each file is stored once under its sha1 digest (<store>/ab/cdef...) and hard linked into each project that uses
+    it (copied if the project is on another volume). Input files are hashed while they are copied into the store;
+    the digest of each input (path, size and modified time) is kept in the store's sources.db, so an unchanged input
+    exported again is only linked. Files written by the export (shapefiles, rasters, xml) are added to the store
+    when the project is complete.
+
+    Files in a project are shared with the store and other projects: they must be replaced, never edited in place.
+    The files that tools update after an export (MUTABLE_FILES, i.e. log.xml) are not added to the store.
+    Run this module with --gc (while no export is running) to remove files no longer used by any project, and with
+    --verify to also detach stored files that were edited through a link (their content no longer matches their
+    digest).
+"""
+import os
+import uuid
+import hashlib
+import sqlite3
+import threading
+import file_placement
+
+BLOCKSIZE = 1024 * 1024
+# files of a project that are rewritten after the export (i.e. RemoveZFeatureClasses adds to log.xml)
+MUTABLE_FILES = ["project.rs.xml", "log.xml", "export_manifest.json"]
+
+
+class BlobStore(object):
+
+    def __init__(self, root):
+        self.root = root
+        self.tmp = os.path.join(root, "tmp")
+        if not os.path.isdir(self.tmp):
+            os.makedirs(self.tmp)
+        self.lock = threading.Lock()  # placements run in the threads of stage_executor
+        self.conn = sqlite3.connect(os.path.join(root, "sources.db"), timeout=120, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS Sources (path text PRIMARY KEY,
+                                                                 size integer,
+                                                                 mtime real,
+                                                                 digest text)''')
+        self.conn.commit()
+
+    def blob_path(self, digest):
+        return os.path.join(self.root, digest[:2], digest[2:])
+
+    def _known_digest(self, src, stat):
+        with self.lock:
+            row = self.conn.execute("SELECT digest FROM Sources WHERE path=? AND size=? AND mtime=?",
+                                    (os.path.abspath(src), stat.st_size, stat.st_mtime)).fetchone()
+        if row and os.path.isfile(self.blob_path(row[0])):
+            return row[0]
+        return None
+
+    def _remember(self, src, stat, digest):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO Sources VALUES (?,?,?,?)",
+                              (os.path.abspath(src), stat.st_size, stat.st_mtime, digest))
+            self.conn.commit()
+
+    def _store(self, temp_path, digest):
+        """ move a temporary file to its blob path, or drop it if the blob is already stored."""
+        blob = self.blob_path(digest)
+        if os.path.isfile(blob):
+            os.unlink(temp_path)
+            return blob
+        if not os.path.isdir(os.path.dirname(blob)):
+            try:
+                os.makedirs(os.path.dirname(blob))
+            except OSError:
+                pass  # created by another export process
+        try:
+            os.rename(temp_path, blob)
+        except OSError:
+            # stored by another export process in the meantime (rename does not replace files on Windows)
+            if not os.path.isfile(blob):
+                raise
+            os.unlink(temp_path)
+        return blob
+
+    def put(self, src):
+        """ add an input file to the store, hashing it while it is copied. Returns its digest."""
+        stat = os.stat(src)
+        digest = self._known_digest(src, stat)
+        if digest is not None:
+            return digest
+        temp_path = os.path.join(self.tmp, uuid.uuid4().hex)
+        sha1 = hashlib.sha1()
+        with open(src, "rb") as fsrc:
+            with open(temp_path, "wb") as ftemp:
+                for block in iter(lambda: fsrc.read(BLOCKSIZE), b""):
+                    sha1.update(block)
+                    ftemp.write(block)
+        digest = sha1.hexdigest()
+        os.utime(temp_path, (stat.st_atime, stat.st_mtime))
+        self._store(temp_path, digest)
+        self._remember(src, stat, digest)
+        return digest
+
+    def place(self, src, dst):
+        """ place an input file into a project through the store."""
+        if os.path.isdir(dst):
+            dst = os.path.join(dst, os.path.basename(src))
+        # hard links keep the file shared with the store (and let collect_garbage see that it is used)
+        return file_placement.place(self.blob_path(self.put(src)), dst, "hardlink")
+
+    def place_files(self, files, dest_folder):
+        for file_path in files:
+            self.place(file_path, os.path.join(dest_folder, os.path.basename(file_path)))
+
+    def place_tree(self, src, dst):
+        for dirpath, dirnames, filenames in os.walk(src):
+            dest_dir = os.path.join(dst, os.path.relpath(dirpath, src))
+            if not os.path.isdir(dest_dir):
+                os.makedirs(dest_dir)
+            for filename in filenames:
+                self.place(os.path.join(dirpath, filename), os.path.join(dest_dir, filename))
+
+    def ingest(self, file_path):
+        """ replace a file written by the export with its blob, adding it to the store if it is new."""
+        sha1 = hashlib.sha1()
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(BLOCKSIZE), b""):
+                sha1.update(block)
+        digest = sha1.hexdigest()
+        temp_path = os.path.join(self.tmp, uuid.uuid4().hex)
+        try:
+            os.rename(file_path, temp_path)
+        except OSError:  # store on another volume
+            file_placement.copy(file_path, temp_path)
+            os.unlink(file_path)
+        file_placement.place(self._store(temp_path, digest), file_path, "hardlink")
+        return digest
+
+    def ingest_tree(self, folder, exclude=MUTABLE_FILES):
+        """
+        Add the files written into a project folder to the store. Files that are already shared (more than one
+        link, i.e. placed from the store) are skipped.
+        :param exclude: file names that are rewritten after the export and are not stored
+        """
+        for dirpath, dirnames, filenames in os.walk(folder):
+            for filename in filenames:
+                file_path = os.path.join(dirpath, filename)
+                if filename not in exclude and os.stat(file_path).st_nlink <= 1:
+                    self.ingest(file_path)
+
+    def close(self):
+        self.conn.close()
+
+
+def _file_sha1(file_path):
+    sha1 = hashlib.sha1()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(BLOCKSIZE), b""):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def collect_garbage(root, verify=False):
+    """
+    Remove stored files that are no longer linked into any project (requires hard links).
+    :param verify: also remove stored files whose content does not match their digest: they were edited in place
+                   through a project link, so the store must not place them again. The projects linked to them keep
+                   the edited file.
+    :return: tuple of (number of files removed, MB freed)
+    """
+    removed = 0
+    freed = 0
+    for name in os.listdir(root):
+        folder = os.path.join(root, name)
+        if len(name) != 2 or not os.path.isdir(folder):
+            continue
+        for blob in os.listdir(folder):
+            blob_path = os.path.join(folder, blob)
+            stat = os.stat(blob_path)
+            if stat.st_nlink == 0:
+                raise RuntimeError("File link counts are not available on this platform: cannot find unused files.")
+            if stat.st_nlink == 1:
+                os.unlink(blob_path)
+                removed += 1
+                freed += stat.st_size
+            elif verify and _file_sha1(blob_path) != name + blob:
+                print "Edited through a link, removed from the store: " + blob_path
+                os.unlink(blob_path)
+                removed += 1
+    conn = sqlite3.connect(os.path.join(root, "sources.db"))
+    digests = conn.execute("SELECT DISTINCT digest FROM Sources").fetchall()
+    conn.executemany("DELETE FROM Sources WHERE digest=?",
+                     [row for row in digests if not os.path.isfile(os.path.join(root, row[0][:2], row[0][2:]))])
+    conn.commit()
+    conn.close()
+    return removed, freed / 1048576.0
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Content-addressed store of exported project files.")
+    parser.add_argument('store', help='folder of the store (i.e. <path_output>/blobs)', type=str)
+    parser.add_argument('--gc', help='remove files no longer used by any project', action='store_true', default=False)
+    parser.add_argument('--verify', help='with --gc, also remove stored files that were edited through a project link', action='store_true', default=False)
+    args = parser.parse_args()
+
+    if args.gc:
+        removed, freed = collect_garbage(args.store, args.verify)
+        print "Removed {} files ({:.1f}MB)".format(removed, freed)
+    else:
+        count = 0
+        size = 0
+        for name in os.listdir(args.store):
+            folder = os.path.join(args.store, name)
+            if len(name) == 2 and os.path.isdir(folder):
+                for blob in os.listdir(folder):
+                    count += 1
+                    size += os.path.getsize(os.path.join(folder, blob))
+        print "{} files ({:.1f}MB)".format(count, size / 1048576.0)
+
+
+if __name__ == "__main__":
+    main()
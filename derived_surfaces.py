@@ -0,0 +1,129 @@
+"""
+    Surfaces derived from the DEM, for surveys whose geodatabase does not have them: hillshade, slope and the
+    detrended DEM. Computed block by block with numpy kernels (see raster_blocks), without Spatial Analyst.
+
+    Hillshade and slope use the 3x3 neighbourhood of each cell (Horn's method, as the Spatial Analyst tools), so
+    blocks are read with a halo of one cell. Cells on the edge of the DEM or next to NoData are NoData.
+
+    The detrended DEM is the DEM minus the elevation trend of the channel: DEM elevations are sampled along the
+    centerline and fitted with a straight line of elevation against distance along the centerline, and each cell is
+    detrended with the fitted elevation of the nearest centerline point (found with scipy when it is installed).
+"""
+import math
+import numpy
+import raster_blocks
+
+AZIMUTH = 315.0
+ALTITUDE = 45.0
+NEAREST_CHUNK = 1000000  # cells x centerline points compared at once when finding the nearest centerline point
+
+
+def _gradients(z, cell_width, cell_height):
+    """ dz/dx and dz/dy of the cells inside the halo of z (Horn's method)"""
+    a, b, c = z[:-2, :-2], z[:-2, 1:-1], z[:-2, 2:]
+    d, f = z[1:-1, :-2], z[1:-1, 2:]
+    g, h, i = z[2:, :-2], z[2:, 1:-1], z[2:, 2:]
+    dz_dx = ((c + 2 * f + i) - (a + 2 * d + g)) / (8.0 * cell_width)
+    dz_dy = ((g + 2 * h + i) - (a + 2 * b + c)) / (8.0 * cell_height)
+    return dz_dx, dz_dy
+
+
+def _hillshade(arrays, window, azimuth, altitude):
+    dz_dx, dz_dy = _gradients(arrays[0], window[2], window[3])
+    zenith = math.radians(90.0 - altitude)
+    azimuth_math = math.radians((360.0 - azimuth + 90.0) % 360.0)
+    slope = numpy.arctan(numpy.hypot(dz_dx, dz_dy))
+    aspect = numpy.arctan2(dz_dy, -dz_dx)
+    aspect = numpy.where(aspect < 0, aspect + 2 * math.pi, aspect)
+    shade = 255.0 * (math.cos(zenith) * numpy.cos(slope) +
+                     math.sin(zenith) * numpy.sin(slope) * numpy.cos(azimuth_math - aspect))
+    with numpy.errstate(invalid="ignore"):
+        return numpy.round(numpy.maximum(shade, 0))
+
+
+def _slope(arrays, window):
+    dz_dx, dz_dy = _gradients(arrays[0], window[2], window[3])
+    return numpy.degrees(numpy.arctan(numpy.hypot(dz_dx, dz_dy)))
+
+
+def _detrend(arrays, window, points, trend):
+    dem = arrays[0]
+    rows, columns = dem.shape
+    x0, y0, cell_width, cell_height = window
+    x = x0 + (numpy.arange(columns) + 0.5) * cell_width
+    y = y0 - (numpy.arange(rows) + 0.5) * cell_height
+    cells = numpy.column_stack([numpy.tile(x, rows), numpy.repeat(y, columns)])
+    try:
+        from scipy.spatial import cKDTree
+        nearest = cKDTree(points).query(cells)[1]
+    except ImportError:
+        nearest = numpy.empty(len(cells), dtype=numpy.int64)
+        chunk = max(1, NEAREST_CHUNK // len(points))
+        for start in range(0, len(cells), chunk):
+            offsets = cells[start:start + chunk, numpy.newaxis, :] - points[numpy.newaxis, :, :]
+            nearest[start:start + chunk] = numpy.argmin((offsets ** 2).sum(axis=2), axis=1)
+    return dem - trend[nearest].reshape(rows, columns)
+
+
+def hillshade(dem, output_raster, processes=0, azimuth=AZIMUTH, altitude=ALTITUDE):
+    """ :return: statistics of the hillshade (see raster_blocks.Statistics.result)"""
+    return raster_blocks.map_blocks(_hillshade, [dem], output_raster, halo=1, processes=processes,
+                                    args=(azimuth, altitude))
+
+
+def slope(dem, output_raster, processes=0):
+    """ slope in degrees. Returns its statistics (see raster_blocks.Statistics.result)."""
+    return raster_blocks.map_blocks(_slope, [dem], output_raster, halo=1, processes=processes)
+
+
+def centerline_points(centerline, spacing):
+    """
+    Points along the longest line of a centerline feature class (the main channel), every spacing map units.
+    :return: tuple of (array of x, y, array of distance along the line), or None if there is no line
+    """
+    import arcpy
+    longest = None
+    with arcpy.da.SearchCursor(centerline, ["SHAPE@"]) as sc:
+        for row in sc:
+            if row[0] is not None and (longest is None or row[0].length > longest.length):
+                longest = row[0]
+    if longest is None or longest.length == 0:
+        return None
+    stations = numpy.arange(0, longest.length, spacing)
+    points = numpy.array([(point.firstPoint.X, point.firstPoint.Y)
+                          for point in (longest.positionAlongLine(station) for station in stations)])
+    return points, stations
+
+
+def sample(raster, grid, points):
+    """ values of a raster on a grid at points (NaN outside the raster or on NoData), read one block at a time"""
+    values = numpy.empty(len(points))
+    values.fill(numpy.nan)
+    columns = numpy.floor((points[:, 0] - grid.xmin) / grid.cell_width).astype(numpy.int64)
+    rows = numpy.floor((grid.ymax - points[:, 1]) / grid.cell_height).astype(numpy.int64)
+    for row, column, block_rows, block_columns in grid.blocks():
+        inside = (rows >= row) & (rows < row + block_rows) & (columns >= column) & (columns < column + block_columns)
+        if inside.any():
+            block = raster_blocks.read_block(raster, grid, row, column, block_rows, block_columns)
+            values[inside] = block[rows[inside] - row, columns[inside] - column]
+    return values
+
+
+def detrended(dem, centerline, output_raster, processes=0):
+    """
+    DEM detrended along a centerline.
+    :return: statistics of the detrended DEM (see raster_blocks.Statistics.result), or False if the trend cannot be
+             fitted (no centerline, or fewer than two centerline points on the DEM)
+    """
+    grid = raster_blocks.Grid(dem)
+    line = centerline_points(centerline, grid.cell_width)
+    if line is None:
+        return False
+    points, stations = line
+    elevations = sample(dem, grid, points)
+    valid = ~numpy.isnan(elevations)
+    if valid.sum() < 2:
+        return False
+    gradient, intercept = numpy.polyfit(stations[valid], elevations[valid], 1)
+    trend = (intercept + gradient * stations).astype(numpy.float32)
+    return raster_blocks.map_blocks(_detrend, [dem], output_raster, processes=processes, args=(points, trend))
@@ -0,0 +1,125 @@
+"""
+    SQLite log for batch export and repair tools (i.e. SurveyExports, ZPolygonRepair tables).
+
+    The log database is opened in WAL mode and inserts are grouped into one commit per COMMIT_SIZE rows or
+    COMMIT_INTERVAL seconds. Worker processes report into a multiprocessing queue with QueueLog (isolated
+    processes into their own pipe, see process_supervisor.MessageQueue), and a single QueueWriter thread in the
+    parent process drains the queue into the database.
+"""
+import sqlite3
+import threading
+import time
+from Queue import Empty
+
+LOG_COLUMNS = ["timestamp", "year", "watershed", "site", "visit", "status", "message"]
+COMMIT_SIZE = 100
+COMMIT_INTERVAL = 5.0
+
+
+class ExportLog(object):
+    """
+    Batched writer for log tables sharing the timestamp/year/watershed/site/visit/status/message layout.
+    """
+
+    def __init__(self, db_path, tables=("SurveyExports",), commit_size=COMMIT_SIZE, commit_interval=COMMIT_INTERVAL):
+        self.db_path = db_path
+        self.commit_size = commit_size
+        self.commit_interval = commit_interval
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.pending = []
+        self.last_commit = time.time()
+        self.lock = threading.Lock()
+        for table in tables:
+            self.create_table(table)
+
+    def create_table(self, table):
+        """ Create a log table and its visit index. Existing tables (without the id column) are left as they are."""
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS {} (id INTEGER PRIMARY KEY,
+                                                            timestamp text,
+                                                            year text,
+                                                            watershed text,
+                                                            site text,
+                                                            visit text,
+                                                            status text,
+                                                            message text)'''.format(table))
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_{0}_visit ON {0} (year, watershed, site, visit, timestamp)".format(table))
+        self.conn.commit()
+
+    def write(self, table, row):
+        """ Queue one log row (timestamp, year, watershed, site, visit, status, message) for insert."""
+        self.execute("INSERT INTO {} ({}) VALUES ({})".format(table, ",".join(LOG_COLUMNS), ",".join(["?"] * len(LOG_COLUMNS))),
+                     row)
+
+    def execute(self, sql, params=()):
+        """ Queue any other write statement so it is committed in order with the log rows."""
+        with self.lock:
+            self.pending.append((sql, params))
+            if len(self.pending) >= self.commit_size or time.time() - self.last_commit >= self.commit_interval:
+                self._commit()
+
+    def flush(self):
+        with self.lock:
+            self._commit()
+
+    def _commit(self):
+        if self.pending:
+            for sql, params in self.pending:
+                self.conn.execute(sql, params)
+            self.conn.commit()
+            self.pending = []
+        self.last_commit = time.time()
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+
+class QueueLog(object):
+    """
+    Log client for worker processes. Has the same write/execute methods as ExportLog, but only puts the
+    statements on a queue for the QueueWriter in the parent process.
+    """
+
+    def __init__(self, queue):
+        self.queue = queue
+
+    def write(self, table, row):
+        self.queue.put(("write", table, tuple(row)))
+
+    def execute(self, sql, params=()):
+        self.queue.put(("execute", sql, tuple(params)))
+
+
+class QueueWriter(threading.Thread):
+    """
+    Single writer thread: drains a queue filled by QueueLog clients into an ExportLog.
+    """
+
+    def __init__(self, log, queue):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.log = log
+        self.queue = queue
+
+    def run(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=self.log.commit_interval)
+            except Empty:
+                self.log.flush()
+                continue
+            if item is None:
+                break
+            action, first, second = item
+            if action == "write":
+                self.log.write(first, second)
+            else:
+                self.log.execute(first, second)
+        self.log.flush()
+
+    def stop(self):
+        """ Write everything already on the queue, then stop the writer."""
+        self.queue.put(None)
+        self.join()
@@ -0,0 +1,74 @@
+"""
+    Export cost estimates for batch scheduling.
+
+    The cost of a visit is estimated from the size of its input datasets (no arcpy required), weighted by how
+    expensive each dataset is to export. Visits are scheduled longest-first so a few large visits do not start at
+    the end of a parallel batch.
+"""
+import os
+import csv
+
+# Relative cost per MB of each input. The survey geodatabase is converted (rasters, shapefiles), the TINs and map
+# images are copied.
+COST_WEIGHTS = {"SurveyGDB": 1.0,
+                "TopoTIN": 0.25,
+                "WSETIN": 0.25,
+                "MapImages": 0.1}
+
+
+def dataset_size(dataset_path):
+    """ size in bytes of a file or of all files in a folder."""
+    if os.path.isfile(dataset_path):
+        return os.path.getsize(dataset_path)
+    total = 0
+    for dirpath, dirnames, filenames in os.walk(dataset_path):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, filename))
+            except OSError:
+                pass
+    return total
+
+
+def estimate_cost(visit_data):
+    """
+    Estimate the export cost of a visit.
+    :param visit_data: visit dictionary from BatchExport.gather_visit
+    :return: tuple of (cost, dictionary of input sizes in MB)
+    """
+    sizes = {}
+    for name in ["SurveyGDB", "TopoTIN", "WSETIN"]:
+        sizes[name] = sum(dataset_size(p) for p in visit_data["datasets"].get(name, [])) / 1048576.0
+    sizes["MapImages"] = dataset_size(os.path.join(visit_data["path_topo"], "MapImages")) / 1048576.0
+    cost = sum(COST_WEIGHTS[name] * size for name, size in sizes.iteritems())
+    return cost, sizes
+
+
+def plan(visits):
+    """ sort visits longest-first, storing the estimate in each visit's 'cost' and 'sizes' items."""
+    for visit_data in visits:
+        visit_data["cost"], visit_data["sizes"] = estimate_cost(visit_data)
+    return sorted(visits, key=lambda v: v["cost"], reverse=True)
+
+
+def plan_lines(visits):
+    yield "{0:>10} {1:>10} {2:>10} {3:>10}  {4}".format("cost", "gdb MB", "tins MB", "images MB", "visit")
+    for visit_data in visits:
+        sizes = visit_data["sizes"]
+        yield "{0:>10.1f} {1:>10.1f} {2:>10.1f} {3:>10.1f}  {4}/{5}/{6}/{7}".format(
+            visit_data["cost"], sizes["SurveyGDB"], sizes["TopoTIN"] + sizes["WSETIN"], sizes["MapImages"],
+            visit_data["year"], visit_data["watershed"], visit_data["site"], visit_data["visit_id"])
+    yield "{0:>10.1f}  total for {1} visits".format(sum(v["cost"] for v in visits), len(visits))
+
+
+def write_plan(visits, filename):
+    with open(filename, "wb") as f:
+        writer = csv.writer(f)
+        writer.writerow(["order", "year", "watershed", "site", "visit", "cost",
+                         "SurveyGDB_MB", "TopoTIN_MB", "WSETIN_MB", "MapImages_MB"])
+        for order, visit_data in enumerate(visits, 1):
+            sizes = visit_data["sizes"]
+            writer.writerow([order, visit_data["year"], visit_data["watershed"], visit_data["site"],
+                             visit_data["visit_id"], round(visit_data["cost"], 3),
+                             round(sizes["SurveyGDB"], 3), round(sizes["TopoTIN"], 3),
+                             round(sizes["WSETIN"], 3), round(sizes["MapImages"], 3)])
@@ -0,0 +1,134 @@
+"""
+    Place pass-through input files (instrument files, dxf, csv, map images, reports, TINs) into an exported project
+    without copying their bytes where the file system allows it.
+
+    Strategies:
+        auto      reflink, then copy
+        reflink   copy-on-write clone (Linux btrfs/xfs with FICLONE, macOS APFS with clonefile), else an error
+        hardlink  hard link (same volume only), else copy
+        copy      buffered copy
+
+    A hard linked file shares its data with the input: editing either one in place changes both, so hard links of
+    source data are only made when the hardlink strategy is chosen explicitly. Files that the export modifies (i.e.
+    the SQLite template that the QA tables are written into) are placed with writable=True and are never hard linked.
+"""
+import os
+import sys
+import errno
+import shutil
+
+STRATEGIES = ["auto", "reflink", "hardlink", "copy"]
+BUFFER_SIZE = 1024 * 1024
+FICLONE = 0x40049409
+
+# (st_dev of the source, st_dev of the destination folder) of volumes where reflinks are not supported, so they are
+# not tried again. Only these errors mean that the file system cannot clone (not a cross volume or transient error).
+_no_reflink = set()
+UNSUPPORTED_ERRORS = [errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, getattr(errno, "ENOTSUP", errno.EOPNOTSUPP)]
+
+
+def _reflink_linux(src, dst):
+    import fcntl
+    with open(src, "rb") as fsrc:
+        with open(dst, "wb") as fdst:
+            try:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            except IOError as e:
+                fdst.close()
+                os.unlink(dst)
+                raise OSError(e.errno, "reflink failed: " + e.strerror)
+
+
+def _reflink_mac(src, dst):
+    import ctypes
+    import ctypes.util
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    if not hasattr(libc, "clonefile"):
+        raise OSError(errno.EOPNOTSUPP, "reflink not supported")
+    if libc.clonefile(src.encode("utf-8"), dst.encode("utf-8"), 0) != 0:
+        raise OSError(ctypes.get_errno(), "reflink failed: " + os.strerror(ctypes.get_errno()))
+
+
+def reflink(src, dst):
+    """
+    copy-on-write clone of src. Raises OSError if the platform or file system does not support it, or if src and dst
+    are on different volumes.
+    """
+    devices = (os.stat(src).st_dev, os.stat(os.path.dirname(os.path.abspath(dst))).st_dev)
+    if devices in _no_reflink:
+        raise OSError(errno.EOPNOTSUPP, "reflink not supported")
+    try:
+        if sys.platform.startswith("linux"):
+            _reflink_linux(src, dst)
+        elif sys.platform == "darwin":
+            _reflink_mac(src, dst)
+        else:
+            raise OSError(errno.EOPNOTSUPP, "reflink not supported")
+    except OSError as e:
+        if e.errno in UNSUPPORTED_ERRORS:
+            _no_reflink.add(devices)
+        raise
+    shutil.copystat(src, dst)
+
+
+def hardlink(src, dst):
+    """ hard link dst to src. Raises OSError if the file system does not support it (i.e. across volumes)."""
+    if hasattr(os, "link"):
+        os.link(src, dst)
+    elif sys.platform == "win32":
+        import ctypes
+        if not ctypes.windll.kernel32.CreateHardLinkW(unicode(dst), unicode(src), None):
+            raise OSError("hard link failed")
+    else:
+        raise OSError("hard links not supported")
+
+
+def copy(src, dst):
+    """ buffered copy of src, with its modified time and permissions."""
+    with open(src, "rb") as fsrc:
+        with open(dst, "wb") as fdst:
+            shutil.copyfileobj(fsrc, fdst, BUFFER_SIZE)
+    shutil.copystat(src, dst)
+
+
+def place(src, dst, strategy="auto", writable=False):
+    """
+    Place the file src at dst.
+    :param strategy: one of STRATEGIES. auto and hardlink fall back to a copy if cloning or linking fails, reflink
+                     raises the OSError. Only the hardlink strategy makes hard links.
+    :param writable: dst will be modified, so it must not share its data with src (no hard link).
+    :return: name of the method used (reflink, hardlink or copy)
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError("Unknown placement strategy {}. Use one of {}".format(strategy, STRATEGIES))
+    if os.path.isdir(dst):
+        dst = os.path.join(dst, os.path.basename(src))
+    methods = []
+    if strategy in ["auto", "reflink"]:
+        methods.append(("reflink", reflink))
+    if strategy == "hardlink" and not writable:
+        methods.append(("hardlink", hardlink))
+    for name, method in methods:
+        try:
+            method(src, dst)
+            return name
+        except OSError:
+            if strategy == "reflink":
+                raise
+    copy(src, dst)
+    return "copy"
+
+
+def place_files(files, dest_folder, strategy="auto"):
+    for file_path in files:
+        place(file_path, os.path.join(dest_folder, os.path.basename(file_path)), strategy)
+
+
+def place_tree(src, dst, strategy="auto"):
+    """ place all files of the folder src into the new folder dst."""
+    for dirpath, dirnames, filenames in os.walk(src):
+        dest_dir = os.path.join(dst, os.path.relpath(dirpath, src))
+        if not os.path.isdir(dest_dir):
+            os.makedirs(dest_dir)
+        for filename in filenames:
+            place(os.path.join(dirpath, filename), os.path.join(dest_dir, filename), strategy)
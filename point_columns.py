@@ -0,0 +1,75 @@
+"""
+    Columnar export of the survey point feature classes (Topo_Points, Control_Points, EdgeOfWater_Points, Error_Points
+    and QaQc_RawPoints) as Parquet files, for analysis of the points of many visits.
+
+    Each file has the X, Y and Z of the points and all their attributes (VDE, HDE, POINT_QUALITY, DESCRIPTION, STATION,
+    CODE...) as typed columns with their full field names. Points are read with a cursor and written in row groups of
+    BATCH_ROWS points compressed with COMPRESSION, so a query over the files of many visits (pyarrow.dataset, DuckDB,
+    Spark) reads only the columns it needs. Constant columns (i.e. VisitID) identify the visit of each point.
+
+    pyarrow is optional: it is only needed for this export (see available).
+"""
+import itertools
+
+POINT_DATASETS = ["Topo_Points", "Control_Points", "EdgeOfWater_Points", "Error_Points", "fcQaQcRawPoints"]
+EXTENSION = ".parquet"
+BATCH_ROWS = 65536
+COMPRESSION = "zstd"
+SKIPPED_TYPES = ["Geometry", "Blob", "Raster"]
+
+
+def available():
+    """ True if pyarrow (with parquet support) is installed"""
+    try:
+        import pyarrow.parquet
+    except ImportError:
+        return False
+    return True
+
+
+def point_datasets(survey_gdb):
+    """ the point feature classes of a survey geodatabase that exist"""
+    return [dataset for dataset in (getattr(survey_gdb, name) for name in POINT_DATASETS) if dataset.validateExists()]
+
+
+def arrow_type(field):
+    """ pyarrow type of the column of an arcpy field (strings, guids and other types are written as strings)"""
+    import pyarrow
+    return {"SmallInteger": pyarrow.int16(),
+            "Integer": pyarrow.int32(),
+            "OID": pyarrow.int64(),
+            "Single": pyarrow.float32(),
+            "Double": pyarrow.float64(),
+            "Date": pyarrow.timestamp("ms")}.get(field.type, pyarrow.string())
+
+
+def export_points(feature_class, output_file, constants=None, batch_rows=BATCH_ROWS, compression=COMPRESSION):
+    """
+    Write the points of a feature class to a Parquet file.
+    :param constants: dict of column name: value of string columns with the same value in every row
+    :return: number of points written
+    """
+    import arcpy
+    import pyarrow
+    import pyarrow.parquet
+    constants = constants or {}
+    fields = [field for field in arcpy.ListFields(feature_class) if field.type not in SKIPPED_TYPES]
+    # Z is always written (null for 2D points), so the files of all visits have the same columns
+    schema = pyarrow.schema([pyarrow.field(name, pyarrow.float64()) for name in ["X", "Y", "Z"]] +
+                            [pyarrow.field(field.name, arrow_type(field)) for field in fields] +
+                            [pyarrow.field(name, pyarrow.string()) for name in sorted(constants)])
+    count = 0
+    writer = pyarrow.parquet.ParquetWriter(output_file, schema, compression=compression)
+    try:
+        with arcpy.da.SearchCursor(feature_class, ["SHAPE@X", "SHAPE@Y", "SHAPE@Z"] + [f.name for f in fields]) as sc:
+            for rows in iter(lambda: list(itertools.islice(sc, batch_rows)), []):
+                columns = zip(*rows)
+                arrays = [pyarrow.array(list(column), type=schema_field.type)
+                          for column, schema_field in zip(columns, schema)]
+                arrays.extend(pyarrow.array([unicode(constants[name])] * len(rows), type=pyarrow.string())
+                              for name in sorted(constants))
+                writer.write_table(pyarrow.Table.from_arrays(arrays, schema=schema))
+                count += len(rows)
+    finally:
+        writer.close()
+    return count
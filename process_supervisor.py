@@ -0,0 +1,173 @@
+"""
+    Run jobs in short-lived child processes with a memory ceiling and a per-job timeout.
+
+    Each child process runs a group of jobs and then exits, so memory held by arcpy (in_memory datasets, reloaded
+    modules) is returned to the system between groups. A child that exceeds the memory ceiling or the timeout is
+    killed; the job it was running is reported as killed and the rest of its group is run in a new process.
+
+    Each child reports to the parent on its own pipe (job starts and results, and the messages put on a
+    MessageQueue, i.e. its log). A killed child can leave a partial message or a held lock on its channel, so no
+    channel is shared between children: the pipe of a killed child is discarded with it.
+"""
+import multiprocessing
+import time
+
+RECEIVE_BATCH = 100  # messages handled from one child before the others are polled
+_connection = None  # sending end of the pipe of this child process to the parent
+
+
+class MessageQueue(object):
+    """
+    Put-only queue for the jobs of supervised child processes (i.e. for an export_log.QueueLog). Each message is sent
+    on the pipe of the child process it is put in, and passed to the on_message callback of run_supervised.
+    """
+
+    def put(self, item):
+        _connection.send(("message", None, item))
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def _child(target, initializer, initargs, jobs, connection):
+    global _connection
+    _connection = connection
+    if initializer is not None:
+        initializer(*initargs)
+    for i, job in enumerate(jobs):
+        connection.send(("start", i, None))
+        result = target(job)
+        connection.send(("done", i, result))
+    connection.close()
+
+
+def rss_mb(pid):
+    try:
+        return psutil.Process(pid).memory_info().rss / 1048576.0
+    except psutil.Error:
+        return None
+
+
+def run_supervised(target, jobs, processes=1, jobs_per_process=1, max_rss_mb=None, timeout=None,
+                   initializer=None, initargs=(), on_result=None, on_killed=None, on_message=None,
+                   poll_interval=0.5):
+    """
+    Run target(job) for each job in recycled child processes.
+    :param target: module level function run in the child process for each job. Returns a picklable result.
+    :param jobs: list of picklable jobs, run in order.
+    :param processes: number of child processes running at once.
+    :param jobs_per_process: number of jobs each child process runs before it is replaced.
+    :param max_rss_mb: kill a child process whose resident memory exceeds this many MB (requires psutil).
+    :param timeout: kill a child process that has been running the same job for longer than this many seconds.
+    :param initializer: function run in each child process before its first job.
+    :param on_result: on_result(job, result) called in the parent process for each finished job.
+    :param on_killed: on_killed(job, reason) called in the parent process for a job that was killed or crashed.
+    :param on_message: on_message(item) called in the parent process for each item put on a MessageQueue by a child.
+    """
+    if max_rss_mb and psutil is None:
+        raise ImportError("psutil is required for a memory ceiling on export processes.")
+    pending = list(jobs)
+    workers = {}
+    next_worker_id = 0
+
+    def handle(worker, message):
+        action, i, result = message
+        if action == "message":
+            if on_message is not None:
+                on_message(result)
+        elif action == "start":
+            worker["current"] = i
+            worker["started"] = time.time()
+        else:
+            worker["current"] = None
+            worker["next"] = i + 1
+            if on_result is not None:
+                on_result(worker["jobs"][i], result)
+
+    def receive(worker, limit=None):
+        """
+        handle the messages waiting on the pipe of a worker (at most limit, so a busy worker cannot hold up the
+        others). Returns the number of messages.
+        """
+        count = 0
+        connection = worker["connection"]
+        while connection is not None and count != limit:
+            try:
+                if not connection.poll():
+                    break
+                message = connection.recv()
+            except Exception:
+                # closed by an exiting child, or a partial message from a killed one
+                connection.close()
+                worker["connection"] = connection = None
+                break
+            handle(worker, message)
+            count += 1
+        return count
+
+    def drain(wait=0.0):
+        """ handle the messages of all workers, for wait seconds"""
+        deadline = time.time() + wait
+        while True:
+            received = sum(receive(worker, RECEIVE_BATCH) for worker in workers.values())
+            if time.time() >= deadline:
+                return
+            if not received:
+                time.sleep(min(0.05, max(0.0, deadline - time.time())))
+
+    def retire(worker_id, reason=None):
+        """ remove a stopped worker, report the job it was running, and requeue the jobs it did not start."""
+        worker = workers.pop(worker_id)
+        if worker["connection"] is not None:
+            worker["connection"].close()
+        remaining = worker["jobs"][worker["next"]:]
+        if worker["current"] is not None:
+            if on_killed is not None:
+                on_killed(worker["jobs"][worker["current"]],
+                          reason or "Export process exited with code {}".format(worker["process"].exitcode))
+            remaining = worker["jobs"][worker["current"] + 1:]
+        elif reason is None and worker["process"].exitcode and remaining:
+            # failed between jobs (i.e. in the initializer): blame the next job so the batch keeps moving
+            if on_killed is not None:
+                on_killed(remaining[0], "Export process exited with code {}".format(worker["process"].exitcode))
+            remaining = remaining[1:]
+        pending[0:0] = remaining
+
+    while pending or workers:
+        while pending and len(workers) < processes:
+            group = pending[:jobs_per_process]
+            del pending[:jobs_per_process]
+            connection, child_connection = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(target=_child,
+                                              args=(target, initializer, initargs, group, child_connection))
+            process.daemon = True
+            process.start()
+            child_connection.close()  # so the parent sees the end of the pipe when the child exits
+            workers[next_worker_id] = {"process": process, "jobs": group, "next": 0, "current": None, "started": None,
+                                       "connection": connection}
+            next_worker_id += 1
+
+        drain(poll_interval)
+
+        now = time.time()
+        for worker_id, worker in workers.items():
+            process = worker["process"]
+            if not process.is_alive():
+                process.join()
+                receive(worker)  # results sent just before the process exited
+                retire(worker_id)
+                continue
+            reason = None
+            if timeout and worker["current"] is not None and now - worker["started"] > timeout:
+                reason = "Export process killed: visit exceeded the {}s timeout".format(timeout)
+            elif max_rss_mb:
+                rss = rss_mb(process.pid)
+                if rss is not None and rss > max_rss_mb:
+                    reason = "Export process killed: memory ({:.0f}MB) exceeded the {}MB limit".format(rss, max_rss_mb)
+            if reason:
+                process.terminate()
+                process.join()
+                receive(worker)
+                retire(worker_id, reason)
@@ -0,0 +1,216 @@
+"""
+    Write an exported project as a single zip or tar archive.
+
+    The project is exported into a local temporary folder and streamed into the archive while it is exported (see
+    ArchiveStream), so the share only receives one file per visit. Input files are streamed from their source, and the
+    files written by the export are streamed in at fixed points between the export stages. The files of each point
+    are added sorted by path (project.rs.xml first), so the order of the members and of the checksums is the same
+    for every export of a visit. Each member is hashed while it is written. The archive ends with a CHECKSUMS.sha256
+    member listing the sha256 of every other member, in the format read by "sha256sum -c".
+
+    The archive is written to <archive>.partial and renamed when complete, so an archive is never seen half written.
+"""
+import os
+import time
+import zlib
+import tarfile
+import zipfile
+import hashlib
+import threading
+from StringIO import StringIO
+
+FORMATS = ["zip", "tar"]
+PROJECT_XML = "project.rs.xml"
+CHECKSUMS_NAME = "CHECKSUMS.sha256"
+PARTIAL_SUFFIX = ".partial"
+BLOCKSIZE = 1024 * 1024
+
+
+def archive_path(project_folder, archive_format):
+    """ path of the archive of a project folder (i.e. <visit>/Topo/Project.zip for <visit>/Topo/Project)"""
+    if archive_format not in FORMATS:
+        raise ValueError("Unknown archive format {}. Use one of {}".format(archive_format, FORMATS))
+    return project_folder.rstrip("\\/") + "." + archive_format
+
+
+def _order(member):
+    return member[0] != PROJECT_XML, member[0]
+
+
+def members(folder):
+    """ (archive name, file path) of the files in a folder, in archive order."""
+    files = []
+    for dirpath, dirnames, filenames in os.walk(folder):
+        for filename in filenames:
+            file_path = os.path.join(dirpath, filename)
+            files.append((os.path.relpath(file_path, folder).replace(os.sep, "/"), file_path))
+    files.sort(key=_order)
+    return files
+
+
+class _HashingReader(object):
+    """ file object that hashes the data read from it"""
+
+    def __init__(self, f):
+        self.f = f
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.sha256.update(data)
+        return data
+
+
+def _add_tar(archive, name, file_path):
+    tarinfo = archive.gettarinfo(file_path, name)
+    tarinfo.uid = tarinfo.gid = 0
+    tarinfo.uname = tarinfo.gname = ""
+    with open(file_path, "rb") as f:
+        reader = _HashingReader(f)
+        archive.addfile(tarinfo, reader)
+    return reader.sha256.hexdigest()
+
+
+def _add_zip(archive, name, file_path):
+    """
+    stream a file into a zip archive, hashing it in the same read. Follows ZipFile.write, which reads the file
+    itself: the local header is written first, and written again with the crc and sizes once the file is compressed.
+    """
+    stat = os.stat(file_path)
+    zipinfo = zipfile.ZipInfo(name, time.localtime(stat.st_mtime)[:6])
+    zipinfo.compress_type = zipfile.ZIP_DEFLATED
+    zipinfo.external_attr = (stat.st_mode & 0xFFFF) << 16
+    zipinfo.file_size = stat.st_size
+    zipinfo.flag_bits = 0x00
+    zipinfo.CRC = zipinfo.compress_size = 0  # written again once known
+    zipinfo.header_offset = archive.fp.tell()
+    archive._writecheck(zipinfo)
+    archive._didModify = True
+    # compressed data can be larger than the file
+    zip64 = archive._allowZip64 and stat.st_size * 1.05 > zipfile.ZIP64_LIMIT
+    archive.fp.write(zipinfo.FileHeader(zip64))
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+    sha256 = hashlib.sha256()
+    crc = file_size = compress_size = 0
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(BLOCKSIZE), b""):
+            sha256.update(block)
+            crc = zlib.crc32(block, crc) & 0xffffffff
+            file_size += len(block)
+            data = compressor.compress(block)
+            compress_size += len(data)
+            archive.fp.write(data)
+    data = compressor.flush()
+    compress_size += len(data)
+    archive.fp.write(data)
+    if not zip64 and max(file_size, compress_size) > zipfile.ZIP64_LIMIT:
+        raise RuntimeError("{} grew while it was archived".format(file_path))
+    zipinfo.CRC = crc
+    zipinfo.file_size = file_size
+    zipinfo.compress_size = compress_size
+    position = archive.fp.tell()
+    archive.fp.seek(zipinfo.header_offset, 0)
+    archive.fp.write(zipinfo.FileHeader(zip64))
+    archive.fp.seek(position, 0)
+    archive.filelist.append(zipinfo)
+    archive.NameToInfo[zipinfo.filename] = zipinfo
+    return sha256.hexdigest()
+
+
+def _add_text(archive, name, text):
+    if isinstance(archive, zipfile.ZipFile):
+        zipinfo = zipfile.ZipInfo(name, time.localtime()[:6])
+        zipinfo.compress_type = zipfile.ZIP_DEFLATED
+        zipinfo.external_attr = 0644 << 16
+        archive.writestr(zipinfo, text)
+    else:
+        tarinfo = tarfile.TarInfo(name)
+        tarinfo.size = len(text)
+        tarinfo.mtime = time.time()
+        archive.addfile(tarinfo, StringIO(text))
+
+
+class ArchiveStream(object):
+    """
+    Archive of a project written while the project is exported into a (temporary) folder.
+
+    place_files and place_tree (as with blob_store.BlobStore) record input files, which are streamed into the archive
+    from their source, without a copy in the folder. add_written streams them in with the files written into the
+    folder by the export, at fixed points between the export stages, while the files are still in the file cache.
+    Each member is hashed as it is written, and close() ends the archive with the CHECKSUMS_NAME member.
+    """
+
+    def __init__(self, folder, archive_file, archive_format):
+        """
+        :param folder: folder the project is exported into
+        :param archive_file: path of the archive, replaced when the archive is closed
+        :param archive_format: one of FORMATS
+        """
+        if archive_format not in FORMATS:
+            raise ValueError("Unknown archive format {}. Use one of {}".format(archive_format, FORMATS))
+        self.folder = folder
+        self.archive_file = archive_file
+        self.partial_file = archive_file + PARTIAL_SUFFIX
+        if archive_format == "zip":
+            self.archive = zipfile.ZipFile(self.partial_file, "w", zipfile.ZIP_DEFLATED, allowZip64=True)
+            self._add = _add_zip
+        else:
+            self.archive = tarfile.open(self.partial_file, "w")
+            self._add = _add_tar
+        self.checksums = []
+        self.added = set()
+        self.placed = []  # (archive name, source file) of input files not added yet
+        self.lock = threading.Lock()  # input files are placed by background stages (see stage_executor)
+
+    def place(self, file_path, dest):
+        """ record a file as the member for the path dest in the project folder (added by the next add_written)"""
+        with self.lock:
+            self.placed.append((os.path.relpath(dest, self.folder).replace(os.sep, "/"), file_path))
+
+    def place_files(self, files, dest_folder):
+        for file_path in files:
+            self.place(file_path, os.path.join(dest_folder, os.path.basename(file_path)))
+
+    def place_tree(self, src, dst):
+        for dirpath, dirnames, filenames in os.walk(src):
+            for filename in filenames:
+                self.place(os.path.join(dirpath, filename), os.path.join(dst, os.path.relpath(dirpath, src), filename))
+
+    def add_written(self):
+        """
+        add the input files placed and the files written into the folder since the last call, sorted by path (see
+        members). Call it from the thread running the export stages, once the stages before it (including the
+        background stages placing input files, see stage_executor.StageExecutor.wait_all) are complete.
+        """
+        with self.lock:
+            placed, self.placed = self.placed, []
+        for name, file_path in sorted(placed + members(self.folder), key=_order):
+            if name not in self.added:
+                self.checksums.append((name, self._add(self.archive, name, file_path)))
+                self.added.add(name)
+
+    def close(self):
+        """
+        add the remaining files of the folder and the checksums, and move the archive in place.
+        :return: list of (archive name, sha256) of the members
+        """
+        try:
+            self.add_written()
+            _add_text(self.archive, CHECKSUMS_NAME,
+                      "".join("{}  {}\n".format(digest, name) for name, digest in self.checksums))
+        except:
+            self.abort()
+            raise
+        self.archive.close()
+        if os.path.isfile(self.archive_file):
+            os.remove(self.archive_file)  # rename does not replace files on Windows
+        os.rename(self.partial_file, self.archive_file)
+        return self.checksums
+
+    def abort(self):
+        """ close and remove the unfinished archive"""
+        try:
+            self.archive.close()
+        finally:
+            if os.path.isfile(self.partial_file):
+                os.remove(self.partial_file)
@@ -0,0 +1,177 @@
+"""
+    Manifest of the datasets in an exported project, used to refresh a project in place.
+
+    For each output (path relative to the project folder) the manifest records the fingerprint of the source it was
+    exported from, with the log messages and metadata produced by its export. On a refresh, an output is exported
+    again only if its source fingerprint has changed (or the output is missing). Outputs of datasets that are no
+    longer in the source are removed.
+
+    Fingerprints of geodatabase datasets are read with arcpy (see CHaMP_Data). A source (i.e. the SurveyGDB folder)
+    can be registered with its file fingerprint: while it is unchanged, the datasets exported from it are current
+    without reading them.
+
+    Dataset fingerprints are only read by refresh exports. An export without refresh records its outputs without
+    fingerprints, so the first refresh after it keeps the datasets of unchanged sources and exports the others again.
+"""
+import os
+import json
+import glob
+import shutil
+import hashlib
+import visit_fingerprint
+import file_placement
+
+MANIFEST_NAME = "export_manifest.json"
+# Outputs written as several files with the same name (i.e. DEM.tif, DEM.tfw, DEM.tif.aux.xml)
+MULTI_FILE_EXTENSIONS = [".shp", ".tif", ".dbf"]
+
+
+def source_files(source_path):
+    """ the files of an input dataset (shapefiles include their sidecar files)."""
+    if os.path.splitext(source_path)[1].lower() == ".shp":
+        return glob.glob(os.path.splitext(source_path)[0] + ".*")
+    return [source_path]
+
+
+def file_fingerprint(source_path):
+    """ fingerprint of the files of an input dataset (file, shapefile or folder, i.e. TINs)."""
+    return visit_fingerprint.fingerprint(source_files(source_path), "")
+
+
+def combine(fingerprints):
+    digest = hashlib.sha1()
+    for value in fingerprints:
+        digest.update(str(value))
+    return digest.hexdigest()
+
+
+def output_files(output_path):
+    """ the files of an output (shapefiles and rasters include their sidecar files, folders all their files)."""
+    if os.path.isdir(output_path):
+        for dirpath, dirnames, filenames in os.walk(output_path):
+            for filename in filenames:
+                yield os.path.join(dirpath, filename)
+        return
+    stem, ext = os.path.splitext(output_path)
+    for filepath in glob.glob(stem + ".*") if ext.lower() in MULTI_FILE_EXTENSIONS else [output_path]:
+        if os.path.isfile(filepath):
+            yield filepath
+
+
+def seed(project_folder, staging_folder, strategy="auto"):
+    """
+    Place the datasets recorded in the manifest of a project, and the manifest itself, into an empty staging folder
+    (see project_staging), so a refresh export can keep them. Files are cloned where possible, or hard linked with
+    the hardlink strategy (see file_placement): kept datasets are never modified, and changed datasets are removed
+    before they are exported again.
+    :param strategy: file_placement strategy
+    """
+    manifest_file = os.path.join(project_folder, MANIFEST_NAME)
+    if not os.path.isfile(manifest_file):
+        return
+    with open(manifest_file, "r") as f:
+        datasets = json.load(f)["datasets"]
+    for output in datasets:
+        for filepath in output_files(os.path.join(project_folder, output)):
+            dest = os.path.join(staging_folder, os.path.relpath(filepath, project_folder))
+            if not os.path.isdir(os.path.dirname(dest)):
+                os.makedirs(os.path.dirname(dest))
+            file_placement.place(filepath, dest, strategy)
+    shutil.copy2(manifest_file, staging_folder)
+
+
+def remove_output(output_path):
+    if os.path.isdir(output_path):
+        shutil.rmtree(output_path)
+        return
+    for filepath in list(output_files(output_path)):
+        os.unlink(filepath)
+
+
+class ProjectManifest(object):
+
+    def __init__(self, project_folder, tool_version, refresh=False):
+        """
+        :param project_folder: folder of the exported project
+        :param tool_version: version of the export tool. A manifest written by another version is not used.
+        :param refresh: use the manifest of the previous export. If False, every dataset is exported.
+        """
+        self.project_folder = project_folder
+        self.refresh = refresh
+        self.manifest_file = os.path.join(project_folder, MANIFEST_NAME)
+        self.tool_version = tool_version
+        self.previous = {}
+        self.previous_sources = {}
+        self.loaded = False
+        if refresh and os.path.isfile(self.manifest_file):
+            with open(self.manifest_file, "r") as f:
+                manifest = json.load(f)
+            if manifest.get("tool_version") == tool_version:
+                self.previous = manifest["datasets"]
+                self.previous_sources = manifest["sources"]
+                self.loaded = True
+        self.datasets = {}
+        self.sources = {}
+        self.unchanged_sources = set()
+        self.pending = {}
+
+    def add_source(self, name, source_path):
+        """ register a source folder or file, and check if it has changed since the previous export."""
+        self.sources[name] = source_path
+        if self.previous_sources.get(name) == file_fingerprint(source_path):
+            self.unchanged_sources.add(name)
+
+    def current(self, output, fingerprint, source=None):
+        """
+        Check if an output is current. If not, its previous version is removed and it must be exported and then
+        recorded with record().
+        :param output: output path relative to the project folder
+        :param fingerprint: source fingerprint, or a function returning it (only called by refresh exports, and not if
+                            the registered source the output was exported from is unchanged)
+        :param source: name of the registered source (see add_source) the output is exported from
+        :return: the manifest entry (with the "messages" and "metadata" of its export) if current, otherwise None
+        """
+        entry = self.previous.get(output)
+        output_path = os.path.join(self.project_folder, output)
+        if entry is not None and os.path.exists(output_path):
+            if source is not None and source in self.unchanged_sources and entry.get("source") == source:
+                self.datasets[output] = entry
+                return entry
+            if entry["fingerprint"] is not None:
+                fingerprint = fingerprint() if callable(fingerprint) else fingerprint
+                if entry["fingerprint"] == fingerprint:
+                    self.datasets[output] = entry
+                    return entry
+        remove_output(output_path)
+        self.pending[output] = (fingerprint, source)
+        return None
+
+    def record(self, output, messages=None, metadata=None):
+        """ record an output exported after current() returned None."""
+        value, source = self.pending.pop(output)
+        if not self.refresh:
+            value = None
+        elif callable(value):
+            value = value()
+        entry = {"fingerprint": value,
+                 "source": source,
+                 "messages": list(messages or []),
+                 "metadata": dict(metadata or {})}
+        self.datasets[output] = entry
+        return entry
+
+    def remove_stale(self):
+        """ remove the outputs of the previous export that were not exported or kept in this export."""
+        removed = []
+        for output in self.previous:
+            if output not in self.datasets:
+                remove_output(os.path.join(self.project_folder, output))
+                removed.append(output)
+        return removed
+
+    def save(self):
+        """ write the manifest. Sources are fingerprinted again, since the export may have changed them."""
+        with open(self.manifest_file, "w") as f:
+            json.dump({"tool_version": self.tool_version,
+                       "sources": {name: file_fingerprint(source_path) for name, source_path in self.sources.iteritems()},
+                       "datasets": self.datasets}, f, indent=1, sort_keys=True)
@@ -0,0 +1,152 @@
+"""
+    Staged writes of an exported project.
+
+    A project is exported into a sibling staging folder (<project>.staging.<host>.<pid>) and swapped in with folder
+    renames once
+    the export has succeeded, so readers of the project (i.e. topoproject.TopoProject) never see a half-built
+    project and a failed export leaves the previous version in place.
+
+    The swap renames the live project to <project>.previous, renames the staging folder to the project and then
+    removes the previous version. It is two renames, not one atomic swap: between them there is briefly no live
+    project. If the staging folder cannot be renamed, the previous version is renamed back before the error is raised.
+    If the process stops between the two renames, the previous version is restored by the next export of the
+    project.
+"""
+import os
+import sys
+import time
+import errno
+import shutil
+import socket
+import project_manifest
+
+STAGING_SUFFIX = ".staging"
+PREVIOUS_SUFFIX = ".previous"
+RENAME_ATTEMPTS = 5  # files in the folder can be briefly held open by readers or virus scanners on Windows
+STALE_SECONDS = 24 * 3600  # staging folders of other hosts unchanged for this long are left over from a crash
+
+
+def staging_folder(project_folder):
+    """
+    staging folder of this process. Each host and process has its own, so a visit claimed again from a work queue
+    (see work_queue) does not share its staging folder with the node that lost it.
+    """
+    return "{}{}.{}.{}".format(project_folder.rstrip("\\/"), STAGING_SUFFIX, socket.gethostname(), os.getpid())
+
+
+def _running(pid):
+    """ True if the process pid of this host is running"""
+    if sys.platform == "win32":
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        exit_code = ctypes.c_ulong()
+        try:
+            return kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code)) and exit_code.value == 259  # active
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def stale_staging_folders(project_folder):
+    """
+    staging folders of exports of a project that are no longer running: those of this host whose process has exited,
+    and those of other hosts (or without a host, from older versions) unchanged for STALE_SECONDS.
+    """
+    parent, name = os.path.split(project_folder.rstrip("\\/"))
+    prefix = name + STAGING_SUFFIX
+    host = socket.gethostname()
+    stale = []
+    if not os.path.isdir(parent or "."):
+        return stale
+    for folder in os.listdir(parent or "."):
+        if not (folder == prefix or folder.startswith(prefix + ".")):
+            continue
+        path = os.path.join(parent, folder)
+        owner, _, pid = folder[len(prefix) + 1:].rpartition(".")
+        if owner == host and pid.isdigit():
+            if int(pid) != os.getpid() and not _running(int(pid)):
+                stale.append(path)
+        elif time.time() - os.path.getmtime(path) > STALE_SECONDS:
+            stale.append(path)
+    return stale
+
+
+def previous_folder(project_folder):
+    return project_folder.rstrip("\\/") + PREVIOUS_SUFFIX
+
+
+def _rename(src, dst):
+    for attempt in range(RENAME_ATTEMPTS):
+        try:
+            os.rename(src, dst)
+            return
+        except OSError:
+            if attempt == RENAME_ATTEMPTS - 1:
+                raise
+            time.sleep(1)
+
+
+def recover(project_folder):
+    """ restore the previous version of a project if an export stopped during the swap."""
+    previous = previous_folder(project_folder)
+    if os.path.isdir(previous):
+        if os.path.isdir(project_folder):
+            shutil.rmtree(previous)
+        else:
+            _rename(previous, project_folder)
+
+
+def start(project_folder, refresh=False, placement="auto"):
+    """
+    Create an empty staging folder for a project export. Stale staging folders of failed exports are removed (see
+    stale_staging_folders): the staging folders of exports still running on other nodes are left alone.
+    :param project_folder: live project folder
+    :param refresh: seed the staging folder with the datasets of the live project and its manifest, so they can be
+                    kept by a refresh export (see project_manifest).
+    :param placement: how the datasets are placed into the staging folder (see file_placement)
+    :return: path of the staging folder
+    """
+    recover(project_folder)
+    for folder in stale_staging_folders(project_folder):
+        shutil.rmtree(folder, ignore_errors=True)
+    staging = staging_folder(project_folder)
+    if os.path.isdir(staging):
+        shutil.rmtree(staging)
+    os.makedirs(staging)
+    if refresh and os.path.isdir(project_folder):
+        project_manifest.seed(project_folder, staging, placement)
+    return staging
+
+
+def abort(project_folder):
+    """ remove the staging folder of a failed export of this process. The live project is left as it was."""
+    staging = staging_folder(project_folder)
+    if os.path.isdir(staging):
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def commit(project_folder):
+    """
+    swap the staging folder in as the live project and remove the previous version (two renames, see above). If the
+    staging folder cannot be renamed, the previous version is restored as the live project and the error is raised:
+    the staging folder is left for abort.
+    """
+    staging = staging_folder(project_folder)
+    previous = previous_folder(project_folder)
+    if os.path.isdir(project_folder):
+        _rename(project_folder, previous)
+    try:
+        _rename(staging, project_folder)
+    except:
+        if os.path.isdir(previous) and not os.path.isdir(project_folder):
+            _rename(previous, project_folder)
+        raise
+    if os.path.isdir(previous):
+        shutil.rmtree(previous, ignore_errors=True)
@@ -0,0 +1,316 @@
+"""
+    Block-wise raster processing with NumPy, without a Spatial Analyst license.
+
+    Rasters are read in windows of the cell grid of a reference raster (arcpy.RasterToNumPyArray; cells outside a
+    raster and NoData cells are read as NaN) and processed with vectorized NumPy. Each output block is saved as a
+    temporary GeoTIFF, and the blocks are mosaicked into the output raster when it is complete, so memory use is set
+    by the block size and not by the size of the site.
+
+    Neighbourhood kernels (i.e. slope) read each block with a halo of cells from the neighbouring blocks. Blocks can
+    be computed in a process pool: only the main process uses arcpy, the workers run the numpy kernels. Statistics
+    of the output are collected from the blocks as they are written.
+"""
+import os
+import shutil
+import tempfile
+import multiprocessing
+import numpy
+
+BLOCK_SIZE = 1024
+NODATA = -3.4028235e38  # NoData of float rasters written by arcpy
+
+
+class Grid(object):
+    """ cell grid of a reference raster"""
+
+    def __init__(self, raster):
+        import arcpy
+        desc = arcpy.Describe(raster)
+        self.xmin = desc.Extent.XMin
+        self.ymax = desc.Extent.YMax
+        self.cell_width = desc.meanCellWidth
+        self.cell_height = desc.meanCellHeight
+        self.columns = desc.width
+        self.rows = desc.height
+        self.spatial_reference = desc.spatialReference
+
+    def same_spatial_reference(self, other):
+        """ True if other has the coordinate system of this grid (same factory code, or the same WKT without one)"""
+        if self.spatial_reference.factoryCode and other.spatial_reference.factoryCode:
+            return self.spatial_reference.factoryCode == other.spatial_reference.factoryCode
+        return self.spatial_reference.exportToString() == other.spatial_reference.exportToString()
+
+    def aligned(self, other):
+        """ True if the cells of other are the cells of this grid (same coordinate system and cell size, same corners)"""
+        if not self.same_spatial_reference(other):
+            return False
+        tolerance = self.cell_width * 1e-6
+        if abs(self.cell_width - other.cell_width) > tolerance or abs(self.cell_height - other.cell_height) > tolerance:
+            return False
+        for offset, cell in [(other.xmin - self.xmin, self.cell_width), (other.ymax - self.ymax, self.cell_height)]:
+            if abs(offset / cell - round(offset / cell)) * cell > tolerance:
+                return False
+        return True
+
+    def blocks(self, block_size=BLOCK_SIZE):
+        """ (row, column, rows, columns) of the blocks covering the grid"""
+        for row in range(0, self.rows, block_size):
+            for column in range(0, self.columns, block_size):
+                yield row, column, min(block_size, self.rows - row), min(block_size, self.columns - column)
+
+    def lower_left(self, row, column, rows):
+        import arcpy
+        return arcpy.Point(self.xmin + column * self.cell_width, self.ymax - (row + rows) * self.cell_height)
+
+    def window(self, row, column):
+        """ (x, y of the upper left corner, cell width, cell height) of a block, passed to block kernels"""
+        return (self.xmin + column * self.cell_width, self.ymax - row * self.cell_height,
+                self.cell_width, self.cell_height)
+
+
+def read_block(raster, grid, row, column, rows, columns):
+    """
+    Read a window of the grid from a raster on the grid (the window may extend past the raster).
+    :return: float32 array of rows x columns, NaN where the raster has no data
+    """
+    import arcpy
+    array = arcpy.RasterToNumPyArray(raster, grid.lower_left(row, column, rows), columns, rows, numpy.nan)
+    return array.astype(numpy.float32, copy=False)
+
+
+class BlockWriter(object):
+    """ output raster on a grid, written block by block"""
+
+    def __init__(self, grid):
+        self.grid = grid
+        self.folder = tempfile.mkdtemp(prefix="champ_blocks_")
+        self.block_rasters = []
+
+    def write(self, row, column, array):
+        """ save a block of the output. NaN cells are written as NoData."""
+        import arcpy
+        rows, columns = array.shape
+        array = numpy.where(numpy.isnan(array), NODATA, array).astype(numpy.float32)
+        block_raster = os.path.join(self.folder, "block_{}.tif".format(len(self.block_rasters)))
+        arcpy.NumPyArrayToRaster(array, self.grid.lower_left(row, column, rows), self.grid.cell_width,
+                                 self.grid.cell_height, NODATA).save(block_raster)
+        self.block_rasters.append(block_raster)
+
+    def save(self, output_raster):
+        """ mosaic the blocks into the output raster"""
+        import arcpy
+        output_folder, output_name = os.path.split(output_raster)
+        arcpy.MosaicToNewRaster_management(self.block_rasters, output_folder, output_name,
+                                           self.grid.spatial_reference, "32_BIT_FLOAT", self.grid.cell_width, 1,
+                                           "FIRST")
+
+    def close(self):
+        """ remove the temporary block rasters"""
+        import arcpy
+        for block_raster in self.block_rasters:
+            arcpy.Delete_management(block_raster)
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+
+def _run_kernel(task):
+    kernel, arrays, window, args = task
+    return kernel(arrays, window, *args)
+
+
+def map_blocks(kernel, rasters, output_raster, halo=0, processes=0, args=(), block_size=BLOCK_SIZE):
+    """
+    Compute a raster on the grid of rasters[0], block by block.
+    :param kernel: kernel(arrays, window, *args) returns the output block (float array, NaN for NoData). arrays are
+                   the blocks of the input rasters, with halo cells on each side (NaN outside the rasters). window
+                   is Grid.window of the block. Must be a module level function if processes > 0.
+    :param rasters: input rasters, aligned with the grid of the first
+    :param halo: number of neighbouring cells read on each side of a block
+    :param processes: size of the process pool computing the blocks. 0 computes them in this process (as do pool
+                      workers, which cannot start processes of their own).
+    :return: statistics of the output raster (see Statistics.result)
+    """
+    grid = Grid(rasters[0])
+    if multiprocessing.current_process().daemon:
+        processes = 0
+    pool = multiprocessing.Pool(processes) if processes > 0 else None
+    writer = BlockWriter(grid)
+    output_statistics = Statistics()
+    try:
+        blocks = list(grid.blocks(block_size))
+        batch_size = max(1, processes * 2)
+        pending = None  # (blocks, results) of the batch computed while the next batch is read
+
+        def write_batch(batch, results):
+            for (row, column, rows, columns), result in zip(batch, results.get() if pool is not None else results):
+                writer.write(row, column, result)
+                output_statistics.add(result)
+
+        for start in range(0, len(blocks), batch_size):
+            batch = blocks[start:start + batch_size]
+            tasks = [(kernel,
+                      [read_block(raster, grid, row - halo, column - halo, rows + 2 * halo, columns + 2 * halo)
+                       for raster in rasters],
+                      grid.window(row, column),
+                      args) for row, column, rows, columns in batch]
+            if pool is not None:
+                results = pool.map_async(_run_kernel, tasks)
+            else:
+                results = [_run_kernel(task) for task in tasks]
+            if pending is not None:
+                write_batch(*pending)
+            pending = (batch, results)
+        if pending is not None:
+            write_batch(*pending)
+        writer.save(output_raster)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        writer.close()
+    return output_statistics.result()
+
+
+def _depth(arrays, window):
+    dem, wsedem = arrays
+    with numpy.errstate(invalid="ignore"):
+        return numpy.maximum(wsedem - dem, 0)  # NaN (NoData) is kept by maximum
+
+
+def water_depth(dem, wsedem, output_raster, block_size=BLOCK_SIZE):
+    """
+    Water depth (water surface elevation - DEM, 0 where the water surface is below the DEM) on the DEM grid.
+    NoData where either raster has no data. wsedem must be aligned with the DEM grid (see Grid.aligned).
+    :return: statistics of the water depth raster (see Statistics.result)
+    """
+    return map_blocks(_depth, [dem, wsedem], output_raster, block_size=block_size)
+
+
+HISTOGRAM_BINS = 32  # even, see Statistics
+
+
+class Statistics(object):
+    """
+    Statistics of the values of a raster, accumulated block by block in one pass (see map_blocks).
+
+    The histogram range is not known before the last block, so the histogram starts on the range of the first
+    block, and its bins are merged in pairs (doubling their width) whenever a block has values outside the range.
+    histogram_range covers the minimum and maximum, but can be wider than the minimum to the maximum.
+    """
+
+    def __init__(self, bins=HISTOGRAM_BINS):
+        self.bins = bins
+        self.cells = 0
+        self.valid = 0
+        self.mean = 0.0
+        self.m2 = 0.0  # sum of squared differences from the mean, merged block by block (Chan et al.)
+        self.minimum = numpy.inf
+        self.maximum = -numpy.inf
+        self.low = None
+        self.width = None
+        self.counts = numpy.zeros(bins, dtype=numpy.int64)
+
+    def _grow(self, minimum, maximum):
+        """ widen the histogram range until it covers minimum and maximum"""
+        while minimum < self.low or maximum > self.low + self.bins * self.width:
+            merged = self.counts.reshape(self.bins // 2, 2).sum(axis=1)
+            self.counts = numpy.zeros(self.bins, dtype=numpy.int64)
+            if minimum < self.low:  # extend down, keeping the top of the range
+                self.counts[self.bins // 2:] = merged
+                self.low -= self.bins * self.width
+            else:  # extend up, keeping the bottom of the range
+                self.counts[:self.bins // 2] = merged
+            self.width *= 2
+
+    def add(self, block):
+        """ add a block of values (NaN for NoData)"""
+        self.cells += block.size
+        values = block[~numpy.isnan(block)].astype(numpy.float64)
+        if not values.size:
+            return
+        block_mean = values.mean()
+        delta = block_mean - self.mean
+        total = self.valid + values.size
+        self.mean += delta * values.size / total
+        self.m2 += ((values - block_mean) ** 2).sum() + delta ** 2 * self.valid * values.size / total
+        self.valid = total
+        minimum, maximum = values.min(), values.max()
+        self.minimum, self.maximum = min(self.minimum, minimum), max(self.maximum, maximum)
+        if self.low is None:
+            self.low = minimum
+            self.width = (maximum - minimum) / self.bins or max(abs(minimum), 1.0) * 1e-6
+        self._grow(minimum, maximum)
+        high = self.low + self.bins * self.width
+        self.counts += numpy.histogram(numpy.clip(values, self.low, high), self.bins, (self.low, high))[0]
+
+    def result(self):
+        """
+        :return: dict of minimum, maximum, mean, stddev, valid_cells, nodata_fraction, histogram (counts of bins
+                 equal intervals of histogram_range) and histogram_range (low, high). minimum, maximum, mean,
+                 stddev and histogram_range are None if the raster has no data.
+        """
+        valid = self.valid
+        return {"minimum": float(self.minimum) if valid else None,
+                "maximum": float(self.maximum) if valid else None,
+                "mean": self.mean if valid else None,
+                "stddev": (self.m2 / valid) ** 0.5 if valid else None,
+                "valid_cells": valid,
+                "nodata_fraction": 1.0 - float(valid) / self.cells if self.cells else 1.0,
+                "histogram": self.counts.tolist(),
+                "histogram_range": (float(self.low), float(self.low + self.bins * self.width)) if valid else None}
+
+
+def statistics(raster, bins=HISTOGRAM_BINS, block_size=BLOCK_SIZE):
+    """
+    Statistics of a raster (see Statistics), read one block at a time. For rasters without statistics stored when
+    they were written (see stored_statistics).
+    """
+    grid = Grid(raster)
+    accumulator = Statistics(bins)
+    for row, column, rows, columns in grid.blocks(block_size):
+        accumulator.add(read_block(raster, grid, row, column, rows, columns))
+    return accumulator.result()
+
+
+def stored_statistics(raster_file, bins=HISTOGRAM_BINS):
+    """
+    Statistics stored with a raster file when it was written (arcpy and GDAL write them with a histogram to the
+    <raster>.aux.xml file), in the form of Statistics.result. The cell counts come from the histogram, so stored
+    statistics are only used if they are exact: not marked approximate (GDAL), not computed with skip factors
+    (arcpy), and with a histogram covering every value.
+    :return: None if the file has no exact stored statistics and histogram
+    """
+    import xml.etree.ElementTree as ET
+    aux_file = raster_file + ".aux.xml"
+    if not os.path.isfile(aux_file):
+        return None
+    band = ET.parse(aux_file).getroot().find("PAMRasterBand")
+    if band is None:
+        return None
+    items = dict((item.get("key"), item.text) for item in band.iter("MDI"))
+    histogram = band.find("Histograms/HistItem")
+    keys = ["STATISTICS_MINIMUM", "STATISTICS_MAXIMUM", "STATISTICS_MEAN", "STATISTICS_STDDEV"]
+    if histogram is None or any(key not in items for key in keys):
+        return None
+    if histogram.findtext("Approximate", "1").strip() != "0" or \
+            items.get("STATISTICS_APPROXIMATE", "NO").upper() == "YES" or \
+            any(float(items.get(key, 1)) > 1 for key in ["STATISTICS_SKIPFACTORX", "STATISTICS_SKIPFACTORY"]):
+        return None
+    if histogram.findtext("IncludeOutOfRange", "0").strip() != "1" and \
+            (float(histogram.findtext("HistMin")) > float(items["STATISTICS_MINIMUM"]) or
+             float(histogram.findtext("HistMax")) < float(items["STATISTICS_MAXIMUM"])):
+        return None
+    counts = numpy.array([int(count) for count in histogram.findtext("HistCounts").split("|")], dtype=numpy.int64)
+    if len(counts) % bins == 0:
+        counts = counts.reshape(bins, -1).sum(axis=1)
+    import arcpy
+    desc = arcpy.Describe(raster_file)
+    cells = desc.width * desc.height
+    valid = int(counts.sum())
+    return {"minimum": float(items["STATISTICS_MINIMUM"]),
+            "maximum": float(items["STATISTICS_MAXIMUM"]),
+            "mean": float(items["STATISTICS_MEAN"]),
+            "stddev": float(items["STATISTICS_STDDEV"]),
+            "valid_cells": valid,
+            "nodata_fraction": 1.0 - float(valid) / cells if cells else 1.0,
+            "histogram": counts.tolist(),
+            "histogram_range": (float(histogram.findtext("HistMin")), float(histogram.findtext("HistMax")))}
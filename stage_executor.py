@@ -0,0 +1,76 @@
+"""
+    Run the file-copy stages of a survey export in background threads while the arcpy stages run in the main thread.
+
+    arcpy is not thread safe, so only plain file operations (shutil copies of the sqlite template, instrument files,
+    TINs and map images) are submitted to the thread pool. A main thread stage that depends on a copy (i.e. the QA
+    tables written into the copied sqlite template) waits for it with wait(name). All copies are finished (and
+    their errors raised) when the executor is closed.
+"""
+from multiprocessing.pool import ThreadPool
+
+
+class StageExecutor(object):
+
+    def __init__(self, threads=4, timer=None):
+        """
+        :param threads: number of background threads. 0 runs each stage in the main thread when it is submitted.
+        :param timer: stage_timer.StageTimer to record the stages with
+        """
+        self.pool = ThreadPool(threads) if threads > 0 else None
+        self.timer = timer
+        self.stages = []
+        self.results = {}
+
+    def _run(self, name, func, args):
+        if self.timer is None:
+            return func(*args)
+        with self.timer.stage(name):
+            return func(*args)
+
+    def submit(self, name, func, *args):
+        """ run func(*args) as a background stage."""
+        self.stages.append(name)
+        if self.pool is None:
+            self.results[name] = _Done(self._run(name, func, args))
+        else:
+            self.results[name] = self.pool.apply_async(self._run, (name, func, args))
+
+    def wait(self, name):
+        """ wait for a background stage, raising its exception if it failed."""
+        return self.results[name].get()
+
+    def wait_all(self):
+        """ wait for the background stages submitted so far, raising the exception of the first stage that failed."""
+        for name in self.stages:
+            self.wait(name)
+
+    def close(self):
+        """ wait for all background stages, raising the exception of the first stage that failed."""
+        try:
+            self.wait_all()
+        finally:
+            self._shutdown()
+
+    def _shutdown(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # the export already failed: let the running copies finish, keep the original exception
+            self._shutdown()
+
+
+class _Done(object):
+    def __init__(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
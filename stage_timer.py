@@ -0,0 +1,243 @@
+"""
+    Wall time, cpu time and peak memory of the stages of a survey export.
+
+    Timings are stored in the StageTimings table of the batch export log (export_log.db). Run this module with the
+    path to the log database to report the median and 95th percentile time of each stage for a batch run.
+"""
+import os
+import sys
+import time
+import ctypes
+import ctypes.util
+import threading
+from contextlib import contextmanager
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+SAMPLE_INTERVAL = 0.2  # seconds between samples of the resident memory while stages run
+
+
+def _windows_working_set():
+    class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+        _fields_ = [("cb", ctypes.c_ulong), ("PageFaultCount", ctypes.c_ulong)] + \
+                   [(name, ctypes.c_size_t) for name in ["PeakWorkingSetSize", "WorkingSetSize",
+                                                         "QuotaPeakPagedPoolUsage", "QuotaPagedPoolUsage",
+                                                         "QuotaPeakNonPagedPoolUsage", "QuotaNonPagedPoolUsage",
+                                                         "PagefileUsage", "PeakPagefileUsage"]]
+    counters = PROCESS_MEMORY_COUNTERS()
+    counters.cb = ctypes.sizeof(counters)
+    if not ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(),
+                                                    ctypes.byref(counters), counters.cb):
+        return None
+    return counters.WorkingSetSize
+
+
+def current_rss():
+    """ resident memory of this process now in MB, or None if it cannot be measured on this platform."""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / 1048576.0
+    if sys.platform.startswith("linux"):
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1048576.0
+    if sys.platform == "win32":
+        working_set = _windows_working_set()
+        return working_set / 1048576.0 if working_set is not None else None
+    return None
+
+
+def _thread_cpu_clock():
+    """ function returning the cpu time (s) of the calling thread, or None if not available on this platform"""
+    if sys.platform == "win32":
+        kernel32 = ctypes.windll.kernel32
+
+        def thread_cpu_time():
+            creation, exit, kernel, user = [ctypes.c_ulonglong() for i in range(4)]
+            kernel32.GetThreadTimes(kernel32.GetCurrentThread(), ctypes.byref(creation), ctypes.byref(exit),
+                                    ctypes.byref(kernel), ctypes.byref(user))
+            return (kernel.value + user.value) / 1e7  # 100 ns units
+        return thread_cpu_time
+
+    clock_id = {"linux": 3, "darwin": 16}.get(sys.platform.rstrip("0123456789"))  # CLOCK_THREAD_CPUTIME_ID
+    try:
+        clock_gettime = ctypes.CDLL(ctypes.util.find_library("rt"), use_errno=True).clock_gettime
+    except (OSError, AttributeError):
+        return None
+    if clock_id is None:
+        return None
+
+    class timespec(ctypes.Structure):
+        _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+    def thread_cpu_time():
+        ts = timespec()
+        if clock_gettime(clock_id, ctypes.byref(ts)) != 0:
+            raise OSError(ctypes.get_errno(), "clock_gettime failed")
+        return ts.tv_sec + ts.tv_nsec * 1e-9
+    return thread_cpu_time
+
+
+thread_cpu_time = _thread_cpu_clock()
+
+
+def cpu_time():
+    """ cpu time (s) of the calling thread, or of the whole process where thread cpu time is not available"""
+    if thread_cpu_time is not None:
+        return thread_cpu_time()
+    user, system = os.times()[:2]
+    return user + system
+
+
+class StageTimer(object):
+    """
+    Collects timings for named stages. A stage entered more than once accumulates its times. Stages can run in
+    several threads at once (see stage_executor): their cpu time is that of the thread running the stage. Where
+    thread cpu time is not available, only the process cpu time can be measured, so the cpu time of a stage that
+    overlapped another stage is not reported (None).
+
+    The peak memory of a stage is the largest resident memory of the process sampled while it ran (at its start and
+    end, and every SAMPLE_INTERVAL seconds by a sampler thread), so it reflects that stage rather than earlier ones.
+    Memory of stages running at the same time is shared, so overlapping stages can report the same peak.
+    """
+
+    def __init__(self):
+        self.stages = []
+        self.timings = {}
+        self.lock = threading.Lock()
+        self.count = 0
+        self.running = set()  # numbers of the running stages
+        self.overlapped = set()  # numbers of the running stages that overlapped another stage
+        self.peaks = {}  # number of each running stage: peak resident memory sampled while it runs
+        self.sampler = None
+
+    def _sample(self):
+        """ record the resident memory as a peak candidate of each running stage"""
+        rss = current_rss()
+        if rss is None:
+            return
+        with self.lock:
+            for number in self.running:
+                self.peaks[number] = max(self.peaks.get(number), rss)
+
+    def _run_sampler(self):
+        while True:
+            time.sleep(SAMPLE_INTERVAL)
+            with self.lock:
+                if not self.running:
+                    self.sampler = None
+                    return
+            self._sample()
+
+    @contextmanager
+    def stage(self, name):
+        with self.lock:
+            self.count += 1
+            number = self.count
+            if self.running:
+                self.overlapped.update(self.running)
+                self.overlapped.add(number)
+            self.running.add(number)
+            if self.sampler is None:
+                self.sampler = threading.Thread(target=self._run_sampler)
+                self.sampler.daemon = True
+                self.sampler.start()
+        self._sample()
+        wall_start = time.time()
+        cpu_start = cpu_time()
+        try:
+            yield
+        finally:
+            wall = time.time() - wall_start
+            cpu = cpu_time() - cpu_start
+            self._sample()
+            with self.lock:
+                rss = self.peaks.pop(number, None)
+                self.running.discard(number)
+                if number in self.overlapped:
+                    self.overlapped.discard(number)
+                    if thread_cpu_time is None:
+                        cpu = None
+                if name not in self.timings:
+                    self.stages.append(name)
+                    self.timings[name] = [0.0, 0.0, None]
+                timing = self.timings[name]
+                timing[0] += wall
+                timing[1] = None if cpu is None or timing[1] is None else timing[1] + cpu
+                timing[2] = rss if timing[2] is None else max(timing[2], rss)
+
+    def items(self):
+        """ (stage, wall time s, cpu time s, peak rss MB while the stage ran) in the order the stages first ran."""
+        for name in self.stages:
+            wall, cpu, rss = self.timings[name]
+            yield name, wall, cpu, rss
+
+    def summary(self):
+        lines = []
+        for name, wall, cpu, rss in self.items():
+            lines.append("  {0:<24} wall {1:8.2f}s  cpu {2}  peak rss {3}".format(
+                name, wall, "{:8.2f}s".format(cpu) if cpu is not None else "     n/a",
+                "{:.0f}MB".format(rss) if rss is not None else "n/a"))
+        return lines
+
+
+def create_table(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS StageTimings (run text,
+                                                             year text,
+                                                             watershed text,
+                                                             site text,
+                                                             visit text,
+                                                             stage text,
+                                                             wall_time real,
+                                                             cpu_time real,
+                                                             peak_rss_mb real)''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_StageTimings_run ON StageTimings (run, stage)")
+    conn.commit()
+
+
+def store_timings(log, run, year, watershed, site, visit, timer):
+    for name, wall, cpu, rss in timer.items():
+        log.execute("INSERT INTO StageTimings VALUES (?,?,?,?,?,?,?,?,?)",
+                    (run, year, watershed, site, visit, name, wall, cpu, rss))
+
+
+def percentile(values, pct):
+    """ nearest-rank percentile of a sorted list."""
+    if not values:
+        return None
+    rank = int(round(pct / 100.0 * (len(values) - 1)))
+    return values[rank]
+
+
+def report(db_path, run=None):
+    import sqlite3
+    conn = sqlite3.connect(db_path)
+    if run is None:
+        run = conn.execute("SELECT max(run) FROM StageTimings").fetchone()[0]
+    print "Stage timings for run {}".format(run)
+    print "  {0:<24} {1:>6} {2:>10} {3:>10} {4:>10} {5:>12}".format("stage", "visits", "p50 wall", "p95 wall", "p95 cpu", "max rss")
+    stages = [row[0] for row in conn.execute("SELECT stage FROM StageTimings WHERE run=? GROUP BY stage ORDER BY min(rowid)", (run,))]
+    for stage in stages:
+        rows = conn.execute("SELECT wall_time, cpu_time, peak_rss_mb FROM StageTimings WHERE run=? AND stage=?", (run, stage)).fetchall()
+        walls = sorted(r[0] for r in rows)
+        cpus = sorted(r[1] for r in rows if r[1] is not None)
+        rss = [r[2] for r in rows if r[2] is not None]
+        print "  {0:<24} {1:>6} {2:>9.2f}s {3:>9.2f}s {4:>10} {5:>12}".format(
+            stage, len(rows), percentile(walls, 50), percentile(walls, 95),
+            "{:.2f}s".format(percentile(cpus, 95)) if cpus else "n/a",
+            "{:.0f}MB".format(max(rss)) if rss else "n/a")
+    conn.close()
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Report per-stage export timings from a batch export log")
+    parser.add_argument('export_log', help='Path to export_log.db', type=str)
+    parser.add_argument('--run', help='Batch run to report (default: latest run)', type=str, default=None)
+    args = parser.parse_args()
+    report(args.export_log, args.run)
+
+
+if __name__ == '__main__':
+    main()
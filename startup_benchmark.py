@@ -0,0 +1,51 @@
+"""
+    Measure the startup time of the export tools: each command runs in a new Python process (as a batch export
+    worker does) and the median wall time of the runs is reported.
+
+    arcpy is only imported at the first geoprocessing call (see CHaMP_Data), so importing the tools and running
+    BatchExport --help should take milliseconds; "import arcpy" is measured for reference.
+"""
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+COMMANDS = [("import BatchExport", ["-c", "import BatchExport"]),
+            ("BatchExport --help", ["BatchExport.py", "--help"]),
+            ("import CHaMP_Data", ["-c", "import CHaMP_Data"]),
+            ("import CHaMP_Survey_Data_Project_Export", ["-c", "import CHaMP_Survey_Data_Project_Export"]),
+            ("import arcpy", ["-c", "import arcpy"])]
+
+
+def time_command(args, repeats):
+    """
+    :return: median wall time in seconds, or None if the command fails (i.e. arcpy is not installed)
+    """
+    times = []
+    with open(os.devnull, "w") as devnull:
+        for i in range(repeats):
+            start = time.time()
+            if subprocess.call([sys.executable] + args, stdout=devnull, stderr=devnull,
+                               cwd=os.path.dirname(os.path.abspath(__file__))) != 0:
+                return None
+            times.append(time.time() - start)
+    times.sort()
+    return times[len(times) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the startup time of the export tools.")
+    parser.add_argument('--repeats', help='number of runs of each command', type=int, default=5)
+    args = parser.parse_args()
+
+    baseline = time_command(["-c", "pass"], args.repeats)
+    print "{:<42}{:>10}".format("Command", "Median ms")
+    print "{:<42}{:>10.0f}".format("python (baseline)", baseline * 1000)
+    for name, command in COMMANDS:
+        median = time_command(command, args.repeats)
+        print "{:<42}{:>10}".format(name, "failed" if median is None else "{:.0f}".format(median * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+    Year/Watershed/Site/Visit filters for batch processing.
+
+    Filter values may be exact names, glob patterns (i.e. "Upper*", "CBW05583-*") or numeric ranges (i.e.
+    "2012-2014", "3500-3999"). Values are compared without leading/trailing spaces, so "Methow" matches the
+    "Methow " watershed folder. Filters are applied while walking the archive, so folders outside the filters are
+    never listed, and levels filtered by a few exact names are looked up directly instead of listed.
+"""
+import os
+import re
+from fnmatch import fnmatchcase
+
+# Levels with at most this many exact names (and no patterns or ranges) are looked up directly instead of listed.
+PROBE_LIMIT = 20
+
+RANGE_PATTERN = re.compile(r"^(\d+)\s*-\s*(\d+)$")
+
+
+class LevelFilter(object):
+    """
+    Filter for the folder names at one level of the archive.
+    """
+
+    def __init__(self, values):
+        self.names = set()
+        self.exact = set()
+        self.patterns = []
+        self.ranges = []
+        for value in values:
+            value_stripped = value.strip()
+            if not value_stripped:
+                continue
+            match = RANGE_PATTERN.match(value_stripped)
+            if match:
+                self.ranges.append((int(match.group(1)), int(match.group(2))))
+            elif any(c in value_stripped for c in "*?["):
+                self.patterns.append(value_stripped)
+            else:
+                self.names.add(value)
+                self.exact.add(value_stripped)
+
+    def match(self, name):
+        name = name.strip()
+        if name in self.exact:
+            return True
+        if self.ranges and name.isdigit():
+            number = int(name)
+            if any(low <= number <= high for low, high in self.ranges):
+                return True
+        return any(fnmatchcase(name, pattern) for pattern in self.patterns)
+
+    def probe_names(self):
+        """ folder names to look up directly, or None if the level needs to be listed."""
+        if self.patterns or self.ranges or len(self.names) > PROBE_LIMIT:
+            return None
+        return sorted(self.names)
+
+
+def read_filter_file(filename):
+    """ values from a text or csv file, separated by commas, spaces or new lines. Lines starting with # are ignored."""
+    values = []
+    with open(filename, "r") as f:
+        for line in f:
+            if not line.strip().startswith("#"):
+                values.extend(v for v in re.split(r"[,\s]+", line) if v)
+    return values
+
+
+def level_filter(value_string=None, filename=None):
+    """ LevelFilter from a comma delimited string and/or a filter file, or None if there is nothing to filter."""
+    values = []
+    if value_string is not None:
+        values.extend(value_string.split(","))
+    if filename is not None:
+        values.extend(read_filter_file(filename))
+    return LevelFilter(values) if value_string is not None or filename is not None else None
+
+
+class VisitFilter(object):
+    """
+    Filters for the Year/Watershed/Site/Visit levels of a CHaMP data archive.
+    """
+
+    def __init__(self, years=None, watersheds=None, sites=None, visits=None):
+        self.years = years
+        self.watersheds = watersheds
+        self.sites = sites
+        self.visits = visits
+
+    def _children(self, index, path, levelfilter):
+        """ matching sub folders of path."""
+        if levelfilter is None:
+            return index.subdirs(path)
+        names = levelfilter.probe_names()
+        if names is not None and all(os.path.isdir(os.path.join(path, name)) for name in names):
+            return names
+        return [name for name in index.subdirs(path) if levelfilter.match(name)]
+
+    def walk(self, index, path_input):
+        """
+        Walk the archive, only listing folders within the year, watershed and site filters.
+        :param index: visit_index.VisitIndex
+        :param path_input: archive folder containing the year folders
+        :return: generator of (year, watershed, site, path_site, visit folder, visit id, True if visit is within
+                 the visit filter)
+        """
+        for year in self._children(index, path_input, self.years):
+            path_year = os.path.join(path_input, year)
+            for watershed in self._children(index, path_year, self.watersheds):
+                path_watershed = os.path.join(path_year, watershed)
+                for site in self._children(index, path_watershed, self.sites):
+                    path_site = os.path.join(path_watershed, site)
+                    for visit in index.subdirs(path_site):
+                        visit_id = visit.lstrip("VISIT_")
+                        yield year, watershed, site, path_site, visit, visit_id, \
+                            self.visits is None or self.visits.match(visit_id)
@@ -0,0 +1,69 @@
+"""
+    Fingerprints of the input datasets of a visit, used to skip visits that have not changed since their last
+    successful export.
+"""
+import os
+import hashlib
+
+BLOCKSIZE = 1024 * 1024
+
+
+def dataset_files(filepath):
+    """ all files in a dataset (file or folder), in a stable order. Geodatabase lock files are left out."""
+    if os.path.isdir(filepath):
+        for dirpath, dirnames, filenames in os.walk(filepath):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if not filename.endswith(".lock"):
+                    yield os.path.join(dirpath, filename)
+    elif os.path.isfile(filepath):
+        yield filepath
+
+
+def _bytes(value):
+    return value.encode("utf-8") if isinstance(value, unicode) else str(value)
+
+
+def fingerprint(input_paths, tool_version, hash_content=False):
+    """
+    Build a fingerprint of a set of input datasets from the size and mtime (and optionally contents) of every file.
+    :param input_paths: list of input dataset files or folders (i.e. SurveyGDB, TINs, csv, instrument files)
+    :param tool_version: version of the export tool. A new version invalidates all fingerprints.
+    :param hash_content: include the file contents in the fingerprint.
+    :return: hex digest string
+    """
+    digest = hashlib.sha1()
+    digest.update(_bytes(tool_version))
+    for input_path in sorted(p for p in input_paths if p):
+        digest.update(_bytes(os.path.basename(input_path)))
+        for filepath in dataset_files(input_path):
+            stat = os.stat(filepath)
+            digest.update(_bytes(os.path.relpath(filepath, input_path)))
+            digest.update("|{}|{}".format(stat.st_size, int(stat.st_mtime)))
+            if hash_content:
+                with open(filepath, "rb") as f:
+                    for block in iter(lambda: f.read(BLOCKSIZE), b""):
+                        digest.update(block)
+    return digest.hexdigest()
+
+
+def create_table(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS VisitFingerprints (year text,
+                                                                  watershed text,
+                                                                  site text,
+                                                                  visit text,
+                                                                  fingerprint text,
+                                                                  timestamp text,
+                                                                  PRIMARY KEY (year, watershed, site, visit))''')
+    conn.commit()
+
+
+def load_fingerprints(conn):
+    """ dictionary of {(year, watershed, site, visit): fingerprint} of the last successful export of each visit."""
+    return {(year, watershed, site, visit): value for year, watershed, site, visit, value in
+            conn.execute("SELECT year, watershed, site, visit, fingerprint FROM VisitFingerprints")}
+
+
+def store_fingerprint(log, timestamp, year, watershed, site, visit, value):
+    log.execute("INSERT OR REPLACE INTO VisitFingerprints VALUES (?,?,?,?,?,?)",
+                (year, watershed, site, visit, value, timestamp))
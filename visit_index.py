@@ -0,0 +1,151 @@
+"""
+    Single-pass discovery of CHaMP visit folders and their input datasets.
+
+    Each directory is listed once with scandir and the listing is cached (with the directory mtime) in a json
+    manifest, so a rerun only re-lists directories that have changed since the last batch.
+
+    Signatures of Topo folders (see VisitIndex.signature) are cached in memory with the modified times of the folder
+    and its sub folders, so watch mode only walks the files of folders that have changed since the last poll.
+"""
+import os
+import json
+from fnmatch import fnmatch
+import visit_fingerprint
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+# Bucket, dataset name and patterns checked in the Topo folder and its first level of subfolders (equivalent of
+# the glob patterns previously run for each visit).
+TOPO_PATTERNS = [("datasets", "SurveyGDB", ["*.gdb"], False),
+                 ("datasets", "TopoTIN", ["tin*"], False),
+                 ("datasets", "WSETIN", ["wsetin*"], False),
+                 ("datasets", "ChannelUnitCSV", ["ChannelUnits.csv"], False),
+                 ("inst_datasets", "InstrumentFiles_JOB", ["*.job"], True),
+                 ("inst_datasets", "InstrumentFiles_MJF", ["*.mjf"], True),
+                 ("opt_datasets", "InstrumentFiles_RAW", ["*.raw"], True),
+                 ("opt_datasets", "DXF_File", ["*.dxf", "*.shp"], True)]
+
+# Folders in the Topo folder that are datasets themselves and are not searched for instrument or dxf files.
+DATASET_FOLDER_PATTERNS = ["*.gdb", "tin*", "wsetin*"]
+
+
+def _scan(path):
+    """ list (name, is_dir) for each entry in path."""
+    if scandir is not None:
+        return [(entry.name, entry.is_dir()) for entry in scandir(path)]
+    return [(name, os.path.isdir(os.path.join(path, name))) for name in os.listdir(path)]
+
+
+class VisitIndex(object):
+    """
+    Cached directory listings for a CHaMP data archive (Year/Watershed/Site/Visit/Topo).
+    """
+
+    def __init__(self, index_file=None, rescan=False):
+        self.index_file = index_file
+        self.listings = {}
+        self.signatures = {}  # Topo folder: (modified times of the folder and its sub folders, signature)
+        self.changed = False
+        if index_file and not rescan and os.path.isfile(index_file):
+            with open(index_file, "r") as f:
+                self.listings = json.load(f)
+
+    def list_dir(self, path):
+        """ (name, is_dir) for each entry in path. Reuses the cached listing if the directory mtime is unchanged."""
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return []
+        cached = self.listings.get(path)
+        if cached and cached["mtime"] == mtime:
+            return cached["entries"]
+        entries = _scan(path)
+        self.listings[path] = {"mtime": mtime, "entries": entries}
+        self.changed = True
+        return entries
+
+    def subdirs(self, path):
+        return [name for name, is_dir in self.list_dir(path) if is_dir]
+
+    def classify_topo(self, path_topo):
+        """
+        Sort the entries of a visit Topo folder into dataset buckets in one pass.
+        :param path_topo: visit Topo folder
+        :return: tuple of (datasets, opt_datasets, inst_datasets) dictionaries of lists of paths
+        """
+        buckets = {"datasets": {}, "opt_datasets": {}, "inst_datasets": {}}
+        for bucket, key, patterns, search_subfolders in TOPO_PATTERNS:
+            buckets[bucket][key] = []
+
+        entries = [(name, is_dir) for name, is_dir in self.list_dir(path_topo) if not name.startswith(".")]
+        for name, is_dir in entries:
+            self._classify(buckets, path_topo, name, False)
+        for name, is_dir in entries:
+            if is_dir and not any(fnmatch(name, pattern) for pattern in DATASET_FOLDER_PATTERNS):
+                path_sub = os.path.join(path_topo, name)
+                for sub_name, sub_is_dir in self.list_dir(path_sub):
+                    if not sub_name.startswith("."):
+                        self._classify(buckets, path_sub, sub_name, True)
+
+        opt_datasets = buckets["opt_datasets"]
+        inst_datasets = buckets["inst_datasets"]
+        opt_datasets["InstrumentFiles_JOBorMJF"] = inst_datasets["InstrumentFiles_MJF"] + \
+                                                   inst_datasets["InstrumentFiles_JOB"]
+        return buckets["datasets"], opt_datasets, inst_datasets
+
+    def signature(self, path_topo, rewalk=False):
+        """
+        Modified times of a Topo folder and its sub folders, and the sizes and modified times of its files and of the
+        files in its dataset folders (geodatabases and TINs, without geodatabase lock files, as visit_fingerprint).
+        Changes while a visit is being uploaded, or while its datasets are edited in place.
+
+        The files are only walked again if the modified time of the Topo folder or of one of its sub folders has
+        changed (arcpy creates and removes lock files in a geodatabase folder while it is edited), or with rewalk.
+        :param rewalk: walk the files even if the folders are unchanged (i.e. while a visit is settling)
+        """
+        folders = []
+        for name, is_dir in [(".", True)] + self.list_dir(path_topo):
+            if is_dir:
+                try:
+                    folders.append((name, os.stat(os.path.join(path_topo, name)).st_mtime))
+                except OSError:
+                    continue
+        cached = self.signatures.get(path_topo)
+        if cached is not None and cached[0] == folders and not rewalk:
+            return cached[1]
+        signature = list(folders)
+        for name, is_dir in self.list_dir(path_topo):
+            path = os.path.join(path_topo, name)
+            if not is_dir:
+                files = [(name, path)]
+            elif any(fnmatch(name, pattern) for pattern in DATASET_FOLDER_PATTERNS):
+                files = [(os.path.join(name, os.path.relpath(file_path, path)), file_path)
+                         for file_path in visit_fingerprint.dataset_files(path)]
+            else:
+                continue
+            for file_name, file_path in files:
+                try:
+                    stat = os.stat(file_path)
+                except OSError:
+                    continue
+                signature.append((file_name, stat.st_mtime, stat.st_size))
+        self.signatures[path_topo] = (folders, signature)
+        return signature
+
+    @staticmethod
+    def _classify(buckets, folder, name, in_subfolder):
+        for bucket, key, patterns, search_subfolders in TOPO_PATTERNS:
+            if (search_subfolders or not in_subfolder) and any(fnmatch(name, pattern) for pattern in patterns):
+                buckets[bucket][key].append(os.path.join(folder, name))
+
+    def save(self):
+        if self.index_file and self.changed:
+            with open(self.index_file, "w") as f:
+                json.dump(self.listings, f)
+            self.changed = False
@@ -0,0 +1,172 @@
+"""
+    Shared visit queue for running the batch export from several nodes against the same archive.
+
+    Visits are enqueued in an ExportJobs table of a shared SQLite database. Each node claims one visit at a time
+    with a lease, renews the lease while the visit is exported, and marks the visit with the SurveyExports status
+    (Success, Error, Exception, Warning) when done. Claims whose lease has expired (i.e. the node crashed) are
+    claimed again by another node, and marked Failed once they have used all their attempts. A node that loses its
+    lease (see LeaseKeeper) stops exporting the visit.
+
+    The database is opened with the default rollback journal (not WAL), since WAL does not work across network
+    shares.
+"""
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+QUEUED = "Queued"
+CLAIMED = "Claimed"
+FAILED = "Failed"  # lease expired on the last attempt
+FAILED_STATUSES = ["Error", "Exception", FAILED]
+LEASE_SECONDS = 600
+MAX_ATTEMPTS = 3
+
+
+def node_name():
+    return "{}:{}".format(socket.gethostname(), os.getpid())
+
+
+class WorkQueue(object):
+
+    def __init__(self, db_path, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.conn = sqlite3.connect(db_path, timeout=120, isolation_level=None)
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS ExportJobs (year text,
+                                                                    watershed text,
+                                                                    site text,
+                                                                    visit text,
+                                                                    visit_data text,
+                                                                    cost real,
+                                                                    status text,
+                                                                    node text,
+                                                                    lease_expires real,
+                                                                    attempts integer,
+                                                                    timestamp text,
+                                                                    message text,
+                                                                    PRIMARY KEY (year, watershed, site, visit))''')
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_ExportJobs_status ON ExportJobs (status, cost)")
+
+    def enqueue(self, visits, requeue_failed=False):
+        """
+        Add visits to the queue. Visits already in the queue are left as they are, unless they failed and
+        requeue_failed is set.
+        :return: number of visits queued
+        """
+        count = 0
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            for visit_data in visits:
+                key = (visit_data["year"], visit_data["watershed"], visit_data["site"], str(visit_data["visit_id"]))
+                cursor = self.conn.execute("INSERT OR IGNORE INTO ExportJobs VALUES (?,?,?,?,?,?,?,NULL,NULL,0,?,NULL)",
+                                           key + (json.dumps(visit_data), visit_data.get("cost", 0.0), QUEUED,
+                                                  str(time.asctime())))
+                if cursor.rowcount == 0 and requeue_failed:
+                    cursor = self.conn.execute("UPDATE ExportJobs SET status=?, visit_data=?, attempts=0 "
+                                               "WHERE year=? AND watershed=? AND site=? AND visit=? AND status IN ({})".format(
+                                                   ",".join("?" * len(FAILED_STATUSES))),
+                                               (QUEUED, json.dumps(visit_data)) + key + tuple(FAILED_STATUSES))
+                count += cursor.rowcount
+            self.conn.execute("COMMIT")
+        except:
+            self.conn.execute("ROLLBACK")
+            raise
+        return count
+
+    def claim(self, node):
+        """
+        Claim the largest queued visit (or a visit whose lease has expired).
+        :return: tuple of (key, visit_data), or None if there is nothing left to claim.
+        """
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.conn.execute("UPDATE ExportJobs SET status=?, message=?, lease_expires=NULL, timestamp=? "
+                              "WHERE status=? AND lease_expires<? AND attempts>=?",
+                              (FAILED, "Lease expired on each of {} attempts".format(self.max_attempts),
+                               str(time.asctime()), CLAIMED, now, self.max_attempts))
+            row = self.conn.execute("SELECT year, watershed, site, visit, visit_data FROM ExportJobs "
+                                    "WHERE (status=? OR (status=? AND lease_expires<?)) AND attempts<? "
+                                    "ORDER BY cost DESC LIMIT 1",
+                                    (QUEUED, CLAIMED, now, self.max_attempts)).fetchone()
+            if row is None:
+                self.conn.execute("COMMIT")
+                return None
+            key = tuple(row[:4])
+            self.conn.execute("UPDATE ExportJobs SET status=?, node=?, lease_expires=?, attempts=attempts+1, timestamp=? "
+                              "WHERE year=? AND watershed=? AND site=? AND visit=?",
+                              (CLAIMED, node, now + self.lease_seconds, str(time.asctime())) + key)
+            self.conn.execute("COMMIT")
+        except:
+            self.conn.execute("ROLLBACK")
+            raise
+        return key, json.loads(row[4])
+
+    def renew(self, key, node):
+        """ extend the lease of a claimed visit. Returns False if the claim was lost to another node."""
+        cursor = self.conn.execute("UPDATE ExportJobs SET lease_expires=? "
+                                   "WHERE year=? AND watershed=? AND site=? AND visit=? AND status=? AND node=?",
+                                   (time.time() + self.lease_seconds,) + key + (CLAIMED, node))
+        return cursor.rowcount == 1
+
+    def complete(self, key, node, status, message=None):
+        """ mark a claimed visit with its export status (Success, Error, Exception or Warning)."""
+        self.conn.execute("UPDATE ExportJobs SET status=?, message=?, lease_expires=NULL, timestamp=? "
+                          "WHERE year=? AND watershed=? AND site=? AND visit=? AND node=?",
+                          (status, message, str(time.asctime())) + key + (node,))
+
+    def counts(self):
+        return dict(self.conn.execute("SELECT status, count(*) FROM ExportJobs GROUP BY status").fetchall())
+
+    def close(self):
+        self.conn.close()
+
+
+class LeaseLost(Exception):
+    """ raised in the main thread of a node whose lease on the visit it is exporting was lost"""
+
+
+class LeaseKeeper(threading.Thread):
+    """
+    Renews the lease of a claimed visit while it is exported. Uses its own connection to the queue database.
+
+    If the lease cannot be renewed (it expired and the visit was claimed by another node), lost is set and LeaseLost
+    is raised in the main thread (with thread.interrupt_main, which raises KeyboardInterrupt), so the node stops
+    exporting a visit that another node now exports.
+    """
+
+    def __init__(self, db_path, key, node, lease_seconds=LEASE_SECONDS):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.db_path = db_path
+        self.key = key
+        self.node = node
+        self.lease_seconds = lease_seconds
+        self.stopped = threading.Event()
+        self.lost = threading.Event()
+
+    def run(self):
+        import thread
+        queue = WorkQueue(self.db_path, self.lease_seconds)
+        try:
+            while not self.stopped.wait(self.lease_seconds / 3.0):
+                if not queue.renew(self.key, self.node):
+                    self.lost.set()
+                    if not self.stopped.is_set():
+                        thread.interrupt_main()
+                    break
+        finally:
+            queue.close()
+
+    def check(self):
+        """ raise LeaseLost if the lease was lost. Call on a KeyboardInterrupt in the main thread."""
+        if self.lost.is_set():
+            raise LeaseLost("Lease on visit {} lost to another node".format(self.key))
+
+    def stop(self):
+        self.stopped.set()
+        self.join()